@@ -0,0 +1,59 @@
+"""
+Checks that mining the compact embedding store finds the same pairs as float32, on
+synthetic embeddings, and times mining from the memory-mapped file.
+
+Usage:
+    python benchmarks/embedding_precision.py [--size 20000] [--dim 512] [--threshold 0.9]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.pair_extraction import make_embeddings  # noqa: E402
+from core.embedding_store import (  # noqa: E402
+    EMBEDDING_PRECISIONS,
+    EmbeddingStore,
+    compare_precisions,
+)
+from core.image_analyzer import ImageAnalyzer  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding precision benchmark")
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    args = parser.parse_args()
+
+    embeddings = make_embeddings(args.size, args.dim)
+    image_hashes = [f"{row:016x}" for row in range(args.size)]
+    print(f"{args.size} embeddings of dimension {args.dim}")
+    for precision in EMBEDDING_PRECISIONS:
+        with tempfile.TemporaryDirectory() as directory:
+            store = EmbeddingStore(precision=precision, directory=directory)
+            store.add(image_hashes, embeddings)
+            matrix, _ = store.matrix(image_hashes)
+            start_time = time.perf_counter()
+            scores, _, _ = ImageAnalyzer.mine_pair_indices(
+                matrix, similarity_threshold=args.threshold
+            )
+            mining_time = time.perf_counter() - start_time
+            file_size = os.path.getsize(store.data_path) * args.size // store.capacity
+            store.close()
+
+        result = compare_precisions(embeddings, precision, args.threshold)
+        print(
+            f"{precision:<8} {file_size / 1024**2:8.1f} MiB  "
+            f"mining {mining_time:6.2f} s, {len(scores)} pairs  "
+            f"recall {result['recall']:.5f}  precision {result['precision']:.5f}  "
+            f"max score error {result['max_score_error']:.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Compares the per-pair Python loop formerly used to extract similar pairs with the
+vectorized extraction of ImageAnalyzer.mine_pair_indices, on synthetic embeddings.
+
+Usage:
+    python benchmarks/pair_extraction.py [--size 20000] [--dim 512] [--threshold 0.9]
+"""
+
+import argparse
+import heapq
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.image_analyzer import ImageAnalyzer  # noqa: E402
+
+
+def make_embeddings(size: int, dim: int, seed: int = 0) -> np.ndarray:
+    """Random embeddings where a fifth of the rows are noisy copies of other rows."""
+    rng = np.random.default_rng(seed)
+    unique_size = size - size // 5
+    embeddings = rng.standard_normal((size, dim), dtype=np.float32)
+    sources = rng.integers(0, unique_size, size // 5)
+    embeddings[unique_size:] = embeddings[sources] + 0.2 * rng.standard_normal(
+        (size // 5, dim), dtype=np.float32
+    )
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings
+
+
+def loop_pair_extraction(
+    embeddings: np.ndarray,
+    top_k: int,
+    max_pairs: int,
+    query_chunk_size: int,
+    corpus_chunk_size: int,
+    similarity_threshold: float,
+) -> list[tuple[float, int, int]]:
+    """The previous extraction, one Python iteration and heap push per candidate."""
+    pairs: list[tuple[float, int, int]] = []
+    total_embeddings = len(embeddings)
+    for corpus_start_idx in range(0, total_embeddings, corpus_chunk_size):
+        corpus_embeddings = embeddings[
+            corpus_start_idx : corpus_start_idx + corpus_chunk_size
+        ]
+        for query_start_idx in range(0, total_embeddings, query_chunk_size):
+            query_embeddings = embeddings[
+                query_start_idx : query_start_idx + query_chunk_size
+            ]
+            scores = query_embeddings @ corpus_embeddings.T
+            if not (scores >= similarity_threshold).any():
+                continue
+            k = min(top_k, scores.shape[1])
+            top_k_idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_k_values = np.take_along_axis(scores, top_k_idx, axis=1)
+            for query_itr, (values, indices) in enumerate(zip(top_k_values, top_k_idx)):
+                i = query_start_idx + query_itr
+                for score, j in zip(values, indices):
+                    j = corpus_start_idx + int(j)
+                    if i < j and score >= similarity_threshold:
+                        heapq.heappush(pairs, (float(score), i, j))
+                        if len(pairs) > max_pairs:
+                            heapq.heappop(pairs)
+    return sorted(pairs, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pair extraction benchmark")
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--top-k", type=int, default=100)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--max-pairs", type=int, default=500000)
+    parser.add_argument("--query-chunk-size", type=int, default=5000)
+    parser.add_argument("--corpus-chunk-size", type=int, default=100000)
+    args = parser.parse_args()
+
+    embeddings = make_embeddings(args.size, args.dim)
+    options = dict(
+        top_k=args.top_k,
+        max_pairs=args.max_pairs,
+        query_chunk_size=args.query_chunk_size,
+        corpus_chunk_size=args.corpus_chunk_size,
+        similarity_threshold=args.threshold,
+    )
+
+    # Both implementations share the block matrix products, time them on their own
+    start_time = time.perf_counter()
+    for start in range(0, args.size, args.query_chunk_size):
+        embeddings[start : start + args.query_chunk_size] @ embeddings.T
+    matmul_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    loop_pairs = loop_pair_extraction(embeddings, **options)
+    loop_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    scores, i_indices, j_indices = ImageAnalyzer.mine_pair_indices(
+        embeddings, **options
+    )
+    vectorized_time = time.perf_counter() - start_time
+
+    same_pairs = {(i, j) for _, i, j in loop_pairs} == set(
+        zip(i_indices.tolist(), j_indices.tolist())
+    )
+    print(f"{args.size} embeddings, {len(scores)} pairs above {args.threshold}")
+    print(f"similarity: {matmul_time:8.2f} s")
+    print(
+        f"loop:       {loop_time:8.2f} s, "
+        f"{max(loop_time - matmul_time, 0):8.2f} s extracting pairs"
+    )
+    print(
+        f"vectorized: {vectorized_time:8.2f} s, "
+        f"{max(vectorized_time - matmul_time, 0):8.2f} s extracting pairs"
+    )
+    print(f"same pairs: {same_pairs}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Times exact mining with an increasing number of processes on synthetic embeddings,
+and checks that every run finds the same pairs as mining in a single process.
+
+Usage:
+    python benchmarks/parallel_mining.py [--size 50000] [--dim 512] [--top-k 100] [--workers 1 2 4 8]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.pair_extraction import make_embeddings  # noqa: E402
+from core.image_analyzer import ImageAnalyzer  # noqa: E402
+from core.parallel_mining import mine_pair_indices_parallel  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel mining benchmark")
+    parser.add_argument("--size", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--top-k", type=int, default=100)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    embeddings = make_embeddings(args.size, args.dim)
+    options = dict(top_k=args.top_k, similarity_threshold=args.threshold)
+
+    start_time = time.perf_counter()
+    _, i_indices, j_indices = ImageAnalyzer.mine_pair_indices(embeddings, **options)
+    serial_time = time.perf_counter() - start_time
+    serial_pairs = set(zip(i_indices.tolist(), j_indices.tolist()))
+    print(f"{args.size} embeddings, {len(serial_pairs)} pairs above {args.threshold}")
+    print(f"serial:      {serial_time:8.2f} s")
+
+    for workers in args.workers:
+        start_time = time.perf_counter()
+        _, i_indices, j_indices = mine_pair_indices_parallel(
+            embeddings, workers=workers, **options
+        )
+        parallel_time = time.perf_counter() - start_time
+        same_pairs = serial_pairs == set(zip(i_indices.tolist(), j_indices.tolist()))
+        print(
+            f"{workers:3d} workers: {parallel_time:8.2f} s, "
+            f"speedup {serial_time / parallel_time:5.2f}x, same pairs: {same_pairs}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares coarse-to-fine PCA mining with exact mining on synthetic embeddings, for a
+few margins below the threshold: mining time and recall of the exact pairs.
+
+Random isotropic embeddings have no principal components worth keeping, so the
+embeddings are drawn from a low-rank subspace with some noise, like image
+embeddings that concentrate their energy in a few components.
+
+Usage:
+    python benchmarks/pca_mining.py [--size 50000] [--dim 512] [--rank 48] [--margins 0.05 0.1 0.2]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.image_analyzer import ImageAnalyzer  # noqa: E402
+from core.pca_projection import PCA_DIMENSIONS, PcaProjection  # noqa: E402
+
+
+def make_structured_embeddings(
+    size: int, dim: int, rank: int, seed: int = 0
+) -> np.ndarray:
+    """Low-rank embeddings with noise, where a fifth of the rows are noisy copies of other rows."""
+    rng = np.random.default_rng(seed)
+    basis = rng.standard_normal((rank, dim), dtype=np.float32)
+    embeddings = rng.standard_normal((size, rank), dtype=np.float32) @ basis
+    embeddings += 0.5 * rng.standard_normal((size, dim), dtype=np.float32)
+    unique_size = size - size // 5
+    sources = rng.integers(0, unique_size, size // 5)
+    embeddings[unique_size:] = embeddings[sources] + 0.1 * np.linalg.norm(
+        embeddings[sources], axis=1, keepdims=True
+    ) / np.sqrt(dim) * rng.standard_normal((size // 5, dim), dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PCA mining benchmark")
+    parser.add_argument("--size", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--rank", type=int, default=48)
+    parser.add_argument("--dimensions", type=int, default=PCA_DIMENSIONS)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--margins", type=float, nargs="+", default=[0.05, 0.1, 0.2])
+    args = parser.parse_args()
+
+    embeddings = make_structured_embeddings(args.size, args.dim, args.rank)
+    options = dict(top_k=100, similarity_threshold=args.threshold)
+
+    start_time = time.perf_counter()
+    _, i_indices, j_indices = ImageAnalyzer.mine_pairs(embeddings, **options)
+    exact_time = time.perf_counter() - start_time
+    exact_pairs = set(zip(i_indices.tolist(), j_indices.tolist()))
+    print(f"{args.size} embeddings, {len(exact_pairs)} pairs above {args.threshold}")
+    print(f"exact:        {exact_time:8.2f} s")
+
+    start_time = time.perf_counter()
+    projection = PcaProjection.fit(embeddings, args.dimensions)
+    print(
+        f"PCA fit:      {time.perf_counter() - start_time:8.2f} s, "
+        f"{args.dimensions} components keep {projection.explained_variance:.1%} of the energy"
+    )
+    for margin in args.margins:
+        start_time = time.perf_counter()
+        _, i_indices, j_indices = ImageAnalyzer.mine_pairs(
+            embeddings,
+            mining="pca",
+            projection=projection,
+            pca_margin=margin,
+            **options,
+        )
+        pca_time = time.perf_counter() - start_time
+        pca_pairs = set(zip(i_indices.tolist(), j_indices.tolist()))
+        recall = len(pca_pairs & exact_pairs) / len(exact_pairs) if exact_pairs else 1.0
+        print(
+            f"margin {margin:4.2f}:  {pca_time:8.2f} s, "
+            f"speedup {exact_time / pca_time:5.2f}x, recall {recall:.5f}, "
+            f"false pairs {len(pca_pairs - exact_pairs)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Measures how long the CLI takes to start, and fails when it regresses.
+
+Each command runs in a fresh interpreter from the repository root. The script exits
+with a non-zero status when the median time of a command exceeds its budget, or when
+importing the core package loads one of the heavy dependencies that should only be
+imported by the stage that needs them.
+
+Usage:
+    python benchmarks/startup_time.py [--runs 5] [--budget 1.0]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("torch", "sentence_transformers", "chromadb", "brisque", "cv2")
+
+COMMANDS = {
+    "cli --help": [sys.executable, "-m", "snap_sweeper_cli", "-h"],
+    "cli argument error": [sys.executable, "-m", "snap_sweeper_cli", "--top-k", "x"],
+    "import core": [
+        sys.executable,
+        "-c",
+        "import core.find_and_move_similar_images",
+    ],
+}
+
+CHECK_HEAVY_IMPORTS = f"""
+import sys
+import core.find_and_move_similar_images
+loaded = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+print(",".join(loaded))
+"""
+
+
+def time_command(command: list[str], runs: int) -> float:
+    durations: list[float] = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        subprocess.run(
+            command,
+            cwd=REPO_ROOT,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        durations.append(time.perf_counter() - start_time)
+    return statistics.median(durations)
+
+
+def find_heavy_imports() -> list[str]:
+    output = subprocess.run(
+        [sys.executable, "-c", CHECK_HEAVY_IMPORTS],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    return [name for name in output.split(",") if name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLI startup time benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per command.")
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=1.0,
+        help="Maximum median time of each command in seconds.",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for name, command in COMMANDS.items():
+        duration = time_command(command, args.runs)
+        status = "ok" if duration <= args.budget else "SLOW"
+        failed |= duration > args.budget
+        print(f"{name:<20} {duration * 1000:8.1f} ms  {status}")
+
+    heavy_imports = find_heavy_imports()
+    if heavy_imports:
+        failed = True
+        print(f"Importing core loads heavy modules: {', '.join(heavy_imports)}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
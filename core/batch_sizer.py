@@ -0,0 +1,128 @@
+import re
+from contextlib import contextmanager
+from threading import Lock
+
+import psutil
+
+INITIAL_BATCH_SIZE = 32
+MIN_BATCH_SIZE = 1
+MAX_BATCH_SIZE = 1024
+# Share of the system memory used as budget when none is given
+DEFAULT_MEMORY_FRACTION = 0.5
+# Lower bound of the memory held per image in a batch: a downsampled RGB image,
+# its copy sent back by the decoder and the encoder activations
+MIN_IMAGE_BYTES = 256 * 1024
+# Share of the remaining headroom a single batch may grow into
+HEADROOM_FRACTION = 0.5
+
+MEMORY_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_memory_size(value: str) -> int:
+    """
+    Parses a memory size such as "512M", "4G" or "1.5GB" into bytes.
+
+    Parameters:
+        value (str): The memory size, a number optionally followed by K, M, G or T.
+
+    Returns:
+        int: The size in bytes.
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*", value, re.I)
+    if match is None:
+        raise ValueError(f"Invalid memory size: {value!r}")
+    number, unit = match.groups()
+    return int(float(number) * MEMORY_UNITS[unit.upper()])
+
+
+class AdaptiveBatchSizer:
+    """
+    Sizes embedding batches so the process stays within a memory budget.
+
+    The resident memory of the process and its decoder workers is sampled while
+    each batch is processed. The growth of the peak over the memory held before the
+    batch gives the cost of an image, and the next batch is sized to fit in part of
+    the headroom left under the budget. Batches shrink as soon as a peak exceeds
+    the budget.
+
+    Parameters:
+        max_memory (int | None): The memory budget in bytes. Default is half of the system memory.
+        batch_size (int | None): A fixed batch size, disables the adaptive sizing.
+        initial_batch_size (int): The size of the first batch.
+        min_batch_size (int): The smallest batch size.
+        max_batch_size (int): The largest batch size.
+    """
+
+    def __init__(
+        self,
+        max_memory: int | None = None,
+        batch_size: int | None = None,
+        initial_batch_size: int = INITIAL_BATCH_SIZE,
+        min_batch_size: int = MIN_BATCH_SIZE,
+        max_batch_size: int = MAX_BATCH_SIZE,
+    ):
+        self.process = psutil.Process()
+        self.max_memory = max_memory or int(
+            psutil.virtual_memory().total * DEFAULT_MEMORY_FRACTION
+        )
+        self.fixed_batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.batch_size = batch_size or initial_batch_size
+        self.image_bytes = float(MIN_IMAGE_BYTES)
+        self.lock = Lock()
+        self.peak_rss = 0
+
+    def get_rss(self) -> int:
+        """Returns the resident memory of the process and its child processes."""
+        rss = self.process.memory_info().rss
+        for child in self.process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                continue
+        return rss
+
+    def sample(self):
+        """Records the current resident memory, call it where a batch peaks."""
+        rss = self.get_rss()
+        with self.lock:
+            self.peak_rss = max(self.peak_rss, rss)
+
+    def next_batch_size(self) -> int:
+        return self.batch_size
+
+    @contextmanager
+    def measure(self, batch_size: int):
+        """
+        Measures the memory used while a batch of the given size is processed, and
+        adjusts the size of the next batch accordingly.
+        """
+        rss_before = self.get_rss()
+        with self.lock:
+            self.peak_rss = rss_before
+        yield
+        self.sample()
+        self._update(batch_size, rss_before, self.peak_rss)
+
+    def _update(self, batch_size: int, rss_before: int, peak_rss: int):
+        if self.fixed_batch_size is not None or batch_size == 0:
+            return
+
+        # Freed memory is often kept by the allocator and reused by the next batch,
+        # so a single measurement can only raise the estimate that much
+        measured_image_bytes = max(peak_rss - rss_before, 0) / batch_size
+        self.image_bytes = max(
+            MIN_IMAGE_BYTES, (self.image_bytes + measured_image_bytes) / 2
+        )
+
+        if peak_rss > self.max_memory:
+            next_batch_size = int(batch_size * self.max_memory / peak_rss) // 2
+        else:
+            headroom = (self.max_memory - peak_rss) * HEADROOM_FRACTION
+            next_batch_size = min(
+                batch_size * 2, batch_size + int(headroom / self.image_bytes)
+            )
+        self.batch_size = max(
+            self.min_batch_size, min(self.max_batch_size, next_batch_size)
+        )
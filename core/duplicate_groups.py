@@ -0,0 +1,199 @@
+from collections import deque
+from typing import NamedTuple
+
+
+class DuplicateGroup(NamedTuple):
+    """
+    A set of near-identical images: the best one to keep and the others to discard.
+
+    Parameters:
+        keeper (str): The path of the image with the best quality score.
+        discards (list[str]): The paths of the other images, best quality first.
+        quality_scores (dict[str, float]): The quality score of every member.
+        similarity (float): The lowest similarity of the pairs joining the group.
+    """
+
+    keeper: str
+    discards: list[str]
+    quality_scores: dict[str, float]
+    similarity: float
+
+    @classmethod
+    def from_pair(
+        cls, result: tuple[str, str, float, float, float]
+    ) -> "DuplicateGroup":
+        best, worst, best_score, worst_score, similarity = result
+        return cls(best, [worst], {best: best_score, worst: worst_score}, similarity)
+
+    def to_pairs(self) -> list[tuple[str, str, float, float, float]]:
+        """Returns the group as (keeper, discard, scores, similarity) comparison results."""
+        return [
+            (
+                self.keeper,
+                discard,
+                self.quality_scores[self.keeper],
+                self.quality_scores[discard],
+                self.similarity,
+            )
+            for discard in self.discards
+        ]
+
+
+class UnionFind:
+    """
+    Disjoint sets of paths with union by size and path halving.
+
+    Each set also keeps the graph of the pairs that joined it, to bound its diameter:
+    the largest number of pairs separating two of its members.
+    """
+
+    def __init__(self):
+        self.parent: dict[str, str] = {}
+        self.size: dict[str, int] = {}
+        self.diameter: dict[str, int] = {}
+        self.similarity: dict[str, float] = {}
+        self.neighbours: dict[str, list[str]] = {}
+
+    def add(self, item: str):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+            self.diameter[item] = 0
+            self.similarity[item] = 1.0
+            self.neighbours[item] = []
+
+    def find(self, item: str) -> str:
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def _eccentricity(self, item: str) -> int:
+        distances = {item: 0}
+        pending = deque([item])
+        while pending:
+            current = pending.popleft()
+            for neighbour in self.neighbours[current]:
+                if neighbour not in distances:
+                    distances[neighbour] = distances[current] + 1
+                    pending.append(neighbour)
+        return max(distances.values())
+
+    def union(
+        self,
+        item1: str,
+        item2: str,
+        similarity: float,
+        max_diameter: int | None = None,
+    ) -> bool:
+        """
+        Joins the sets of two items linked by a pair of the given similarity.
+
+        Sets are only joined when the diameter of the result stays within
+        `max_diameter`, which keeps chains of slightly different images apart. A set is
+        a tree when it is joined, so its diameter is the largest of both diameters and
+        of the longest path through the new pair. Pairs within a set only shorten
+        paths, so the stored diameter is an upper bound.
+
+        Returns:
+            bool: Whether the pair is now part of a set.
+        """
+        self.add(item1)
+        self.add(item2)
+        root1, root2 = self.find(item1), self.find(item2)
+        if root1 == root2:
+            self.neighbours[item1].append(item2)
+            self.neighbours[item2].append(item1)
+            return True
+
+        diameter = max(self.diameter[root1], self.diameter[root2])
+        if max_diameter is not None:
+            diameter = max(
+                diameter, self._eccentricity(item1) + 1 + self._eccentricity(item2)
+            )
+            if diameter > max_diameter:
+                return False
+
+        if self.size[root1] < self.size[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.size[root1] += self.size[root2]
+        self.diameter[root1] = diameter
+        self.similarity[root1] = min(
+            self.similarity[root1], self.similarity[root2], similarity
+        )
+        self.neighbours[item1].append(item2)
+        self.neighbours[item2].append(item1)
+        return True
+
+    def groups(self) -> list[tuple[list[str], float]]:
+        """Returns the members of every set with more than one item, and their similarity."""
+        members: dict[str, list[str]] = {}
+        for item in self.parent:
+            members.setdefault(self.find(item), []).append(item)
+        return sorted(
+            (sorted(items), self.similarity[root])
+            for root, items in members.items()
+            if len(items) > 1
+        )
+
+
+def group_pairs(
+    pairs: list[tuple[float, str, str]],
+    threshold: float = 0.0,
+    max_diameter: int | None = None,
+) -> list[tuple[list[str], float]]:
+    """
+    Collapses pairs of near duplicates into connected groups.
+
+    Pairs are joined from the most to the least similar, so that a diameter limit
+    keeps the tightest groups together.
+
+    Parameters:
+        pairs (list[tuple[float, str, str]]): Tuples of similarity score and the paths of the two images.
+        threshold (float): The minimum similarity of a pair joining two images.
+        max_diameter (int | None): The largest number of pairs between two members of a group, None for no limit.
+
+    Returns:
+        list[tuple[list[str], float]]: The members of each group and the lowest similarity of the pairs joining them.
+    """
+    union_find = UnionFind()
+    for similarity, img1_path, img2_path in sorted(pairs, reverse=True):
+        if similarity >= threshold:
+            union_find.union(img1_path, img2_path, similarity, max_diameter)
+    return union_find.groups()
+
+
+def add_exact_copies(
+    groups: list[tuple[list[str], float]], exact_groups: list[list[str]]
+) -> list[tuple[list[str], float]]:
+    """
+    Adds the identical copies of each member to its group of near duplicates.
+
+    Only the representative of identical files takes part in the similarity search,
+    so its copies join whichever group it ended up in, and groups of identical files
+    without near duplicates become groups of their own.
+
+    Parameters:
+        groups (list[tuple[list[str], float]]): The members of each group and their similarity.
+        exact_groups (list[list[str]]): Groups of identical image paths, representative first.
+
+    Returns:
+        list[tuple[list[str], float]]: The groups including every identical copy.
+    """
+    copies = {group[0]: group[1:] for group in exact_groups}
+    grouped_paths = {path for members, _similarity in groups for path in members}
+    merged_groups = [
+        (
+            sorted(
+                members + [copy for path in members for copy in copies.get(path, [])]
+            ),
+            similarity,
+        )
+        for members, similarity in groups
+    ]
+    merged_groups += [
+        (group, 1.0) for group in exact_groups if group[0] not in grouped_paths
+    ]
+    return merged_groups
@@ -0,0 +1,283 @@
+import os
+from abc import ABC, abstractmethod
+from typing import Any
+
+import numpy as np
+from PIL import Image
+
+from .image_loader import CLIP_INPUT_SIZE, ImageDecoder
+from .utils import get_database_path
+
+MODEL_NAME = "clip-ViT-B-32"
+MODELS_DIR_NAME = "models"
+ONNX_BATCH_SIZE = 32
+
+# Normalization constants of the CLIP image processor
+CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+
+
+class EmbeddingBackend(ABC):
+    """
+    Base class of the image encoders used to embed images.
+
+    Every backend produces embeddings in the same CLIP space, so they can be used
+    interchangeably on an existing index.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def encode_images(self, images: list[Image.Image]) -> list[list[float]]:
+        """Returns the embedding of each image."""
+
+
+class TorchClipBackend(EmbeddingBackend):
+    """Encodes images with the sentence-transformers CLIP model on PyTorch."""
+
+    name = "torch"
+
+    def __init__(self, model_name: str = MODEL_NAME):
+        from sentence_transformers import SentenceTransformer, util
+
+        self.model = SentenceTransformer(model_name, device=util.get_device_name())
+
+    def encode_images(self, images: list[Image.Image]) -> list[list[float]]:
+        embeddings: Any = self.model.encode(images, convert_to_numpy=True)  # type: ignore
+        return embeddings.tolist()
+
+
+def preprocess_clip_images(
+    images: list[Image.Image], size: int = CLIP_INPUT_SIZE
+) -> np.ndarray:
+    """
+    Applies the CLIP image processor transforms without depending on transformers.
+
+    Images are resized so their shortest side is `size`, center cropped to a square,
+    scaled to [0, 1] and normalized with the CLIP mean and standard deviation.
+
+    Parameters:
+        images (list[Image.Image]): The images to preprocess.
+        size (int): The encoder input resolution.
+
+    Returns:
+        np.ndarray: A float32 array of shape (batch, 3, size, size).
+    """
+    pixel_values = np.empty((len(images), 3, size, size), dtype=np.float32)
+    for i, image in enumerate(images):
+        image = image.convert("RGB")
+        width, height = image.size
+        if min(width, height) != size:
+            scale = size / min(width, height)
+            width, height = max(size, int(width * scale)), max(
+                size, int(height * scale)
+            )
+            image = image.resize((width, height), Image.Resampling.BICUBIC)
+        left, top = (width - size) // 2, (height - size) // 2
+        image = image.crop((left, top, left + size, top + size))
+        array = np.asarray(image, dtype=np.float32) / 255.0
+        pixel_values[i] = ((array - CLIP_MEAN) / CLIP_STD).transpose(2, 0, 1)
+    return pixel_values
+
+
+def get_onnx_model_path(model_name: str = MODEL_NAME, quantized: bool = False) -> str:
+    suffix = "-int8" if quantized else ""
+    return os.path.join(
+        get_database_path(), MODELS_DIR_NAME, f"{model_name}-vision{suffix}.onnx"
+    )
+
+
+def export_clip_vision_onnx(model_name: str, output_path: str):
+    """
+    Exports the vision tower and projection of the CLIP model to ONNX.
+
+    This needs PyTorch and sentence-transformers, but only once: the exported file is
+    reused by every later run.
+
+    Parameters:
+        model_name (str): The sentence-transformers CLIP model to export.
+        output_path (str): The path of the ONNX file to write.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    clip_model = SentenceTransformer(model_name, device="cpu")[0].model
+
+    class VisionTower(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.clip_model = clip_model
+
+        def forward(self, pixel_values):
+            features = self.clip_model.get_image_features(pixel_values=pixel_values)
+            # Newer transformers releases wrap the projected embeddings in an output
+            return getattr(features, "pooler_output", features)
+
+    print(f"Exporting {model_name} vision tower to ONNX...")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    dummy_input = torch.zeros(1, 3, CLIP_INPUT_SIZE, CLIP_INPUT_SIZE)
+    with torch.no_grad():
+        torch.onnx.export(
+            VisionTower().eval(),
+            (dummy_input,),
+            output_path,
+            input_names=["pixel_values"],
+            output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+            opset_version=17,
+        )
+
+
+def quantize_onnx_model(input_path: str, output_path: str):
+    """
+    Quantizes the weights of the matrix multiplications of an ONNX model to int8.
+
+    Parameters:
+        input_path (str): The path of the float32 ONNX model.
+        output_path (str): The path of the quantized ONNX model to write.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    print("Quantizing ONNX model to int8...")
+    quantize_dynamic(
+        input_path,
+        output_path,
+        op_types_to_quantize=["MatMul", "Gemm"],
+        weight_type=QuantType.QInt8,
+    )
+
+
+class OnnxClipBackend(EmbeddingBackend):
+    """
+    Encodes images with the CLIP vision tower on ONNX Runtime's CPU provider.
+
+    The model is exported from the PyTorch weights on first use, and optionally
+    quantized to int8 for a smaller resident footprint and higher throughput.
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, quantized: bool = False):
+        import onnxruntime as ort
+
+        self.name = "onnx-int8" if quantized else "onnx"
+        model_path = get_onnx_model_path(model_name, quantized)
+        if not os.path.exists(model_path):
+            float_model_path = get_onnx_model_path(model_name)
+            if not os.path.exists(float_model_path):
+                export_clip_vision_onnx(model_name, float_model_path)
+            if quantized:
+                quantize_onnx_model(float_model_path, model_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = os.cpu_count() or 4
+        self.session = ort.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"]
+        )
+
+    def encode_images(self, images: list[Image.Image]) -> list[list[float]]:
+        embeddings: list[list[float]] = []
+        for start in range(0, len(images), ONNX_BATCH_SIZE):
+            pixel_values = preprocess_clip_images(
+                images[start : start + ONNX_BATCH_SIZE]
+            )
+            (image_embeds,) = self.session.run(None, {"pixel_values": pixel_values})
+            embeddings.extend(image_embeds.tolist())
+        return embeddings
+
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def get_backend_index_name(name: str, backend_name: str) -> str:
+    """
+    Returns the name of an index of the embeddings of the given backend.
+
+    Each backend has its own embeddings, as vectors of another model or
+    quantization are not comparable. The torch indexes keep the names they had
+    before other backends existed.
+
+    Parameters:
+        name (str): The name of the index, a file name or a collection name.
+        backend_name (str): One of "torch", "onnx" or "onnx-int8".
+    """
+    if backend_name == "torch":
+        return name
+    root, extension = os.path.splitext(name)
+    return f"{root}-{backend_name}{extension}"
+
+
+def create_embedding_backend(name: str = "torch") -> EmbeddingBackend:
+    """
+    Creates the embedding backend with the given name.
+
+    Parameters:
+        name (str): One of "torch", "onnx" or "onnx-int8".
+
+    Returns:
+        EmbeddingBackend: The embedding backend.
+    """
+    if name == "torch":
+        return TorchClipBackend()
+    if name == "onnx":
+        return OnnxClipBackend()
+    if name == "onnx-int8":
+        return OnnxClipBackend(quantized=True)
+    raise ValueError(
+        f"Unknown embedding backend {name!r}, expected one of {EMBEDDING_BACKENDS}"
+    )
+
+
+def compare_backends(
+    reference: EmbeddingBackend,
+    candidate: EmbeddingBackend,
+    images: list[Image.Image],
+) -> np.ndarray:
+    """
+    Measures how closely a backend reproduces the embeddings of a reference backend.
+
+    Parameters:
+        reference (EmbeddingBackend): The backend to compare against, usually torch.
+        candidate (EmbeddingBackend): The backend to check.
+        images (list[Image.Image]): The images to embed with both backends.
+
+    Returns:
+        np.ndarray: The cosine similarity between both embeddings of each image.
+    """
+    reference_embeddings = np.asarray(reference.encode_images(images))
+    candidate_embeddings = np.asarray(candidate.encode_images(images))
+    reference_embeddings /= np.linalg.norm(reference_embeddings, axis=1, keepdims=True)
+    candidate_embeddings /= np.linalg.norm(candidate_embeddings, axis=1, keepdims=True)
+    return np.sum(reference_embeddings * candidate_embeddings, axis=1)
+
+
+def check_backend_parity(
+    image_paths: list[str], backend_name: str, sample_size: int = 32
+) -> np.ndarray:
+    """
+    Checks the embeddings of a backend against the torch reference on sample images.
+
+    Parameters:
+        image_paths (list[str]): The images to sample from.
+        backend_name (str): The name of the backend to check.
+        sample_size (int): The maximum number of images to embed.
+
+    Returns:
+        np.ndarray: The cosine similarity between both embeddings of each sampled image.
+    """
+    step = max(1, len(image_paths) // sample_size)
+    decoder = ImageDecoder()
+    images = [
+        image
+        for image in decoder.decode(image_paths[::step][:sample_size])
+        if image is not None
+    ]
+    decoder.close()
+
+    similarities = compare_backends(
+        TorchClipBackend(), create_embedding_backend(backend_name), images
+    )
+    print(
+        f"Parity of {backend_name} against torch on {len(images)} images: "
+        f"min cosine {similarities.min():.5f}, mean cosine {similarities.mean():.5f}"
+    )
+    return similarities
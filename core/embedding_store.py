@@ -0,0 +1,340 @@
+import os
+import sqlite3
+from threading import Lock
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from .embedding_backends import get_backend_index_name
+from .hash_cache import SQLITE_MAX_PARAMETERS
+from .utils import chunkify, get_database_path
+
+if TYPE_CHECKING:
+    from .pca_projection import PcaProjection
+
+EMBEDDING_PRECISIONS = ("float32", "float16", "int8")
+EMBEDDING_STORE_DIR_NAME = "embeddings"
+INITIAL_CAPACITY = 1024
+INT8_MAX = 127
+
+
+class EmbeddingMatrix:
+    """
+    A read-only view of rows of an embedding store, in a chosen order.
+
+    Indexing the view with a slice or an array of positions reads only those rows
+    from the memory-mapped file and returns them as float32, so mining code can
+    walk the matrix block by block without ever loading it whole.
+
+    Parameters:
+        data (np.ndarray): The stored rows, float32, float16 or int8.
+        scales (np.ndarray | None): The scale of each int8 row, None for float rows.
+        rows (np.ndarray): The store row of each position of the view.
+    """
+
+    def __init__(self, data: np.ndarray, scales: np.ndarray | None, rows: np.ndarray):
+        self.data = data
+        self.scales = scales
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.rows), self.data.shape[1]
+
+    def __getitem__(self, key) -> np.ndarray:
+        rows = self.rows[key]
+        # Memory-mapped files are read fastest in increasing offsets
+        order = np.argsort(rows, kind="stable")
+        block = np.empty((len(rows), self.data.shape[1]), dtype=np.float32)
+        block[order] = self.data[rows[order]]
+        if self.scales is not None:
+            block *= self.scales[rows][:, None]
+        return block
+
+    def select(self, positions: np.ndarray | list[int]) -> "EmbeddingMatrix":
+        """Returns a view of the given positions of this view, without reading them."""
+        return EmbeddingMatrix(self.data, self.scales, self.rows[positions])
+
+
+def quantize_embeddings(
+    embeddings: np.ndarray, precision: str
+) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    Converts L2-normalized float32 embeddings to the stored precision.
+
+    int8 rows are scaled so their largest component maps to 127, and the scale is
+    kept to restore them.
+
+    Returns:
+        tuple: The stored rows and the scale of each row, None unless int8.
+    """
+    if precision == "int8":
+        scales = np.maximum(np.abs(embeddings).max(axis=1), 1e-8) / INT8_MAX
+        quantized = np.rint(embeddings / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+    return embeddings.astype(precision), None
+
+
+class EmbeddingStore:
+    """
+    Compact on-disk matrix of L2-normalized image embeddings keyed by content hash.
+
+    The embeddings are appended to a memory-mapped file in float32, float16 or int8
+    with a scale per row, and a SQLite table maps each content hash to its row.
+    Mining reads the rows it needs straight from the mapped file, instead of
+    materializing every embedding from Chroma as Python lists.
+
+    Parameters:
+        precision (str): The stored precision, one of "float32", "float16" or "int8".
+        embedding_backend (str): The backend whose embeddings are stored.
+        directory (str | None): The directory of the store. Default is in the database directory.
+    """
+
+    def __init__(
+        self,
+        precision: str = "float16",
+        embedding_backend: str = "torch",
+        directory: str | None = None,
+    ):
+        if precision not in EMBEDDING_PRECISIONS:
+            raise ValueError(
+                f"Unknown embedding precision {precision!r}, expected one of {EMBEDDING_PRECISIONS}"
+            )
+        self.precision = precision
+        self.embedding_backend = embedding_backend
+        self.directory = directory or os.path.join(
+            get_database_path(),
+            get_backend_index_name(EMBEDDING_STORE_DIR_NAME, embedding_backend),
+            precision,
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        self.data_path = os.path.join(self.directory, "matrix.bin")
+        self.scales_path = os.path.join(self.directory, "scales.bin")
+        self.lock = Lock()
+        self.connection = sqlite3.connect(
+            os.path.join(self.directory, "index.sqlite3"), check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS rows (
+                hash TEXT PRIMARY KEY,
+                row INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            """
+        )
+        self.connection.commit()
+        meta = dict(self.connection.execute("SELECT key, value FROM meta").fetchall())
+        self.dim: int | None = meta.get("dim")
+        self.row_count: int = meta.get("row_count", 0)
+        self.capacity = 0
+        self.data: np.ndarray | None = None
+        self.scales: np.ndarray | None = None
+        if self.dim is not None:
+            self._map(max(self.row_count, INITIAL_CAPACITY))
+
+    def _map(self, capacity: int):
+        """Maps the files with room for `capacity` rows, growing them if needed."""
+        assert self.dim is not None
+        itemsize = np.dtype(self.precision).itemsize
+        for path, size in (
+            (self.data_path, capacity * self.dim * itemsize),
+            (self.scales_path, capacity * 4 if self.precision == "int8" else 0),
+        ):
+            if size == 0:
+                continue
+            with open(path, "ab") as file:
+                if file.tell() < size:
+                    file.truncate(size)
+        self.data = np.memmap(
+            self.data_path, dtype=self.precision, mode="r+", shape=(capacity, self.dim)
+        )
+        if self.precision == "int8":
+            self.scales = np.memmap(
+                self.scales_path, dtype=np.float32, mode="r+", shape=(capacity,)
+            )
+        self.capacity = capacity
+
+    def lookup_rows(self, image_hashes: list[str]) -> dict[str, int]:
+        """
+        Returns the row of each of the given content hashes that has an embedding.
+        """
+        results: dict[str, int] = {}
+        with self.lock:
+            for chunk in chunkify(image_hashes, chunk_size=SQLITE_MAX_PARAMETERS):
+                results.update(
+                    self.connection.execute(
+                        f"SELECT hash, row FROM rows WHERE hash IN ({', '.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                )
+        return results
+
+    def add(self, image_hashes: list[str], embeddings: list[list[float]] | np.ndarray):
+        """
+        Appends the embeddings of content hashes that are not stored yet.
+
+        Parameters:
+            image_hashes (list[str]): The content hash of each embedding.
+            embeddings (list[list[float]] | np.ndarray): The embeddings, normalized before they are stored.
+        """
+        existing_rows = self.lookup_rows(image_hashes)
+        new_hashes: dict[str, int] = {}
+        for position, image_hash in enumerate(image_hashes):
+            if image_hash not in existing_rows and image_hash not in new_hashes:
+                new_hashes[image_hash] = position
+        if not new_hashes:
+            return
+
+        vectors = np.asarray(embeddings, dtype=np.float32)[list(new_hashes.values())]
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-8)
+        quantized, scales = quantize_embeddings(vectors, self.precision)
+
+        with self.lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('dim', ?)",
+                    (self.dim,),
+                )
+                self._map(INITIAL_CAPACITY)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(
+                    f"Embeddings of dimension {vectors.shape[1]} do not fit a store of dimension {self.dim}"
+                )
+
+            start = self.row_count
+            end = start + len(quantized)
+            if end > self.capacity:
+                self._map(max(end, self.capacity * 2))
+            assert self.data is not None
+            self.data[start:end] = quantized
+            self.data.flush()
+            if self.scales is not None and scales is not None:
+                self.scales[start:end] = scales
+                self.scales.flush()
+
+            self.connection.executemany(
+                "INSERT INTO rows (hash, row) VALUES (?, ?)",
+                zip(new_hashes, range(start, end)),
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('row_count', ?)",
+                (end,),
+            )
+            self.connection.commit()
+            self.row_count = end
+
+    def matrix(self, image_hashes: list[str]) -> tuple[EmbeddingMatrix, list[str]]:
+        """
+        Returns a view of the embeddings of the given content hashes.
+
+        Parameters:
+            image_hashes (list[str]): The content hashes of the images.
+
+        Returns:
+            tuple: The view, and the content hash of each of its rows. Hashes without an embedding are left out.
+        """
+        rows = self.lookup_rows(image_hashes)
+        found_hashes = [image_hash for image_hash in image_hashes if image_hash in rows]
+        row_indices = np.array(
+            [rows[image_hash] for image_hash in found_hashes], dtype=np.int64
+        )
+        if self.data is None:
+            return (
+                EmbeddingMatrix(np.empty((0, 0), dtype=np.float32), None, row_indices),
+                found_hashes,
+            )
+        return EmbeddingMatrix(self.data, self.scales, row_indices), found_hashes
+
+    def projection(
+        self, embeddings: EmbeddingMatrix, dimensions: int | None = None
+    ) -> "PcaProjection":
+        """
+        Returns the PCA projection saved with the store, fitting it on the given
+        embeddings first if there is none yet or the library grew substantially.
+
+        Parameters:
+            embeddings (EmbeddingMatrix): The embeddings about to be mined.
+            dimensions (int | None): The number of components. Default is PCA_DIMENSIONS.
+        """
+        from .pca_projection import PCA_DIMENSIONS, PcaProjection
+
+        dimensions = dimensions or PCA_DIMENSIONS
+        path = os.path.join(self.directory, f"pca_{dimensions}.npz")
+        projection = PcaProjection.load(path)
+        if projection is None or projection.needs_refit(len(embeddings)):
+            print(
+                f"Fitting a {dimensions}-dimensional PCA on {len(embeddings)} embeddings..."
+            )
+            projection = PcaProjection.fit(embeddings, dimensions)
+            projection.save(path)
+            print(
+                f"The projection keeps {projection.explained_variance:.1%} of the embedding energy"
+            )
+        return projection
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def compare_precisions(
+    embeddings: np.ndarray,
+    precision: str,
+    similarity_threshold: float = 0.9,
+) -> dict[str, float]:
+    """
+    Measures how storing embeddings at a lower precision changes the mined pairs.
+
+    Parameters:
+        embeddings (np.ndarray): The float32 embeddings.
+        precision (str): The stored precision to check.
+        similarity_threshold (float): The minimum cosine similarity of a pair.
+
+    Returns:
+        dict[str, float]: The largest score error, and the share of the float32 pairs
+        found (recall) and of the pairs found that float32 also finds (precision).
+    """
+    from .image_analyzer import ImageAnalyzer
+
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-8)
+    quantized, scales = quantize_embeddings(vectors, precision)
+    restored = EmbeddingMatrix(quantized, scales, np.arange(len(vectors)))
+
+    reference = ImageAnalyzer.mine_pair_indices(
+        vectors, top_k=len(vectors), similarity_threshold=similarity_threshold
+    )
+    candidate = ImageAnalyzer.mine_pair_indices(
+        restored, top_k=len(vectors), similarity_threshold=similarity_threshold
+    )
+    reference_pairs = dict(
+        zip(zip(reference[1].tolist(), reference[2].tolist()), reference[0].tolist())
+    )
+    candidate_pairs = dict(
+        zip(zip(candidate[1].tolist(), candidate[2].tolist()), candidate[0].tolist())
+    )
+    common_pairs = reference_pairs.keys() & candidate_pairs.keys()
+    return {
+        "max_score_error": max(
+            (
+                abs(reference_pairs[pair] - candidate_pairs[pair])
+                for pair in common_pairs
+            ),
+            default=0.0,
+        ),
+        "recall": (
+            len(common_pairs) / len(reference_pairs) if reference_pairs else 1.0
+        ),
+        "precision": (
+            len(common_pairs) / len(candidate_pairs) if candidate_pairs else 1.0
+        ),
+    }
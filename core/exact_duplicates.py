@@ -0,0 +1,128 @@
+import asyncio
+import os
+from collections import defaultdict
+from typing import TYPE_CHECKING, Hashable, Mapping
+
+from .file_hasher import FileHasher, hash_file_head_tail
+from .utils import calculate_file_hashes, chunkify
+
+if TYPE_CHECKING:
+    from .hash_cache import HashCache
+
+
+def _group_by(values: Mapping[str, Hashable]) -> list[list[str]]:
+    groups: dict[Hashable, list[str]] = defaultdict(list)
+    for path, value in values.items():
+        groups[value].append(path)
+    return [sorted(paths) for paths in groups.values() if len(paths) > 1]
+
+
+async def _partial_hashes(
+    file_paths: list[str], max_workers: int | None = None
+) -> dict[str, str]:
+    loop = asyncio.get_running_loop()
+    results: dict[str, str] = {}
+    with FileHasher(max_workers=max_workers) as hasher:
+        for chunk in chunkify(file_paths, chunk_size=hasher.max_in_flight):
+            tasks = [
+                loop.run_in_executor(hasher.executor, hash_file_head_tail, path)
+                for path in chunk
+            ]
+            for path, partial_hash in zip(
+                chunk, await asyncio.gather(*tasks, return_exceptions=True)
+            ):
+                if isinstance(partial_hash, str):
+                    results[path] = partial_hash
+    return results
+
+
+async def find_exact_duplicates(
+    file_paths: list[str],
+    file_sizes: dict[str, int] | None = None,
+    max_workers: int | None = None,
+    hash_cache: "HashCache | None" = None,
+    verify: bool = False,
+) -> tuple[list[list[str]], dict[str, str]]:
+    """
+    Find groups of byte-identical files.
+
+    Files are narrowed down in three passes: by size, then by a partial hash of their
+    head and tail, and finally by their full content hash. Only files sharing a size
+    are ever partially read, and only files sharing a partial hash are fully read.
+
+    Files sharing a size whose full hash is in `hash_cache` are not read at all. The
+    other files of their size are fully hashed, their partial hash could not be
+    compared to the cached files without reading them.
+
+    Parameters:
+        file_paths (list[str]): The paths to the files.
+        file_sizes (dict[str, int] | None): Known file sizes, to avoid stat calls.
+        max_workers (int | None): Maximum number of worker threads.
+        hash_cache (HashCache | None): Persistent cache of previously computed hashes.
+        verify (bool): Whether to ignore cached hashes and re-read every file.
+
+    Returns:
+        tuple: The groups of identical files sorted by path, the first path of each
+            group being its representative, and the full hashes computed along the way.
+    """
+    if file_sizes is None:
+        loop = asyncio.get_running_loop()
+
+        def _stat_sizes() -> dict[str, int]:
+            sizes: dict[str, int] = {}
+            for path in file_paths:
+                try:
+                    sizes[path] = os.path.getsize(path)
+                except OSError:
+                    continue
+            return sizes
+
+        file_sizes = await loop.run_in_executor(None, _stat_sizes)
+
+    size_groups = _group_by(
+        {path: file_sizes[path] for path in file_paths if path in file_sizes}
+    )
+    size_candidates = [path for group in size_groups for path in group]
+    if not size_candidates:
+        return [], {}
+
+    cached_hashes: dict[str, str] = {}
+    if hash_cache is not None and not verify:
+        loop = asyncio.get_running_loop()
+        cached_hashes = await loop.run_in_executor(
+            None, hash_cache.lookup_many, size_candidates
+        )
+    # Sizes with a cached file are settled by full hashes
+    cached_sizes = {file_sizes[path] for path in cached_hashes}
+    uncached_paths = [path for path in size_candidates if path not in cached_hashes]
+    partial_paths = [
+        path for path in uncached_paths if file_sizes[path] not in cached_sizes
+    ]
+
+    partial_hashes = await _partial_hashes(partial_paths, max_workers=max_workers)
+    partial_candidates = [
+        path
+        for group in _group_by(
+            {
+                path: f"{file_sizes[path]}:{value}"
+                for path, value in partial_hashes.items()
+            }
+        )
+        for path in group
+    ]
+    full_hash_paths = [
+        path for path in uncached_paths if file_sizes[path] in cached_sizes
+    ] + partial_candidates
+
+    full_hashes = dict(cached_hashes)
+    if full_hash_paths:
+        full_hashes.update(
+            await calculate_file_hashes(
+                full_hash_paths,
+                max_workers=max_workers,
+                hash_cache=hash_cache,
+                verify=verify,
+            )
+        )
+    exact_groups = sorted(_group_by(full_hashes))
+    return exact_groups, full_hashes
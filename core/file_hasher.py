@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterable, AsyncIterator, Iterable
+
+READ_SIZE = 8 * 1024 * 1024
+HDD_CONCURRENCY = 2
+PARTIAL_HASH_BLOCK_SIZE = 64 * 1024
+
+# The read buffer of each hashing thread, allocated on its first file
+_thread_buffers = threading.local()
+
+
+def _get_read_buffer(read_size: int) -> bytearray:
+    buffer = getattr(_thread_buffers, "buffer", None)
+    if buffer is None or len(buffer) != read_size:
+        buffer = _thread_buffers.buffer = bytearray(read_size)
+    return buffer
+
+
+def hash_file(file_path: str, read_size: int = READ_SIZE) -> tuple[str, os.stat_result]:
+    """
+    Calculate the SHA-256 hash of a file's contents.
+
+    The file is read sequentially into a buffer reused by every file hashed on the
+    same thread.
+
+    Parameters:
+        file_path (str): The path to the file.
+        read_size (int): The number of bytes to read per call.
+
+    Returns:
+        tuple[str, os.stat_result]: The hex digest and the stat of the opened file.
+    """
+    hasher = hashlib.sha256()
+    buffer = _get_read_buffer(read_size)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as f:
+        stat = os.fstat(f.fileno())
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            read_bytes = f.readinto(buffer)
+            if not read_bytes:
+                break
+            hasher.update(view[:read_bytes])
+    return hasher.hexdigest(), stat
+
+
+def hash_file_head_tail(
+    file_path: str, block_size: int = PARTIAL_HASH_BLOCK_SIZE
+) -> str:
+    """
+    Calculate a cheap partial hash from the first and last blocks of a file.
+
+    Two files with different partial hashes cannot be identical, so this is used to
+    rule out candidates before reading them entirely.
+
+    Parameters:
+        file_path (str): The path to the file.
+        block_size (int): The number of bytes read from each end of the file.
+
+    Returns:
+        str: The hex digest of the head and tail blocks.
+    """
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        hasher.update(f.read(block_size))
+        size = os.fstat(f.fileno()).st_size
+        if size > block_size:
+            f.seek(max(block_size, size - block_size))
+            hasher.update(f.read(block_size))
+    return hasher.hexdigest()
+
+
+def is_rotational_device(device: int) -> bool:
+    """
+    Check whether a device is a spinning disk.
+
+    Only Linux exposes this information; every other platform is assumed to be
+    backed by solid state storage.
+
+    Parameters:
+        device (int): The device id, as reported by `os.stat().st_dev`.
+
+    Returns:
+        bool: True if the device is known to be rotational.
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+
+    block_path = f"/sys/dev/block/{os.major(device)}:{os.minor(device)}"
+    # Partitions do not have a queue of their own, it lives on the parent disk.
+    for queue_dir in ("queue", "../queue"):
+        try:
+            with open(os.path.join(block_path, queue_dir, "rotational")) as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return False
+
+
+async def _iterate_async(values: Iterable[str]) -> AsyncIterator[str]:
+    for value in values:
+        yield value
+
+
+class FileHasher:
+    """
+    Bounded worker pool hashing files with a fixed number of threads.
+
+    Paths are submitted lazily, so at most `max_in_flight` files are queued at any
+    time no matter how many are requested, and each device is limited to its own
+    number of concurrent readers so spinning disks are not thrashed by random reads.
+    """
+
+    def __init__(
+        self,
+        max_workers: int | None = None,
+        max_in_flight: int | None = None,
+        hdd_concurrency: int = HDD_CONCURRENCY,
+        ssd_concurrency: int | None = None,
+        read_size: int = READ_SIZE,
+    ):
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 4) * 2)
+        self.max_in_flight = max_in_flight or self.max_workers * 4
+        self.hdd_concurrency = hdd_concurrency
+        self.ssd_concurrency = ssd_concurrency or self.max_workers
+        self.read_size = read_size
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="file_hasher"
+        )
+        self._directory_devices: dict[str, int] = {}
+        self._device_semaphores: dict[int, asyncio.Semaphore] = {}
+
+    def _get_device(self, file_path: str) -> int:
+        directory = os.path.dirname(file_path)
+        device = self._directory_devices.get(directory)
+        if device is None:
+            try:
+                device = os.stat(directory or ".").st_dev
+            except OSError:
+                device = -1
+            self._directory_devices[directory] = device
+        return device
+
+    def _get_device_semaphore(self, device: int) -> asyncio.Semaphore:
+        semaphore = self._device_semaphores.get(device)
+        if semaphore is None:
+            rotational = device >= 0 and is_rotational_device(device)
+            semaphore = asyncio.Semaphore(
+                self.hdd_concurrency if rotational else self.ssd_concurrency
+            )
+            self._device_semaphores[device] = semaphore
+        return semaphore
+
+    async def _hash_one(self, file_path: str, results: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        semaphore = self._get_device_semaphore(self._get_device(file_path))
+        try:
+            async with semaphore:
+                file_hash, stat = await loop.run_in_executor(
+                    self.executor, hash_file, file_path, self.read_size
+                )
+            await results.put((file_path, file_hash, stat))
+        except Exception as e:
+            print(f"Skipping {file_path}: {e}")
+            await results.put(None)
+
+    async def hash_files(
+        self, file_paths: Iterable[str] | AsyncIterable[str]
+    ) -> AsyncIterator[tuple[str, str, os.stat_result]]:
+        """
+        Hash files as they are submitted and yield results in completion order.
+
+        Parameters:
+            file_paths (Iterable[str] | AsyncIterable[str]): The paths to the files, consumed lazily.
+
+        Yields:
+            tuple[str, str, os.stat_result]: The path, hash and stat of each file.
+        """
+        results: asyncio.Queue = asyncio.Queue()
+        in_flight = 0
+        tasks: set[asyncio.Task] = set()
+
+        if not isinstance(file_paths, AsyncIterable):
+            file_paths = _iterate_async(file_paths)
+
+        try:
+            async for file_path in file_paths:
+                task = asyncio.create_task(self._hash_one(file_path, results))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                in_flight += 1
+
+                # Backpressure: wait for a result before submitting more work
+                while in_flight >= self.max_in_flight:
+                    result = await results.get()
+                    in_flight -= 1
+                    if result is not None:
+                        yield result
+
+            while in_flight > 0:
+                result = await results.get()
+                in_flight -= 1
+                if result is not None:
+                    yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,8 +1,168 @@
+import asyncio
 import time
+from typing import AsyncIterator, Callable
 
-from .image_analyzer import ImageAnalyzer
+import numpy as np
+
+from .duplicate_groups import add_exact_copies, group_pairs
+from .exact_duplicates import find_exact_duplicates
+from .hash_cache import HashCache
+from .image_analyzer import ANN_EF, ImageAnalyzer, get_shared_image_analyzer
 from .image_quality_comparator import ImageQualityComparator
-from .utils import calculate_file_hashes, get_image_files, move_files_to_subdir
+from .pair_store import PairStore
+from .pair_table import PathTable, filter_pairs
+from .neighbour_graph import NeighbourGraphCache, get_graph_mining_settings
+from .pca_projection import PCA_MARGIN
+from .perceptual_hash import (
+    DEFAULT_MAX_DISTANCE,
+    calculate_perceptual_hashes,
+    find_perceptual_pairs,
+)
+from .pipeline import QUEUE_SIZE, run_indexing_pipeline
+from .scanner import ExclusionRules
+from .utils import (
+    calculate_file_hashes,
+    get_scanned_image_files,
+    move_files_to_subdir,
+)
+
+PERCEPTUAL_HASH_MODES = ("off", "prefilter", "only")
+
+
+async def hash_images_in_stages(
+    img_folder: str,
+    include_subdirs: bool,
+    exclusion_rules: ExclusionRules,
+    hash_cache: HashCache,
+    verify_hashes: bool,
+    hash_workers: int | None,
+) -> tuple[list[list[str]], dict[str, str]] | None:
+    """
+    Scan and hash the images one stage after the other.
+
+    Returns:
+        tuple | None: The groups of exact duplicates and the hashes of the images to mine, or None if no images were found.
+    """
+    scanned_files = await get_scanned_image_files(
+        img_folder, include_subdirs, exclusion_rules
+    )
+    image_files = [scanned_file.path for scanned_file in scanned_files]
+    print(f"Found {len(image_files)} image files")
+    if len(image_files) == 0:
+        return None
+
+    print("Looking for exact duplicates...")
+    exact_groups, candidate_hashes = await find_exact_duplicates(
+        image_files,
+        file_sizes={
+            scanned_file.path: scanned_file.size for scanned_file in scanned_files
+        },
+        max_workers=hash_workers,
+        hash_cache=hash_cache,
+        verify=verify_hashes,
+    )
+    exact_duplicates = {path for group in exact_groups for path in group[1:]}
+
+    # Only one representative per group of identical files is embedded and mined
+    unique_files = [path for path in image_files if path not in exact_duplicates]
+    path_to_hash_map = {
+        path: candidate_hashes[path]
+        for path in unique_files
+        if path in candidate_hashes
+    }
+    path_to_hash_map.update(
+        await calculate_file_hashes(
+            [path for path in unique_files if path not in path_to_hash_map],
+            max_workers=hash_workers,
+            hash_cache=hash_cache,
+            verify=verify_hashes,
+        )
+    )
+    return exact_groups, path_to_hash_map
+
+
+async def index_images_pipelined(
+    img_folder: str,
+    image_analyzer: ImageAnalyzer,
+    include_subdirs: bool,
+    exclusion_rules: ExclusionRules,
+    hash_cache: HashCache,
+    verify_hashes: bool,
+    hash_workers: int | None,
+    embed_workers: int,
+    queue_size: int,
+) -> tuple[list[list[str]], dict[str, str]] | None:
+    """
+    Scan, hash and index the images as overlapping pipeline stages.
+
+    Returns:
+        tuple | None: The groups of exact duplicates and the hashes of the images to mine, or None if no images were found.
+    """
+    hash_to_paths = await run_indexing_pipeline(
+        img_folder,
+        image_analyzer,
+        include_subdirs=include_subdirs,
+        exclusion_rules=exclusion_rules,
+        hash_cache=hash_cache,
+        verify_hashes=verify_hashes,
+        hash_workers=hash_workers,
+        embed_workers=embed_workers,
+        queue_size=queue_size,
+    )
+    print(f"Found {sum(map(len, hash_to_paths.values()))} image files")
+    if not hash_to_paths:
+        return None
+
+    exact_groups = sorted(
+        sorted(paths) for paths in hash_to_paths.values() if len(paths) > 1
+    )
+    path_to_hash_map = {
+        min(paths): image_hash for image_hash, paths in hash_to_paths.items()
+    }
+    return exact_groups, path_to_hash_map
+
+
+async def compare_pairs_as_mined(
+    image_quality_comparator: ImageQualityComparator,
+    exact_results_task: "asyncio.Task[list[tuple[str, str, float, float, float]]]",
+    pair_blocks: AsyncIterator[np.ndarray],
+    path_table: PathTable,
+    scanned_ids: np.ndarray,
+    on_results: Callable[[list[tuple[str, str, float, float, float]]], None] | None,
+) -> tuple[list[tuple[str, str, float, float, float]], int]:
+    """
+    Compares the quality of the near duplicate pairs block by block while they are
+    mined, and reports the results of each block as soon as it is scored.
+
+    Pairs of images missing from the scan are dropped before their paths are
+    materialized for scoring.
+
+    Returns:
+        tuple: The results, exact duplicates first, and the number of pairs found before the invalid pairs were removed.
+    """
+    found_pairs = 0
+
+    async def _valid_blocks():
+        nonlocal found_pairs
+        async for block in pair_blocks:
+            found_pairs += len(block)
+            yield path_table.to_tuples(filter_pairs(block, scanned_ids))
+
+    def _report_exact_results(task: asyncio.Task):
+        if on_results is not None and not task.cancelled() and task.exception() is None:
+            if exact_results := task.result():
+                on_results(exact_results)
+
+    # Exact duplicates are reported as soon as they are scored, during mining
+    exact_results_task.add_done_callback(_report_exact_results)
+    pair_results = []
+    async for block_results in image_quality_comparator.stream_image_quality_comparison(
+        _valid_blocks()
+    ):
+        pair_results += block_results
+        if on_results is not None:
+            on_results(block_results)
+    return await exact_results_task + pair_results, found_pairs
 
 
 async def find_and_move_similar_images(
@@ -13,6 +173,34 @@ async def find_and_move_similar_images(
     dry_run=False,
     sub_folder_name="DISCARDED",
     include_subdirs=True,
+    verify_hashes=False,
+    hash_workers: int | None = None,
+    exclude_patterns: list[str] | None = None,
+    skip_hidden_dirs=True,
+    max_depth: int | None = None,
+    pipelined=False,
+    embed_workers=1,
+    score_workers: int | None = None,
+    queue_size=QUEUE_SIZE,
+    decode_workers: int | None = None,
+    embedding_backend="torch",
+    batch_size: int | None = None,
+    max_memory: int | None = None,
+    embedding_precision="float16",
+    perceptual_hash="off",
+    perceptual_distance=DEFAULT_MAX_DISTANCE,
+    mining="exact",
+    ann_ef=ANN_EF,
+    ann_recall_sample=0,
+    pca_margin=PCA_MARGIN,
+    mining_workers: int | None = None,
+    group_duplicates=False,
+    max_group_diameter: int | None = None,
+    incremental_mining=True,
+    neighbour_graph=True,
+    on_results: (
+        Callable[[list[tuple[str, str, float, float, float]]], None] | None
+    ) = None,
 ):
     """
     Find and move similar images based on their similarity.
@@ -20,51 +208,271 @@ async def find_and_move_similar_images(
     Parameters:
         img_folder (str): The folder containing the images to process.
         limit (int): The maximum number of near duplicates to find. Default is None.
-        batch_size (int): The batch size to use for encoding images. Default is 32.
         top_k (int): The number of near duplicates to find. Default is 2.
         threshold (float): The similarity threshold for considering two images as near duplicates. Default is 0.9.
         dry_run (bool): Whether to run the process in dry run mode. Default is False.
+        verify_hashes (bool): Whether to re-read every file instead of trusting the hash cache. Default is False.
+        hash_workers (int): The number of threads used to hash files. Default is twice the CPU count.
+        exclude_patterns (list[str]): Glob patterns of directories to skip. The sweep sub-folder is always skipped.
+        skip_hidden_dirs (bool): Whether to skip hidden directories. Default is True.
+        max_depth (int): The maximum depth of subdirectories to scan. Default is None (no limit).
+        pipelined (bool): Whether to overlap scanning, hashing and embedding instead of running them one after the other. Default is False.
+        embed_workers (int): The number of embedding batches processed concurrently in pipelined mode. Default is 1.
+        score_workers (int): The maximum number of concurrent quality comparisons. Default is twice the CPU count.
+        queue_size (int): The capacity of the queues between pipeline stages. Default is 1024.
+        decode_workers (int): The number of processes decoding images for embedding. Default is the CPU count.
+        embedding_backend (str): The image encoder, one of "torch", "onnx" or "onnx-int8". Default is "torch".
+        batch_size (int): A fixed number of images per embedding batch. Default is None (sized from the memory budget).
+        max_memory (int): The memory budget in bytes used to size embedding batches. Default is half of the system memory.
+        embedding_precision (str): The precision of the memory-mapped embeddings read by mining, one of "float32", "float16" or "int8". Default is "float16".
+        perceptual_hash (str): "prefilter" to pair images by perceptual hash before CLIP, "only" to skip CLIP entirely. Default is "off".
+        perceptual_distance (int): The largest Hamming distance between perceptual hashes of near duplicates. Default is 6.
+        mining (str): "exact" for brute-force cosine mining, "ann" for approximate nearest neighbour mining, "pca" for candidates mined from PCA-reduced embeddings and re-ranked at full precision. Default is "exact".
+        ann_ef (int): The HNSW search breadth in ANN mode, higher is slower with better recall. Default is 50.
+        ann_recall_sample (int): The number of images whose ANN or PCA pairs are checked against exact mining, 0 to skip. Default is 0.
+        pca_margin (float): How far below the threshold candidates are searched in PCA mode, larger is slower with better recall. Default is 0.1.
+        mining_workers (int): The number of processes sharing exact mining of large libraries. Default is the CPU count.
+        group_duplicates (bool): Whether to collapse pairs into groups with one keeper each, and return DuplicateGroup results. Default is False.
+        max_group_diameter (int): The largest number of pairs between two members of a group. Default is None (no limit).
+        incremental_mining (bool): Whether to only mine the images added since the previous run against the library, reusing the stored pairs. Default is True.
+        neighbour_graph (bool): Whether to cache the neighbour graph of the images, mined with a generous top k and a low threshold, so a scan of the same images with stricter settings only filters it. Default is True.
+        on_results (Callable): Called with each block of pair results as soon as it is scored, while mining goes on. Not called in group mode, nor with a limit or an ANN recall sample, which need every pair first. Default is None.
 
     Returns:
         tuple: A tuple containing a list of tuples containing the best and worst image paths, their scores, and the similarity score, and a string containing the error message if any.
     """
+    if perceptual_hash not in PERCEPTUAL_HASH_MODES:
+        raise ValueError(
+            f"Unknown perceptual hash mode {perceptual_hash!r}, expected one of {PERCEPTUAL_HASH_MODES}"
+        )
+    use_clip = perceptual_hash != "only"
+    if pipelined and not use_clip:
+        print("Images are not embedded, running the stages one after the other.")
+        pipelined = False
+
     start_time = time.time()
-    image_analyzer = ImageAnalyzer()
-    image_quality_comparator = ImageQualityComparator()
+    image_analyzer = (
+        get_shared_image_analyzer(
+            decode_workers=decode_workers,
+            embedding_backend=embedding_backend,
+            batch_size=batch_size,
+            max_memory=max_memory,
+            embedding_precision=embedding_precision,
+        )
+        if use_clip
+        else None
+    )
+    image_quality_comparator = ImageQualityComparator(max_concurrency=score_workers)
 
-    image_files = await get_image_files(img_folder, include_subdirs)
-    print(f"Found {len(image_files)} image files")
-    if len(image_files) == 0:
-        print("No image files found.")
-        return None, None, "No image files found."
-    path_to_hash_map = await calculate_file_hashes(image_files)
-    await image_analyzer.update_image_index(path_to_hash_map)
-    search_results = await image_analyzer.similarity_search(
-        path_to_hash_map=path_to_hash_map,
-        top_k=top_k,
-        limit=limit,
-        threshold=threshold,
+    exclusion_rules = ExclusionRules(
+        excluded_dir_names=[sub_folder_name],
+        patterns=exclude_patterns,
+        skip_hidden=skip_hidden_dirs,
+        max_depth=max_depth,
     )
+    hash_cache = HashCache()
+    pair_store: PairStore | None = None
+    try:
+        if pipelined and image_analyzer is not None:
+            indexed = await index_images_pipelined(
+                img_folder,
+                image_analyzer,
+                include_subdirs,
+                exclusion_rules,
+                hash_cache,
+                verify_hashes,
+                hash_workers,
+                embed_workers,
+                queue_size,
+            )
+        else:
+            indexed = await hash_images_in_stages(
+                img_folder,
+                include_subdirs,
+                exclusion_rules,
+                hash_cache,
+                verify_hashes,
+                hash_workers,
+            )
 
-    if not search_results:
-        print("No near duplicates found.")
-        return None, None, "No near duplicates found."
+        if indexed is None:
+            print("No image files found.")
+            return None, None, "No image files found."
 
-    valid_pairs = image_analyzer.remove_invalid_pairs(search_results)
+        exact_groups, path_to_hash_map = indexed
+        print(
+            f"Found {sum(len(group) - 1 for group in exact_groups)} exact duplicates in {len(exact_groups)} groups"
+        )
 
-    if not valid_pairs:
-        print("No valid near duplicates pairs found.")
-        return None, None, "No valid near duplicates pairs found."
+        # Pairs are only checked against the scan, not against the file system
+        scanned_paths = [
+            *path_to_hash_map,
+            *(path for group in exact_groups for path in group),
+        ]
 
-    print("Image quality comparison is processing...")
-    results = await image_quality_comparator.perform_image_quality_comparison(
-        valid_pairs
-    )
-    results = sorted(results, key=lambda x: x[4], reverse=True)
-    returned_results = results
+        # Exact duplicates are scored while the near duplicates are searched, unless
+        # they are scored with the rest of their group
+        exact_results_task = (
+            None
+            if group_duplicates
+            else asyncio.create_task(
+                image_quality_comparator.perform_exact_duplicate_comparison(
+                    exact_groups
+                )
+            )
+        )
+
+        # The pair store keeps the pairs of images the perceptual prefilter holds back
+        library_hashes = set(path_to_hash_map.values())
+        perceptual_pairs: list[tuple[float, str, str]] = []
+        if perceptual_hash != "off":
+            print("Looking for near duplicates by perceptual hash...")
+            perceptual_hashes = await calculate_perceptual_hashes(
+                path_to_hash_map, hash_cache=hash_cache, max_workers=decode_workers
+            )
+            loop = asyncio.get_running_loop()
+            perceptual_pairs = await loop.run_in_executor(
+                None, find_perceptual_pairs, perceptual_hashes, perceptual_distance
+            )
+            print(f"Found {len(perceptual_pairs)} perceptual hash pairs")
+            # The second image of each pair is settled by the pair, CLIP only sees the rest
+            resolved_images = {img2_path for _, _, img2_path in perceptual_pairs}
+            path_to_hash_map = {
+                path: image_hash
+                for path, image_hash in path_to_hash_map.items()
+                if path not in resolved_images
+            }
+
+        search_options = {}
+        if image_analyzer is not None and path_to_hash_map:
+            if not pipelined:
+                await image_analyzer.update_image_index(path_to_hash_map)
+            mining_settings = f"{embedding_backend}:{embedding_precision}:{mining}:{ann_ef}:{pca_margin}"
+            # With the neighbour graph, stored pairs are mined with the graph settings,
+            # so a stricter threshold or top k does not start the library over
+            mining_top_k, mining_threshold = (
+                get_graph_mining_settings(top_k, threshold)
+                if neighbour_graph
+                else (top_k, threshold)
+            )
+            if incremental_mining:
+                # The neighbour graph is served from stored neighbour lists, not pairs
+                pair_store = PairStore(
+                    img_folder,
+                    settings=f"{mining_settings}:{mining_top_k}:{mining_threshold}:"
+                    + ("lists" if neighbour_graph else "pairs"),
+                    library_hashes=library_hashes,
+                    neighbour_lists=neighbour_graph,
+                )
+            search_options = dict(
+                path_to_hash_map=path_to_hash_map,
+                top_k=top_k,
+                threshold=threshold,
+                mining=mining,
+                ann_ef=ann_ef,
+                mining_workers=mining_workers,
+                pca_margin=pca_margin,
+                pair_store=pair_store,
+                graph_cache=(
+                    NeighbourGraphCache(settings=mining_settings)
+                    if neighbour_graph
+                    else None
+                ),
+            )
+
+        # Pairs are scored while they are mined, unless every pair is needed first to
+        # group them, keep the best ones or measure the recall
+        if exact_results_task is not None and limit is None and not ann_recall_sample:
+
+            path_table = PathTable(scanned_paths)
+            # Every path interned so far was scanned
+            scanned_ids = np.ones(len(path_table), dtype=bool)
+
+            async def _pair_blocks():
+                if perceptual_pairs:
+                    yield path_table.pairs_from_tuples(perceptual_pairs)
+                if search_options:
+                    async for block in image_analyzer.stream_similar_pairs(
+                        path_table=path_table, **search_options
+                    ):
+                        yield block
+
+            print("Image quality comparison is processing...")
+            results, found_pairs = await compare_pairs_as_mined(
+                image_quality_comparator,
+                exact_results_task,
+                _pair_blocks(),
+                path_table,
+                scanned_ids,
+                on_results,
+            )
+            if not results:
+                if not found_pairs:
+                    print("No near duplicates found.")
+                    return None, None, "No near duplicates found."
+                print("No valid near duplicates pairs found.")
+                return None, None, "No valid near duplicates pairs found."
+        else:
+            search_results: list[tuple[float, str, str]] = []
+            if search_options:
+                search_results = await image_analyzer.similarity_search(
+                    limit=limit, ann_recall_sample=ann_recall_sample, **search_options
+                )
+            search_results = perceptual_pairs + (search_results or [])
+            valid_pairs = ImageAnalyzer.remove_invalid_pairs(
+                search_results, set(scanned_paths)
+            )
+
+            if not valid_pairs and not exact_groups:
+                if exact_results_task is not None:
+                    exact_results_task.cancel()
+                if not search_results:
+                    print("No near duplicates found.")
+                    return None, None, "No near duplicates found."
+                print("No valid near duplicates pairs found.")
+                return None, None, "No valid near duplicates pairs found."
+
+            print("Image quality comparison is processing...")
+            if exact_results_task is None:
+                groups = add_exact_copies(
+                    group_pairs(valid_pairs, max_diameter=max_group_diameter),
+                    exact_groups,
+                )
+                # Identical copies share the score of their representative
+                score_aliases = {
+                    copy: group[0] for group in exact_groups for copy in group[1:]
+                }
+                duplicate_groups = (
+                    await image_quality_comparator.perform_group_quality_comparison(
+                        groups, score_aliases
+                    )
+                )
+            else:
+                results = await exact_results_task
+                results += (
+                    await image_quality_comparator.perform_image_quality_comparison(
+                        valid_pairs
+                    )
+                )
+    finally:
+        hash_cache.close()
+        if pair_store is not None:
+            pair_store.close()
+
+    if exact_results_task is None:
+        returned_results = sorted(
+            duplicate_groups, key=lambda group: group.similarity, reverse=True
+        )
+        discarded_images = {
+            path for group in duplicate_groups for path in group.discards
+        }
+        print(f"Total duplicate groups: {len(returned_results)}")
+    else:
+        results = sorted(results, key=lambda x: x[4], reverse=True)
+        returned_results = results
 
-    print(f"Total valid similarity pairs: {len(results)}")
-    discarded_images = set(map(lambda x: x[1], results))
+        print(f"Total valid similarity pairs: {len(results)}")
+        discarded_images = set(map(lambda x: x[1], results))
     print(
         f"Total similarity low quality images (to be deleted): {len(discarded_images)}"
     )
@@ -0,0 +1,196 @@
+import os
+import sqlite3
+from threading import Lock
+
+from .utils import chunkify, get_database_path
+
+HASH_CACHE_FILE_NAME = "hash_cache.sqlite3"
+# Stays below the default limit of host parameters in a single SQLite statement
+SQLITE_MAX_PARAMETERS = 900
+
+
+def _to_signed_64(value: int) -> int:
+    # SQLite integers are signed, 64-bit perceptual hashes may use the top bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned_64(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class HashCache:
+    """
+    Persistent cache of file content hashes.
+
+    Entries are keyed by the stat signature of a file, (device, inode, size, mtime_ns),
+    so an unchanged file can be resolved to its hash without being opened. Any change
+    to the size or modification time invalidates the entry, and renamed files keep
+    hitting the cache as long as they stay on the same device.
+
+    Perceptual hashes are stored next to the content hashes, keyed by the content
+    hash since identical files always share them.
+    """
+
+    def __init__(self, db_path: str | None = None):
+        self.db_path = db_path or os.path.join(
+            get_database_path(), HASH_CACHE_FILE_NAME
+        )
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self.lock = Lock()
+        self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (device, inode)
+            )
+            """
+        )
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS perceptual_hashes (
+                hash TEXT PRIMARY KEY,
+                phash INTEGER NOT NULL,
+                dhash INTEGER NOT NULL
+            )
+            """
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def _is_cacheable(stat: os.stat_result) -> bool:
+        # Some filesystems (and os.DirEntry.stat on Windows) do not report an inode.
+        return stat.st_ino != 0
+
+    def lookup(self, stat: os.stat_result) -> str | None:
+        """
+        Return the cached hash for the given stat signature, if still valid.
+
+        Parameters:
+            stat (os.stat_result): The stat of the file.
+
+        Returns:
+            str | None: The cached hash, or None on a miss.
+        """
+        if not self._is_cacheable(stat):
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT hash FROM file_hashes "
+                "WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+                (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns),
+            ).fetchone()
+        return row[0] if row else None
+
+    def lookup_path(self, file_path: str) -> str | None:
+        """
+        Return the cached hash of the given file, if still valid.
+
+        Parameters:
+            file_path (str): The path to the file.
+
+        Returns:
+            str | None: The cached hash, or None on a miss or if the file cannot be stat'ed.
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return self.lookup(stat)
+
+    def lookup_many(self, file_paths: list[str]) -> dict[str, str]:
+        """
+        Resolve the cached hashes of the given files.
+
+        Files that can no longer be stat'ed or whose signature changed are omitted.
+
+        Parameters:
+            file_paths (list[str]): The paths to the files.
+
+        Returns:
+            dict[str, str]: A dictionary with the file paths as keys and the hashes as values.
+        """
+        results: dict[str, str] = {}
+        for file_path in file_paths:
+            cached_hash = self.lookup_path(file_path)
+            if cached_hash is not None:
+                results[file_path] = cached_hash
+        return results
+
+    def store_many(self, entries: list[tuple[os.stat_result, str]]):
+        """
+        Store freshly computed hashes, replacing any stale entry of the same file.
+
+        Parameters:
+            entries (list[tuple[os.stat_result, str]]): Pairs of file stat and hash.
+        """
+        rows = [
+            (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, file_hash)
+            for stat, file_hash in entries
+            if self._is_cacheable(stat)
+        ]
+        if not rows:
+            return
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO file_hashes "
+                "(device, inode, size, mtime_ns, hash) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.connection.commit()
+
+    def lookup_perceptual_hashes(
+        self, content_hashes: list[str]
+    ) -> dict[str, tuple[int, int]]:
+        """
+        Return the cached perceptual hashes of the given content hashes.
+
+        Parameters:
+            content_hashes (list[str]): The content hashes of the images.
+
+        Returns:
+            dict[str, tuple[int, int]]: A dictionary with the content hashes as keys and (pHash, dHash) as values.
+        """
+        results: dict[str, tuple[int, int]] = {}
+        with self.lock:
+            for chunk in chunkify(content_hashes, chunk_size=SQLITE_MAX_PARAMETERS):
+                rows = self.connection.execute(
+                    "SELECT hash, phash, dhash FROM perceptual_hashes "
+                    f"WHERE hash IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for content_hash, phash, dhash in rows:
+                    results[content_hash] = (
+                        _to_unsigned_64(phash),
+                        _to_unsigned_64(dhash),
+                    )
+        return results
+
+    def store_perceptual_hashes(self, entries: list[tuple[str, int, int]]):
+        """
+        Store perceptual hashes of images.
+
+        Parameters:
+            entries (list[tuple[str, int, int]]): Tuples of content hash, pHash and dHash.
+        """
+        if not entries:
+            return
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO perceptual_hashes (hash, phash, dhash) "
+                "VALUES (?, ?, ?)",
+                [
+                    (content_hash, _to_signed_64(phash), _to_signed_64(dhash))
+                    for content_hash, phash, dhash in entries
+                ],
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
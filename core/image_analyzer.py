@@ -1,97 +1,358 @@
 import asyncio
 from datetime import datetime
-import heapq
+from functools import partial
 import os
 import queue
-import sys
+import threading
 import time
-from math import ceil
-from pathlib import Path
-from typing import Any, List, Tuple
-
-import chromadb
-from chromadb.api.types import IncludeEnum
-from chromadb.types import Metadata
-from chromadb.utils.embedding_functions.sentence_transformer_embedding_function import (
-    SentenceTransformerEmbeddingFunction,
-)
-from PIL import Image
-from sentence_transformers import util
+from threading import Lock
+from typing import TYPE_CHECKING, Any, AsyncIterator, Iterator, List, Tuple
+
+import numpy as np
 from tqdm.asyncio import tqdm
 
-from .utils import calculate_file_hashes, chunkify
+from .batch_sizer import AdaptiveBatchSizer
+from .embedding_backends import (
+    EmbeddingBackend,
+    create_embedding_backend,
+    get_backend_index_name,
+)
+from .embedding_store import EmbeddingMatrix, EmbeddingStore
+from .image_loader import ImageDecoder
+from .image_manifest import ImageManifest
+from .neighbour_graph import (
+    NeighbourGraph,
+    NeighbourGraphCache,
+    filter_graph_pairs,
+    get_graph_mining_settings,
+)
+from .pair_table import (
+    PathTable,
+    concatenate_pairs,
+    make_pairs,
+    remap_pairs,
+    sort_pairs,
+    top_k_per_row,
+)
+from .pca_projection import PCA_MARGIN, PcaProjection
+from .utils import chunkify, get_database_path
 
-MODEL_NAME = "clip-ViT-B-32"
-DB_PATH_NAME = "database"
+ANN_EF = 50
+ANN_EF_CONSTRUCTION = 100
+ANN_M = 16
+ANN_RECALL_SAMPLE_SIZE = 1000
+ANN_RECALL_CHUNK_SIZE = 256
+ANN_RECALL_CORPUS_CHUNK_SIZE = 100000
+MINING_MODES = ("exact", "ann", "pca")
+# Candidates kept per query row of a block in the PCA space, for each pair kept
+PCA_CANDIDATE_FACTOR = 4
+PCA_RERANK_CHUNK_SIZE = 65536
+# Blocks of pairs buffered between the mining thread and the consumer of the stream
+PAIR_QUEUE_SIZE = 64
+# Pairs per block when streaming a cached neighbour graph
+GRAPH_BLOCK_SIZE = 1000
+EMBEDDING_STORE_FILL_CHUNK_SIZE = 5000
+MANIFEST_IMPORT_CHUNK_SIZE = 10000
+# Below this many embeddings, starting a pool of mining processes costs more than it saves
+PARALLEL_MIN_EMBEDDINGS = 20000
 
+if TYPE_CHECKING:
+    import chromadb
+    from chromadb.types import Metadata
 
-class ImageAnalyzer:
-    def __init__(self):
-        self._setup_database()
+    from .pair_store import PairStore
 
-    def _setup_database(self):
-        self.client = chromadb.PersistentClient(path=self._get_database_path())
-        embedding_function: Any = SentenceTransformerEmbeddingFunction(
-            model_name=MODEL_NAME, device=util.get_device_name()
-        )
-        self.collection = self.client.get_or_create_collection(
-            name="image_embeddings",
-            metadata={"hnsw:space": "cosine"},
-            embedding_function=embedding_function,
-        )
+_chroma_client: "chromadb.ClientAPI | None" = None
+_shared_image_analyzer: "ImageAnalyzer | None" = None
+_shared_lock = Lock()
 
-    @staticmethod
-    async def _load_image(filepath: str):
-        image = Image.open(filepath)
-        return image
 
-    @staticmethod
-    async def _async_load_images(batch_paths: list[str]) -> list[Any]:
-        images = await asyncio.gather(
-            *[ImageAnalyzer._load_image(path) for path in batch_paths]
+def get_chroma_client() -> "chromadb.ClientAPI":
+    """Returns the Chroma client of the process, opening the database on first use."""
+    # Chroma takes most of a second to import, so it is only loaded here
+    import chromadb
+
+    global _chroma_client
+    with _shared_lock:
+        if _chroma_client is None:
+            _chroma_client = chromadb.PersistentClient(path=get_database_path())
+        return _chroma_client
+
+
+def get_shared_image_analyzer(**settings) -> "ImageAnalyzer":
+    """
+    Returns the image analyzer shared by every scan and sweep of the process.
+
+    The analyzer and its loaded model outlive a single scan, so only the first scan
+    pays for loading the model. Settings given here reconfigure the shared analyzer
+    for the next scan, and the model is only reloaded when the backend changes.
+
+    Parameters:
+        **settings: The ImageAnalyzer arguments, omitted to reuse the current ones.
+
+    Returns:
+        ImageAnalyzer: The shared analyzer.
+    """
+    global _shared_image_analyzer
+    analyzer = _shared_image_analyzer
+    if analyzer is None:
+        analyzer = ImageAnalyzer(**settings)
+        with _shared_lock:
+            if _shared_image_analyzer is None:
+                _shared_image_analyzer = analyzer
+            analyzer = _shared_image_analyzer
+    elif settings:
+        analyzer.configure(**settings)
+    return analyzer
+
+
+def _top_pairs(
+    block_scores: list[np.ndarray],
+    block_i: list[np.ndarray],
+    block_j: list[np.ndarray],
+    max_pairs: int | None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if not block_scores:
+        return (
+            np.empty(0, dtype=np.float32),
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.int64),
         )
-        return images
+    scores = np.concatenate(block_scores)
+    i = np.concatenate(block_i)
+    j = np.concatenate(block_j)
+    if max_pairs is not None and len(scores) > max_pairs:
+        best = np.argpartition(-scores, max_pairs - 1)[:max_pairs]
+        scores, i, j = scores[best], i[best], j[best]
+    order = np.argsort(-scores, kind="stable")
+    return scores[order], i[order], j[order]
 
-    @staticmethod
-    def _get_database_path():
-        if os.environ.get("APP_ENV") != "production":
-            return "./" + DB_PATH_NAME
 
-        if getattr(sys, "frozen", False):
-            app_path = Path(sys.executable).parent.parent
-            db_path = app_path / "Contents" / "Resources" / DB_PATH_NAME
-        else:
-            db_path = Path("./" + DB_PATH_NAME)
+def hash_pairs_to_ids(
+    hash_pairs: List[Tuple[float, str, str]],
+    hash_to_id: dict[str, int],
+    neighbour_lists: bool = False,
+) -> np.ndarray:
+    """
+    Converts pairs of content hashes to pairs of ids, of PAIR_DTYPE, the smaller
+    id first, or in the given order for neighbour lists. Pairs of images missing
+    from `hash_to_id` are dropped.
+    """
+    hash_pairs = [
+        (score, hash1, hash2)
+        for score, hash1, hash2 in hash_pairs
+        if hash1 in hash_to_id and hash2 in hash_to_id
+    ]
+    ids1 = np.fromiter(
+        (hash_to_id[hash1] for _, hash1, _ in hash_pairs), dtype=np.int32
+    )
+    ids2 = np.fromiter(
+        (hash_to_id[hash2] for _, _, hash2 in hash_pairs), dtype=np.int32
+    )
+    scores = np.fromiter((score for score, _, _ in hash_pairs), dtype=np.float32)
+    if neighbour_lists:
+        return make_pairs(scores, ids1, ids2)
+    return make_pairs(scores, np.minimum(ids1, ids2), np.maximum(ids1, ids2))
 
-        if sys.platform == "darwin":
-            db_path = (
-                Path.home()
-                / "Library"
-                / "Application Support"
-                / "SnapSweep"
-                / DB_PATH_NAME
+
+class PairAggregator:
+    """
+    Keeps the best pairs of a stream of mined blocks in bounded memory.
+
+    Blocks are buffered until they hold twice `max_pairs` pairs, then cut down to
+    the best `max_pairs`. Every block of the stream is considered, so the result is
+    the true top `max_pairs` without stopping the mining early.
+
+    Parameters:
+        max_pairs (int | None): The number of pairs kept, None to keep every pair.
+    """
+
+    def __init__(self, max_pairs: int | None = None):
+        self.max_pairs = max_pairs
+        self.block_scores: list[np.ndarray] = []
+        self.block_i: list[np.ndarray] = []
+        self.block_j: list[np.ndarray] = []
+        self.total_pairs = 0
+
+    def add(self, scores: np.ndarray, i: np.ndarray, j: np.ndarray):
+        self.block_scores.append(scores)
+        self.block_i.append(i)
+        self.block_j.append(j)
+        self.total_pairs += len(scores)
+        if self.max_pairs is not None and self.total_pairs > 2 * self.max_pairs:
+            self.block_scores, self.block_i, self.block_j = map(
+                lambda array: [array], self.result()
             )
+            self.total_pairs = len(self.block_scores[0])
+
+    def result(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns:
+            tuple: The scores and the row indices of the best pairs, highest scores first.
+        """
+        return _top_pairs(self.block_scores, self.block_i, self.block_j, self.max_pairs)
 
-        # Ensure the directory exists
-        db_path.mkdir(parents=True, exist_ok=True)
-        return str(db_path)
 
-    async def add_images(
-        self, image_paths: list[str], path_to_hash_map: dict[str, str]
+class ImageAnalyzer:
+    def __init__(
+        self,
+        decode_workers: int | None = None,
+        embedding_backend: str = "torch",
+        batch_size: int | None = None,
+        max_memory: int | None = None,
+        embedding_precision: str = "float16",
+    ):
+        self.model_lock = Lock()
+        self._embedding_backend: EmbeddingBackend | None = None
+        self.configure(
+            decode_workers,
+            embedding_backend,
+            batch_size,
+            max_memory,
+            embedding_precision,
+        )
+
+    def configure(
+        self,
+        decode_workers: int | None = None,
+        embedding_backend: str = "torch",
+        batch_size: int | None = None,
+        max_memory: int | None = None,
+        embedding_precision: str = "float16",
     ):
         """
-        Adds the given image paths to the database.
+        Applies new settings, keeping the loaded model and decoder pool when possible.
+        """
+        max_workers = decode_workers or os.cpu_count() or 4
+        if getattr(self, "image_decoder", None) is None:
+            self.image_decoder = ImageDecoder(max_workers=max_workers)
+        elif self.image_decoder.max_workers != max_workers:
+            self.image_decoder.close()
+            self.image_decoder = ImageDecoder(max_workers=max_workers)
 
-        Parameters:
-            image_paths (list[str]): A list of image paths to add to the database.
-            path_to_hash_map (dict[str, str]): A dictionary mapping image paths to their hash values.
+        with self.model_lock:
+            backend_changed = (
+                getattr(self, "embedding_backend_name", None) != embedding_backend
+            )
+            if backend_changed:
+                self.embedding_backend_name = embedding_backend
+                self._embedding_backend = None
+        if backend_changed:
+            self._setup_database()
+
+        if (batch_size, max_memory) != getattr(self, "batch_settings", None):
+            self.batch_settings = (batch_size, max_memory)
+            self.batch_sizer = AdaptiveBatchSizer(
+                max_memory=max_memory, batch_size=batch_size
+            )
+
+        embedding_store = getattr(self, "embedding_store", None)
+        if embedding_store is None or (
+            embedding_store.precision,
+            embedding_store.embedding_backend,
+        ) != (embedding_precision, embedding_backend):
+            if embedding_store is not None:
+                embedding_store.close()
+            self.embedding_store = EmbeddingStore(
+                precision=embedding_precision, embedding_backend=embedding_backend
+            )
+
+    @property
+    def embedding_backend(self) -> EmbeddingBackend:
+        """The embedding model, loaded on the first image that needs an embedding."""
+        return self.load_model()
+
+    def load_model(self) -> EmbeddingBackend:
+        """
+        Loads the embedding model if it is not resident yet. Safe to call from a
+        background thread to warm the model up before the first scan.
+        """
+        with self.model_lock:
+            if self._embedding_backend is None:
+                print(f"Loading {self.embedding_backend_name} embedding model...")
+                self._embedding_backend = create_embedding_backend(
+                    self.embedding_backend_name
+                )
+            return self._embedding_backend
+
+    def _setup_database(self):
+        """
+        Opens the collection and the manifest of the embedding backend. Vectors of
+        different backends are not comparable, so each backend indexes the images
+        on its own and switching backends embeds them again.
+        """
+        self.client = get_chroma_client()
+        # Embeddings are computed by the embedding backend, not by Chroma
+        self.collection = self.client.get_or_create_collection(
+            name=get_backend_index_name(
+                "image_embeddings", self.embedding_backend_name
+            ),
+            metadata={"hnsw:space": "cosine"},
+            embedding_function=None,
+        )
+        # Scans are diffed against the manifest, Chroma only stores the vectors
+        manifest = getattr(self, "manifest", None)
+        if manifest is not None:
+            manifest.close()
+        self.manifest = ImageManifest(embedding_backend=self.embedding_backend_name)
+        self.manifest_lock = Lock()
+
+    def _import_manifest(self):
+        """
+        Records the images indexed before the manifest existed, reading the
+        collection page by page, once.
         """
-        images = await ImageAnalyzer._async_load_images(image_paths)
+        from chromadb.api.types import IncludeEnum
+
+        with self.manifest_lock:
+            if self.manifest.is_imported:
+                return
+            total_images = self.collection.count()
+            if total_images:
+                print(f"Importing {total_images} indexed images into the manifest...")
+            entries = []
+            for offset in range(0, total_images, MANIFEST_IMPORT_CHUNK_SIZE):
+                docs = self.collection.get(
+                    limit=MANIFEST_IMPORT_CHUNK_SIZE,
+                    offset=offset,
+                    include=[IncludeEnum.metadatas],
+                )
+                entries.extend(
+                    (image_hash, metadata["path"], bool(metadata.get("deleted")))
+                    for image_hash, metadata in zip(
+                        docs["ids"], docs["metadatas"] or []
+                    )
+                )
+            self.manifest.import_images(entries)
+
+    @staticmethod
+    def _get_database_path():
+        return get_database_path()
+
+    def _add_images(self, image_paths: list[str], path_to_hash_map: dict[str, str]):
+        decoded_images = self.image_decoder.decode(image_paths)
+        # Images that failed to decode are left out of the index
+        image_paths = [
+            path
+            for path, image in zip(image_paths, decoded_images)
+            if image is not None
+        ]
+        images: List[Any] = [image for image in decoded_images if image is not None]
+        del decoded_images
+        self.batch_sizer.sample()
+        if not images:
+            return
         image_hashes = [path_to_hash_map[path] for path in image_paths]
 
+        embeddings = self.embedding_backend.encode_images(images)
+        self.batch_sizer.sample()
+        # Release the pixels before writing, only the embeddings are kept
+        del images
+
+        self.embedding_store.add(image_hashes, embeddings)
         self.collection.add(
             ids=image_hashes,
-            images=images,
+            embeddings=embeddings,
             metadatas=[
                 {
                     "path": path,
@@ -100,6 +361,24 @@ class ImageAnalyzer:
                 for path in image_paths
             ],
         )
+        self.manifest.record_embedded(
+            {path: path_to_hash_map[path] for path in image_paths}
+        )
+
+    async def add_images(
+        self, image_paths: list[str], path_to_hash_map: dict[str, str]
+    ):
+        """
+        Adds the given image paths to the database.
+
+        Parameters:
+            image_paths (list[str]): A list of image paths to add to the database.
+            path_to_hash_map (dict[str, str]): A dictionary mapping image paths to their hash values.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, self._add_images, image_paths, path_to_hash_map
+        )
 
     def update_metadata(self, update_path_to_hash_map: dict[str, str]):
         ids = list(update_path_to_hash_map.values())
@@ -113,34 +392,49 @@ class ImageAnalyzer:
                 for path in update_path_to_hash_map.keys()
             ],
         )
+        self.manifest.update_paths(update_path_to_hash_map)
+
+    def _diff_index(
+        self, path_to_hash_map: dict[str, str]
+    ) -> tuple[list[str], dict[str, str]]:
+        """
+        Splits the given images into the ones that still need an embedding and the
+        already embedded ones whose stored path or status is outdated, from the
+        manifest.
+        """
+        self._import_manifest()
+        return self.manifest.diff(path_to_hash_map)
+
+    def index_batch(self, path_to_hash_map: dict[str, str]) -> int:
+        """
+        Indexes a batch of images synchronously, refreshing the paths of moved images
+        and embedding the new ones. Meant to be run in a worker thread.
+
+        Parameters:
+            path_to_hash_map (dict[str, str]): A dictionary mapping image paths to their hash values.
+
+        Returns:
+            int: The number of newly embedded images.
+        """
+        new_image_paths, update_path_to_hash_map = self._diff_index(path_to_hash_map)
+        if update_path_to_hash_map:
+            self.update_metadata(update_path_to_hash_map)
+        if new_image_paths:
+            with self.batch_sizer.measure(len(new_image_paths)):
+                self._add_images(new_image_paths, path_to_hash_map)
+        return len(new_image_paths)
 
     async def update_image_index(self, path_to_hash_map: dict[str, str]):
         """
         Updates the image index with the given image paths.
         """
 
-        image_paths = list(path_to_hash_map.keys())
-        image_hashes = list(path_to_hash_map.values())
-        existing_hashes = self.collection.get(ids=image_hashes)["ids"]
-        new_image_paths = [
-            path
-            for path, hash_value in path_to_hash_map.items()
-            if hash_value not in existing_hashes
-        ]
-
-        updated_image_paths = self.collection.get(
-            ids=image_hashes, where={"path": {"$nin": list(image_paths)}}
-        )["ids"]
+        new_image_paths, update_path_to_hash_map = self._diff_index(path_to_hash_map)
 
-        if updated_image_paths:
+        if update_path_to_hash_map:
             print(
-                f"Detected {len(updated_image_paths)} updated image paths, updating metadata...",
+                f"Detected {len(update_path_to_hash_map)} updated image paths, updating metadata...",
             )
-            hash_path_mapping = {v: k for k, v in path_to_hash_map.items()}
-            update_path_to_hash_map = {
-                hash_path_mapping[image_hash]: image_hash
-                for image_hash in updated_image_paths
-            }
             self.update_metadata(update_path_to_hash_map)
             print("Metadata updated.")
 
@@ -150,10 +444,15 @@ class ImageAnalyzer:
             with tqdm(
                 total=len(new_image_paths), desc="Creating embeddings"
             ) as progress_bar:
-                CHUNK_SIZE = ceil(len(new_image_paths) / 10)
                 total_new_embeddings = 0
-                for chunk in chunkify(new_image_paths, chunk_size=CHUNK_SIZE):
-                    await self.add_images(chunk, path_to_hash_map)
+                # Batches are sized from the memory measured on the previous ones
+                while total_new_embeddings < len(new_image_paths):
+                    batch_size = self.batch_sizer.next_batch_size()
+                    chunk = new_image_paths[
+                        total_new_embeddings : total_new_embeddings + batch_size
+                    ]
+                    with self.batch_sizer.measure(len(chunk)):
+                        await self.add_images(chunk, path_to_hash_map)
                     total_new_embeddings += len(chunk)
                     progress_bar.update(len(chunk))
             print(
@@ -165,8 +464,8 @@ class ImageAnalyzer:
 
     @staticmethod
     def paraphrase_mining_embeddings(
-        embeddings: List[chromadb.Embeddings],
-        metadatas: List[chromadb.Metadata],
+        embeddings: "List[chromadb.Embeddings]",
+        metadatas: "List[chromadb.Metadata]",
         top_k=100,
         max_pairs=500000,
         query_chunk_size=5000,
@@ -197,6 +496,7 @@ class ImageAnalyzer:
         min_score = -1
         num_added = 0
         import torch
+        from sentence_transformers import util
 
         for corpus_start_idx in range(0, len(embeddings), corpus_chunk_size):
             for query_start_idx in range(0, len(embeddings), query_chunk_size):
@@ -255,72 +555,1068 @@ class ImageAnalyzer:
         return pairs_list
 
     @staticmethod
-    def paraphrase_mining_embeddings_v2(
-        embeddings: List[List[float]],
-        metadatas: List[Metadata],
+    def mine_block(
+        query_embeddings: np.ndarray,
+        corpus_embeddings: np.ndarray,
+        query_start_idx: int,
+        corpus_start_idx: int,
+        top_k: int = 100,
+        similarity_threshold: float = 0.5,
+        neighbour_lists: bool = False,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+        """
+        Finds the similar pairs of one block of the similarity matrix.
+
+        Parameters:
+            query_embeddings (np.ndarray): The L2-normalized query rows of the block.
+            corpus_embeddings (np.ndarray): The L2-normalized corpus rows of the block.
+            query_start_idx (int): The row index of the first query row.
+            corpus_start_idx (int): The row index of the first corpus row.
+            top_k (int): The number of most similar corpus rows kept per query row, the row itself included.
+            similarity_threshold (float): The minimum cosine similarity of a pair.
+            neighbour_lists (bool): Whether to keep every neighbour j != i of a query row i, not only j > i.
+
+        Returns:
+            tuple | None: The scores and the row indices i < j of the pairs, or i and its neighbours j, None if the block holds no pair.
+        """
+        scores = query_embeddings @ corpus_embeddings.T
+        above_threshold = scores >= similarity_threshold
+        counts = above_threshold.sum(axis=1)
+        if not counts.any():
+            return None
+
+        # Rows with at most top_k scores above the threshold keep them all,
+        # only the crowded ones need a top-k selection
+        crowded_rows = np.nonzero(counts > top_k)[0]
+        if len(crowded_rows):
+            top_k_idx = np.argpartition(-scores[crowded_rows], top_k - 1, axis=1)[
+                :, :top_k
+            ]
+            top_k_values = np.take_along_axis(scores[crowded_rows], top_k_idx, axis=1)
+            above_threshold[crowded_rows] = False
+            above_threshold[crowded_rows[:, None], top_k_idx] = (
+                top_k_values >= similarity_threshold
+            )
+
+        # Avoid duplicate pairs and self-comparisons, blocks whose last query row is
+        # before the first corpus row lie entirely above the diagonal
+        query_end_idx = query_start_idx + len(query_embeddings)
+        if query_end_idx > corpus_start_idx:
+            corpus_rows = np.arange(
+                corpus_start_idx, corpus_start_idx + len(corpus_embeddings)
+            )[None, :]
+            query_rows = np.arange(query_start_idx, query_end_idx)[:, None]
+            above_threshold &= (
+                corpus_rows != query_rows
+                if neighbour_lists
+                else corpus_rows > query_rows
+            )
+        rows, cols = np.nonzero(above_threshold)
+        return scores[rows, cols], rows + query_start_idx, cols + corpus_start_idx
+
+    @staticmethod
+    def iter_pair_blocks(
+        embeddings: "np.ndarray | EmbeddingMatrix",
         top_k: int = 100,
-        max_pairs: int = 500000,
         query_chunk_size: int = 5000,
         corpus_chunk_size: int = 100000,
         similarity_threshold: float = 0.5,
-    ) -> List[Tuple[float, str, str]]:
-        import torch
-        from sentence_transformers import util
+        query_count: int | None = None,
+        neighbour_lists: bool = False,
+    ) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Yields the similar pairs of embeddings block by block, as they are found.
+
+        Each query row keeps its `top_k` most similar corpus rows of a block, and
+        pairs are extracted with array operations only: a mask of the scores above
+        the threshold, restricted to the upper triangle, then `nonzero`. Blocks
+        entirely below the diagonal hold no new pair and are not computed.
+
+        With `query_count`, only the pairs of the first `query_count` rows are mined,
+        which costs O(query_count * N) instead of O(N^2).
+
+        With `neighbour_lists`, every neighbour of a query row is yielded, on both
+        sides of the diagonal, and each block holds the whole lists of its query
+        rows.
+
+        Parameters:
+            embeddings (np.ndarray | EmbeddingMatrix): The L2-normalized embeddings, one per row.
+            top_k (int): The number of most similar rows kept per query row and block, the row itself included.
+            query_chunk_size (int): The number of query rows per block.
+            corpus_chunk_size (int): The number of corpus rows per block.
+            similarity_threshold (float): The minimum cosine similarity of a pair.
+            query_count (int | None): The number of leading rows to mine against every row, None for all rows.
+            neighbour_lists (bool): Whether to yield the neighbours j != i of each query row i, instead of the pairs i < j.
 
-        pairs = []
-        embeddings_tensor = torch.tensor(embeddings)
+        Yields:
+            tuple: The scores and the row indices i < j of the pairs of a block, or i and its neighbours j.
+        """
         total_embeddings = len(embeddings)
+        query_count = total_embeddings if query_count is None else query_count
+
+        if neighbour_lists:
+            for query_start_idx in range(0, query_count, query_chunk_size):
+                query_end_idx = min(query_start_idx + query_chunk_size, query_count)
+                query_embeddings = embeddings[query_start_idx:query_end_idx]
+                aggregator = PairAggregator()
+                for corpus_start_idx in range(0, total_embeddings, corpus_chunk_size):
+                    block_pairs = ImageAnalyzer.mine_block(
+                        query_embeddings,
+                        embeddings[
+                            corpus_start_idx : corpus_start_idx + corpus_chunk_size
+                        ],
+                        query_start_idx,
+                        corpus_start_idx,
+                        top_k=top_k,
+                        similarity_threshold=similarity_threshold,
+                        neighbour_lists=True,
+                    )
+                    if block_pairs is not None:
+                        aggregator.add(*block_pairs)
+                if aggregator.total_pairs:
+                    yield aggregator.result()
+            return
 
         for corpus_start_idx in range(0, total_embeddings, corpus_chunk_size):
             corpus_end_idx = min(corpus_start_idx + corpus_chunk_size, total_embeddings)
-            corpus_embeddings = embeddings_tensor[corpus_start_idx:corpus_end_idx]
+            corpus_embeddings = embeddings[corpus_start_idx:corpus_end_idx]
+
+            # Query rows at or past the end of the corpus block only pair backwards
+            for query_start_idx in range(
+                0, min(corpus_end_idx - 1, query_count), query_chunk_size
+            ):
+                query_end_idx = min(query_start_idx + query_chunk_size, query_count)
+                block_pairs = ImageAnalyzer.mine_block(
+                    embeddings[query_start_idx:query_end_idx],
+                    corpus_embeddings,
+                    query_start_idx,
+                    corpus_start_idx,
+                    top_k=top_k,
+                    similarity_threshold=similarity_threshold,
+                )
+                if block_pairs is not None:
+                    yield block_pairs
+
+    @staticmethod
+    def mine_pair_indices(
+        embeddings: "np.ndarray | EmbeddingMatrix",
+        top_k: int = 100,
+        max_pairs: int = 500000,
+        query_chunk_size: int = 5000,
+        corpus_chunk_size: int = 100000,
+        similarity_threshold: float = 0.5,
+        query_count: int | None = None,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Finds the most similar pairs of embeddings, see `iter_pair_blocks`.
+
+        Returns:
+            tuple: The scores and the row indices i < j of the best `max_pairs` pairs, highest scores first.
+        """
+        aggregator = PairAggregator(max_pairs)
+        for block_pairs in ImageAnalyzer.iter_pair_blocks(
+            embeddings,
+            top_k=top_k,
+            query_chunk_size=query_chunk_size,
+            corpus_chunk_size=corpus_chunk_size,
+            similarity_threshold=similarity_threshold,
+            query_count=query_count,
+        ):
+            aggregator.add(*block_pairs)
+        return aggregator.result()
+
+    @staticmethod
+    def iter_pair_blocks_ann(
+        embeddings: "np.ndarray | EmbeddingMatrix",
+        top_k: int = 100,
+        query_chunk_size: int = 5000,
+        similarity_threshold: float = 0.5,
+        ef: int = ANN_EF,
+        query_count: int | None = None,
+        neighbour_lists: bool = False,
+    ) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Yields similar pairs of embeddings found by approximate nearest neighbour
+        search, one batch of queries at a time.
+
+        The embeddings are indexed in an HNSW graph, then every embedding queries its
+        `top_k` nearest neighbours in batches. Like in exact mining, the embedding
+        itself is one of them, and a pair i < j is kept when j is a neighbour of i.
+        Building and querying the graph is close to linear
+        in the number of embeddings, at the cost of missing a few pairs, which a
+        larger `ef` makes rarer.
+
+        Parameters:
+            embeddings (np.ndarray | EmbeddingMatrix): The L2-normalized embeddings, one per row.
+            top_k (int): The number of nearest neighbours queried per embedding, the embedding itself included.
+            query_chunk_size (int): The number of embeddings queried per batch.
+            similarity_threshold (float): The minimum cosine similarity of a pair.
+            ef (int): The size of the candidate list explored per query, trades speed for recall.
+            query_count (int | None): The number of leading rows querying the index, None for all rows.
+            neighbour_lists (bool): Whether to yield the neighbours j != i of each query row i, instead of the pairs i < j.
+
+        Yields:
+            tuple: The scores and the row indices i < j of the pairs of a batch, or i and its neighbours j.
+        """
+        import hnswlib
 
-            for query_start_idx in range(0, total_embeddings, query_chunk_size):
-                query_end_idx = min(
-                    query_start_idx + query_chunk_size, total_embeddings
+        total_embeddings, dim = embeddings.shape
+        query_count = total_embeddings if query_count is None else query_count
+        if total_embeddings < 2 or query_count == 0:
+            return
+
+        # Each query also finds the embedding itself, which counts in its top k
+        k = min(top_k, total_embeddings)
+        index = hnswlib.Index(space="cosine", dim=dim)
+        index.init_index(
+            max_elements=total_embeddings,
+            ef_construction=max(ef, ANN_EF_CONSTRUCTION),
+            M=ANN_M,
+        )
+        for start in range(0, total_embeddings, query_chunk_size):
+            chunk = embeddings[start : start + query_chunk_size]
+            index.add_items(chunk, np.arange(start, start + len(chunk)), num_threads=-1)
+        index.set_ef(max(ef, k))
+
+        for query_start_idx in range(0, query_count, query_chunk_size):
+            query_embeddings = embeddings[
+                query_start_idx : min(query_start_idx + query_chunk_size, query_count)
+            ]
+            labels, distances = index.knn_query(query_embeddings, k=k, num_threads=-1)
+            scores = 1 - distances
+            i = np.arange(query_start_idx, query_start_idx + len(labels))[:, None]
+            not_self = labels != i
+            # Results are sorted by distance, a query that missed itself still keeps
+            # top_k - 1 neighbours
+            in_top_k = np.cumsum(not_self, axis=1) <= top_k - 1
+            # Like in exact mining, a pair is kept when the second image is among
+            # the neighbours of the first one
+            rows, cols = np.nonzero(
+                (scores >= similarity_threshold)
+                & not_self
+                & in_top_k
+                & (neighbour_lists | (labels > i))
+            )
+            if len(rows):
+                yield (
+                    scores[rows, cols],
+                    rows + query_start_idx,
+                    labels[rows, cols].astype(np.int64),
                 )
-                query_embeddings = embeddings_tensor[query_start_idx:query_end_idx]
 
-                scores = util.cos_sim(query_embeddings, corpus_embeddings)
+    @staticmethod
+    def mine_pair_indices_ann(
+        embeddings: "np.ndarray | EmbeddingMatrix",
+        top_k: int = 100,
+        max_pairs: int = 500000,
+        query_chunk_size: int = 5000,
+        similarity_threshold: float = 0.5,
+        ef: int = ANN_EF,
+        query_count: int | None = None,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Finds similar pairs of embeddings with approximate nearest neighbour search,
+        see `iter_pair_blocks_ann`.
+
+        Returns:
+            tuple: The scores and the row indices i < j of the best `max_pairs` pairs, highest scores first.
+        """
+        aggregator = PairAggregator(max_pairs)
+        for block_pairs in ImageAnalyzer.iter_pair_blocks_ann(
+            embeddings,
+            top_k=top_k,
+            query_chunk_size=query_chunk_size,
+            similarity_threshold=similarity_threshold,
+            ef=ef,
+            query_count=query_count,
+        ):
+            aggregator.add(*block_pairs)
+        return aggregator.result()
+
+    @staticmethod
+    def rerank_pairs(
+        embeddings: "np.ndarray | EmbeddingMatrix",
+        i_indices: np.ndarray,
+        j_indices: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Computes the full precision cosine similarity of candidate pairs, reading
+        each distinct row once per chunk of candidates.
+
+        Returns:
+            np.ndarray: The float32 score of each pair.
+        """
+        scores = np.empty(len(i_indices), dtype=np.float32)
+        for start in range(0, len(i_indices), PCA_RERANK_CHUNK_SIZE):
+            end = start + PCA_RERANK_CHUNK_SIZE
+            rows, inverse = np.unique(
+                np.concatenate([i_indices[start:end], j_indices[start:end]]),
+                return_inverse=True,
+            )
+            vectors = embeddings[rows]
+            count = len(i_indices[start:end])
+            scores[start:end] = np.einsum(
+                "ij,ij->i", vectors[inverse[:count]], vectors[inverse[count:]]
+            )
+        return scores
+
+    @staticmethod
+    def iter_pair_blocks_pca(
+        embeddings: "np.ndarray | EmbeddingMatrix",
+        projection: PcaProjection,
+        top_k: int = 100,
+        query_chunk_size: int = 5000,
+        corpus_chunk_size: int = 100000,
+        similarity_threshold: float = 0.5,
+        margin: float = PCA_MARGIN,
+        query_count: int | None = None,
+        neighbour_lists: bool = False,
+    ) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Yields the similar pairs of embeddings block by block, mined coarse to fine.
 
-                # Apply similarity threshold
-                high_scores = scores >= similarity_threshold
+        The embeddings are projected onto a few principal components, and blocks
+        of the projections are mined like exact mining for candidates scoring at
+        least `similarity_threshold - margin`. Only the candidates are scored again
+        with the full embeddings, and kept above the threshold. A pair is missed
+        when the projection underestimates its similarity by more than the margin;
+        `measure_ann_recall` reports how often that happens.
 
-                if high_scores.any():
-                    scores_top_k_values, scores_top_k_idx = torch.topk(
-                        scores,
-                        min(top_k, scores.size(1)),
-                        dim=1,
-                        largest=True,
-                        sorted=False,
+        Parameters:
+            embeddings (np.ndarray | EmbeddingMatrix): The L2-normalized embeddings, one per row.
+            projection (PcaProjection): The projection of the candidate search.
+            top_k (int): The number of most similar rows kept per query row, the row itself included.
+            query_chunk_size (int): The number of query rows per block.
+            corpus_chunk_size (int): The number of corpus rows per block.
+            similarity_threshold (float): The minimum cosine similarity of a pair.
+            margin (float): How far below the threshold the projected similarity of a candidate may be.
+            query_count (int | None): The number of leading rows to mine against every row, None for all rows.
+            neighbour_lists (bool): Whether to yield the neighbours j != i of each query row i, instead of the pairs i < j.
+
+        Yields:
+            tuple: The scores and the row indices i < j of the pairs of a block, or i and its neighbours j.
+        """
+        projected = projection.project(embeddings)
+        # The candidates of a row are on both sides of the diagonal, so that the
+        # row ranks its whole neighbourhood like in exact mining
+        for _, candidate_i, candidate_j in ImageAnalyzer.iter_pair_blocks(
+            projected,
+            top_k=top_k * PCA_CANDIDATE_FACTOR,
+            query_chunk_size=query_chunk_size,
+            corpus_chunk_size=corpus_chunk_size,
+            similarity_threshold=similarity_threshold - margin,
+            query_count=query_count,
+            neighbour_lists=True,
+        ):
+            scores = ImageAnalyzer.rerank_pairs(embeddings, candidate_i, candidate_j)
+            keep = scores >= similarity_threshold
+            scores, i_indices, j_indices = (
+                scores[keep],
+                candidate_i[keep],
+                candidate_j[keep],
+            )
+            # The row itself is the first of its top k, like in exact mining
+            keep = top_k_per_row(i_indices, scores, top_k - 1) & (
+                neighbour_lists | (j_indices > i_indices)
+            )
+            if keep.any():
+                yield scores[keep], i_indices[keep], j_indices[keep]
+
+    @staticmethod
+    def measure_ann_recall(
+        embeddings: "np.ndarray | EmbeddingMatrix",
+        pair_i: np.ndarray,
+        pair_j: np.ndarray,
+        top_k: int = 100,
+        similarity_threshold: float = 0.5,
+        sample_size: int = ANN_RECALL_SAMPLE_SIZE,
+        query_count: int | None = None,
+    ) -> float:
+        """
+        Measures the share of the exact pairs of sampled embeddings that an
+        approximate mining mode found.
+
+        Like in exact mining, the pairs of a sampled embedding i are the pairs i < j
+        where j is among its `top_k` most similar embeddings, itself included. Each
+        exact pair belongs to exactly one embedding, so the sample is unbiased.
+
+        Parameters:
+            embeddings (np.ndarray | EmbeddingMatrix): The L2-normalized embeddings, one per row.
+            pair_i (np.ndarray): The first row index of each pair found.
+            pair_j (np.ndarray): The second row index of each pair found.
+            top_k (int): The number of nearest neighbours kept per embedding, the embedding itself included.
+            similarity_threshold (float): The minimum cosine similarity of a pair.
+            sample_size (int): The number of embeddings whose exact pairs are computed.
+            query_count (int | None): The number of leading rows that queried the index, None for all rows.
+
+        Returns:
+            float: The recall, 1.0 when the sampled embeddings have no exact pair.
+        """
+        total_embeddings = len(embeddings)
+        query_count = total_embeddings if query_count is None else query_count
+        # The embedding itself is one of its top k, like in exact mining
+        k = min(top_k - 1, total_embeddings - 1)
+        if k < 1:
+            return 1.0
+        rng = np.random.default_rng(0)
+        sample = rng.choice(query_count, min(sample_size, query_count), replace=False)
+        found_pairs = set(zip(pair_i.tolist(), pair_j.tolist()))
+
+        expected = 0
+        found = 0
+        for start in range(0, len(sample), ANN_RECALL_CHUNK_SIZE):
+            rows = sample[start : start + ANN_RECALL_CHUNK_SIZE]
+            query_embeddings = embeddings[rows]
+            scores = np.concatenate(
+                [
+                    query_embeddings
+                    @ embeddings[start : start + ANN_RECALL_CORPUS_CHUNK_SIZE].T
+                    for start in range(
+                        0, total_embeddings, ANN_RECALL_CORPUS_CHUNK_SIZE
                     )
+                ],
+                axis=1,
+            )
+            scores[np.arange(len(rows)), rows] = -np.inf
+            neighbours = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            neighbour_scores = np.take_along_axis(scores, neighbours, axis=1)
+            for row, row_neighbours, row_scores in zip(
+                rows.tolist(), neighbours, neighbour_scores
+            ):
+                for neighbour in row_neighbours[
+                    (row_scores >= similarity_threshold) & (row_neighbours > row)
+                ].tolist():
+                    expected += 1
+                    found += (row, neighbour) in found_pairs
+        return found / expected if expected else 1.0
 
-                    for query_itr, (values, indices) in enumerate(
-                        zip(scores_top_k_values, scores_top_k_idx)
-                    ):
-                        i = query_start_idx + query_itr
-                        for score, j in zip(values, indices):
-                            j = corpus_start_idx + j.item()
-                            if (
-                                i < j and score >= similarity_threshold
-                            ):  # Avoid duplicate pairs and self-comparisons
-                                heapq.heappush(pairs, (-score.item(), i, j))
-                                if len(pairs) > max_pairs:
-                                    heapq.heappop(pairs)
+    @staticmethod
+    def normalize_embeddings(
+        embeddings: "List[List[float]] | np.ndarray | EmbeddingMatrix",
+    ) -> "np.ndarray | EmbeddingMatrix":
+        """
+        L2-normalizes embeddings into a float32 array. Embedding store views are
+        already normalized, and are read block by block by the mining functions
+        rather than loaded whole.
+        """
+        if isinstance(embeddings, EmbeddingMatrix):
+            return embeddings
+        # Cosine similarity on CPU is a plain matrix product, which numpy computes
+        # with the same BLAS kernels as torch without importing it
+        embeddings_array = np.array(embeddings, dtype=np.float32)
+        embeddings_array /= np.maximum(
+            np.linalg.norm(embeddings_array, axis=1, keepdims=True), 1e-8
+        )
+        return embeddings_array
+
+    @staticmethod
+    def iter_pairs(
+        embeddings: "List[List[float]] | np.ndarray | EmbeddingMatrix",
+        top_k: int = 100,
+        query_chunk_size: int = 5000,
+        corpus_chunk_size: int = 100000,
+        similarity_threshold: float = 0.5,
+        mining: str = "exact",
+        ann_ef: int = ANN_EF,
+        query_count: int | None = None,
+        mining_workers: int | None = 1,
+        projection: PcaProjection | None = None,
+        pca_margin: float = PCA_MARGIN,
+        neighbour_lists: bool = False,
+    ) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Yields the similar pairs of embeddings block by block, with the given mode.
+
+        Exact mining of large sets is spread over `mining_workers` processes, None
+        for one per CPU; ANN mining is already multi-threaded by hnswlib. PCA mining
+        uses `projection`, fitted on the embeddings when None.
+
+        With `neighbour_lists`, each block holds the neighbours j != i of some query
+        rows i, on both sides of the diagonal, and every neighbour of a row is in
+        the same block.
+
+        Yields:
+            tuple: The scores and the row indices i < j of the pairs of a block.
+        """
+        embeddings_array = ImageAnalyzer.normalize_embeddings(embeddings)
+        if mining == "ann":
+            yield from ImageAnalyzer.iter_pair_blocks_ann(
+                embeddings_array,
+                top_k=top_k,
+                query_chunk_size=query_chunk_size,
+                similarity_threshold=similarity_threshold,
+                ef=ann_ef,
+                query_count=query_count,
+                neighbour_lists=neighbour_lists,
+            )
+        elif mining == "pca":
+            yield from ImageAnalyzer.iter_pair_blocks_pca(
+                embeddings_array,
+                projection or PcaProjection.fit(embeddings_array),
+                top_k=top_k,
+                query_chunk_size=query_chunk_size,
+                corpus_chunk_size=corpus_chunk_size,
+                similarity_threshold=similarity_threshold,
+                margin=pca_margin,
+                query_count=query_count,
+                neighbour_lists=neighbour_lists,
+            )
+        elif mining == "exact":
+            if mining_workers != 1 and len(embeddings_array) >= PARALLEL_MIN_EMBEDDINGS:
+                from .parallel_mining import iter_pair_blocks_parallel
+
+                yield from iter_pair_blocks_parallel(
+                    embeddings_array,
+                    top_k=top_k,
+                    similarity_threshold=similarity_threshold,
+                    query_count=query_count,
+                    workers=mining_workers,
+                    corpus_chunk_size=corpus_chunk_size,
+                    neighbour_lists=neighbour_lists,
+                )
+            else:
+                yield from ImageAnalyzer.iter_pair_blocks(
+                    embeddings_array,
+                    top_k=top_k,
+                    query_chunk_size=query_chunk_size,
+                    corpus_chunk_size=corpus_chunk_size,
+                    similarity_threshold=similarity_threshold,
+                    query_count=query_count,
+                    neighbour_lists=neighbour_lists,
+                )
+        else:
+            raise ValueError(
+                f"Unknown mining mode {mining!r}, expected one of {MINING_MODES}"
+            )
+
+    @staticmethod
+    def mine_pairs(
+        embeddings: "List[List[float]] | np.ndarray | EmbeddingMatrix",
+        top_k: int = 100,
+        max_pairs: int = 500000,
+        query_chunk_size: int = 5000,
+        corpus_chunk_size: int = 100000,
+        similarity_threshold: float = 0.5,
+        mining: str = "exact",
+        ann_ef: int = ANN_EF,
+        ann_recall_sample: int = 0,
+        query_count: int | None = None,
+        mining_workers: int | None = 1,
+        projection: PcaProjection | None = None,
+        pca_margin: float = PCA_MARGIN,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Normalizes the embeddings and mines their best `max_pairs` pairs, see
+        `iter_pairs`. In ANN and PCA modes, the recall against exact mining is
+        reported on `ann_recall_sample` sampled embeddings.
+
+        Returns:
+            tuple: The scores and the row indices i < j of the pairs, highest scores first.
+        """
+        embeddings_array = ImageAnalyzer.normalize_embeddings(embeddings)
+        aggregator = PairAggregator(max_pairs)
+        for block_pairs in ImageAnalyzer.iter_pairs(
+            embeddings_array,
+            top_k=top_k,
+            query_chunk_size=query_chunk_size,
+            corpus_chunk_size=corpus_chunk_size,
+            similarity_threshold=similarity_threshold,
+            mining=mining,
+            ann_ef=ann_ef,
+            query_count=query_count,
+            mining_workers=mining_workers,
+            projection=projection,
+            pca_margin=pca_margin,
+        ):
+            aggregator.add(*block_pairs)
+        scores, i_indices, j_indices = aggregator.result()
+
+        if mining != "exact" and ann_recall_sample:
+            ImageAnalyzer.report_recall(
+                embeddings_array,
+                i_indices,
+                j_indices,
+                mining,
+                top_k=top_k,
+                similarity_threshold=similarity_threshold,
+                sample_size=ann_recall_sample,
+                query_count=query_count,
+            )
+        return scores, i_indices, j_indices
 
-                if len(pairs) >= max_pairs:
-                    break
+    @staticmethod
+    def report_recall(
+        embeddings: "np.ndarray | EmbeddingMatrix",
+        pair_i: np.ndarray,
+        pair_j: np.ndarray,
+        mining: str,
+        sample_size: int,
+        query_count: int | None = None,
+        **recall_settings,
+    ):
+        """Prints the recall of an approximate mining mode, see `measure_ann_recall`."""
+        recall = ImageAnalyzer.measure_ann_recall(
+            embeddings,
+            pair_i,
+            pair_j,
+            sample_size=sample_size,
+            query_count=query_count,
+            **recall_settings,
+        )
+        sampled = min(
+            sample_size, len(embeddings) if query_count is None else query_count
+        )
+        print(
+            f"{mining.upper()} recall against exact mining on {sampled} images: {recall:.4f}"
+        )
 
-            if len(pairs) >= max_pairs:
-                break
+    @staticmethod
+    def paraphrase_mining_embeddings_v2(
+        embeddings: "List[List[float]] | EmbeddingMatrix",
+        metadatas: "List[Metadata]",
+        top_k: int = 100,
+        max_pairs: int = 500000,
+        query_chunk_size: int = 5000,
+        corpus_chunk_size: int = 100000,
+        similarity_threshold: float = 0.5,
+        mining: str = "exact",
+        ann_ef: int = ANN_EF,
+        ann_recall_sample: int = 0,
+        mining_workers: int | None = 1,
+        projection: PcaProjection | None = None,
+        pca_margin: float = PCA_MARGIN,
+    ) -> List[Tuple[float, str, str]]:
+        scores, i_indices, j_indices = ImageAnalyzer.mine_pairs(
+            embeddings,
+            top_k=top_k,
+            max_pairs=max_pairs,
+            query_chunk_size=query_chunk_size,
+            corpus_chunk_size=corpus_chunk_size,
+            similarity_threshold=similarity_threshold,
+            mining=mining,
+            ann_ef=ann_ef,
+            ann_recall_sample=ann_recall_sample,
+            mining_workers=mining_workers,
+            projection=projection,
+            pca_margin=pca_margin,
+        )
 
         # Convert to final format
-        result = [
-            (-neg_score, metadatas[i]["path"], metadatas[j]["path"])
-            for neg_score, i, j in heapq.nlargest(max_pairs, pairs)
+        return [
+            (score, metadatas[i]["path"], metadatas[j]["path"])
+            for score, i, j in zip(
+                scores.tolist(), i_indices.tolist(), j_indices.tolist()
+            )
         ]
 
-        return result
+    @staticmethod
+    def _new_images_first(
+        image_hashes: list[str], pair_store: "PairStore"
+    ) -> tuple[list[int], int]:
+        """
+        Syncs the pair store with the images, and orders the images never mined in
+        front of the others, so that mining the leading rows finds every pair
+        involving one of them exactly once.
+
+        Returns:
+            tuple: The order of the images and the number of images never mined.
+        """
+        new_hashes = set(pair_store.sync(image_hashes))
+        order = sorted(
+            range(len(image_hashes)),
+            key=lambda index: image_hashes[index] not in new_hashes,
+        )
+        if new_hashes:
+            print(
+                f"Mining {len(new_hashes)} new images against {len(image_hashes)} images..."
+            )
+        else:
+            print("No new images to mine, reusing the stored pairs.")
+        return order, len(new_hashes)
+
+    @staticmethod
+    def mine_pairs_incrementally(
+        embeddings: "EmbeddingMatrix",
+        image_hashes: list[str],
+        pair_store: "PairStore",
+        **mining_settings,
+    ) -> List[Tuple[float, str, str]]:
+        """
+        Mines only the images missing from the pair store against every image, and
+        merges the pairs found into the store.
+
+        The pairs are not capped by `max_pairs`, the store records the mined images
+        as done, so a pair dropped here would never be mined again.
+
+        Parameters:
+            embeddings (EmbeddingMatrix): The embeddings of the images.
+            image_hashes (list[str]): The content hash of each embedding.
+            pair_store (PairStore): The pairs mined by previous runs on the library.
+            **mining_settings: The `mine_pairs` settings.
+
+        Returns:
+            list: Every stored pair of the library as tuples of similarity score and content hashes.
+        """
+        order, new_count = ImageAnalyzer._new_images_first(image_hashes, pair_store)
+        if new_count:
+            scores, i_indices, j_indices = ImageAnalyzer.mine_pairs(
+                embeddings.select(order),
+                query_count=new_count,
+                **{**mining_settings, "max_pairs": None},
+            )
+            ordered_hashes = [image_hashes[index] for index in order]
+            pair_store.add(
+                ordered_hashes[:new_count],
+                [
+                    (score, ordered_hashes[i], ordered_hashes[j])
+                    for score, i, j in zip(
+                        scores.tolist(), i_indices.tolist(), j_indices.tolist()
+                    )
+                ],
+            )
+        return pair_store.pairs()
+
+    @staticmethod
+    def iter_neighbour_list_updates(
+        embeddings: "EmbeddingMatrix",
+        new_count: int,
+        top_k: int = 100,
+        query_chunk_size: int = 5000,
+        corpus_chunk_size: int = 100000,
+        similarity_threshold: float = 0.5,
+        **mining_settings,
+    ) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Yields the neighbours the leading `new_count` rows bring to the lists of the
+        other rows: each other row is ranked exactly against the new rows only,
+        which costs O(new_count * N).
+
+        Yields:
+            tuple: The scores, the rows i >= new_count and their new neighbours j < new_count.
+        """
+        total_embeddings = len(embeddings)
+        for query_start_idx in range(new_count, total_embeddings, query_chunk_size):
+            query_embeddings = embeddings[
+                query_start_idx : query_start_idx + query_chunk_size
+            ]
+            aggregator = PairAggregator()
+            for corpus_start_idx in range(0, new_count, corpus_chunk_size):
+                block_pairs = ImageAnalyzer.mine_block(
+                    query_embeddings,
+                    embeddings[
+                        corpus_start_idx : min(
+                            corpus_start_idx + corpus_chunk_size, new_count
+                        )
+                    ],
+                    query_start_idx,
+                    corpus_start_idx,
+                    top_k=top_k,
+                    similarity_threshold=similarity_threshold,
+                    neighbour_lists=True,
+                )
+                if block_pairs is not None:
+                    aggregator.add(*block_pairs)
+            if aggregator.total_pairs:
+                yield aggregator.result()
+
+    @staticmethod
+    def iter_pairs_incrementally(
+        embeddings: "EmbeddingMatrix",
+        image_hashes: list[str],
+        pair_store: "PairStore",
+        neighbour_lists: bool = False,
+        **mining_settings,
+    ) -> Iterator[List[Tuple[float, str, str]]]:
+        """
+        Yields the stored pairs of the library, then the pairs of the images missing
+        from the pair store block by block. The new pairs are merged into the store
+        once every block is mined.
+
+        With `neighbour_lists`, the store holds neighbour lists. The lists of the
+        stored images are first completed with the new images that rank among
+        their neighbours, and yielded whole, then the lists of the new images.
+
+        Parameters:
+            embeddings (EmbeddingMatrix): The embeddings of the images.
+            image_hashes (list[str]): The content hash of each embedding.
+            pair_store (PairStore): The pairs mined by previous runs on the library.
+            neighbour_lists (bool): Whether to yield neighbour lists instead of pairs, see `iter_pairs`.
+            **mining_settings: The `iter_pairs` settings.
+
+        Yields:
+            list: Tuples of similarity score and content hashes.
+        """
+        order, new_count = ImageAnalyzer._new_images_first(image_hashes, pair_store)
+        stored_pairs = pair_store.pairs()
+        ordered_hashes = [image_hashes[index] for index in order]
+        ordered_embeddings = embeddings.select(order)
+        new_pairs: List[Tuple[float, str, str]] = []
+        if neighbour_lists and new_count:
+            for (
+                scores,
+                i_indices,
+                j_indices,
+            ) in ImageAnalyzer.iter_neighbour_list_updates(
+                ordered_embeddings, new_count, **mining_settings
+            ):
+                new_pairs += [
+                    (score, ordered_hashes[i], ordered_hashes[j])
+                    for score, i, j in zip(
+                        scores.tolist(), i_indices.tolist(), j_indices.tolist()
+                    )
+                ]
+        if stored_pairs or new_pairs:
+            yield stored_pairs + new_pairs
+        if not new_count:
+            return
+
+        for scores, i_indices, j_indices in ImageAnalyzer.iter_pairs(
+            ordered_embeddings,
+            query_count=new_count,
+            neighbour_lists=neighbour_lists,
+            **mining_settings,
+        ):
+            block_pairs = [
+                (score, ordered_hashes[i], ordered_hashes[j])
+                for score, i, j in zip(
+                    scores.tolist(), i_indices.tolist(), j_indices.tolist()
+                )
+            ]
+            new_pairs += block_pairs
+            yield block_pairs
+        # Only a complete mining is recorded, an interrupted one starts over
+        pair_store.add(ordered_hashes[:new_count], new_pairs)
+
+    def _fill_embedding_store(self, image_hashes: list[str]):
+        """
+        Copies the embeddings indexed before the embedding store existed into it.
+        """
+        from chromadb.api.types import IncludeEnum
+
+        stored_rows = self.embedding_store.lookup_rows(image_hashes)
+        missing_hashes = [
+            image_hash for image_hash in image_hashes if image_hash not in stored_rows
+        ]
+        if not missing_hashes:
+            return
+        print(f"Copying {len(missing_hashes)} embeddings into the embedding store...")
+        for chunk in chunkify(
+            missing_hashes, chunk_size=EMBEDDING_STORE_FILL_CHUNK_SIZE
+        ):
+            docs = self.collection.get(ids=chunk, include=[IncludeEnum.embeddings])
+            self.embedding_store.add(docs["ids"], docs["embeddings"])
+
+    def _load_embeddings(
+        self, path_to_hash_map: dict[str, str], limit: int | None = None
+    ) -> tuple["EmbeddingMatrix", list[str], List[Any]]:
+        """
+        Resolves the embeddings of the images that are not marked as deleted.
+
+        Returns:
+            tuple: The embeddings, and the content hash and metadata of each of them.
+        """
+        self._import_manifest()
+        hash_to_indexed_path = self.manifest.active_images(
+            list(path_to_hash_map.values()), limit=limit
+        )
+        self._fill_embedding_store(list(hash_to_indexed_path))
+        # Mining reads the embeddings from the memory-mapped store, not from Chroma
+        embeddings, stored_hashes = self.embedding_store.matrix(
+            list(hash_to_indexed_path)
+        )
+        # Report the scanned path of each hash, the stored one may be an identical copy
+        hash_to_path = {v: k for k, v in path_to_hash_map.items()}
+        metadatas: List[Any] = [
+            {
+                "path": hash_to_path.get(image_hash, hash_to_indexed_path[image_hash]),
+                "deleted": False,
+            }
+            for image_hash in stored_hashes
+        ]
+        return embeddings, stored_hashes, metadatas
+
+    @staticmethod
+    def iter_row_pairs(
+        embeddings: "EmbeddingMatrix",
+        image_hashes: list[str],
+        pair_store: "PairStore | None" = None,
+        neighbour_lists: bool = False,
+        **mining_settings,
+    ) -> Iterator[np.ndarray]:
+        """
+        Yields the similar pairs of the embeddings block by block, as structured
+        arrays of PAIR_DTYPE whose ids are row indices, the smaller one first.
+
+        Parameters:
+            embeddings (EmbeddingMatrix): The embeddings of the images.
+            image_hashes (list[str]): The content hash of each embedding.
+            pair_store (PairStore | None): The pairs mined by previous runs, yielded first, to only mine the new images.
+            neighbour_lists (bool): Whether to yield neighbour lists, the row first, see `iter_pairs`.
+            **mining_settings: The `iter_pairs` settings.
+        """
+        if pair_store is not None and pair_store.neighbour_lists != neighbour_lists:
+            raise ValueError(
+                "The pair store and the mining must both hold pairs or neighbour lists"
+            )
+        if pair_store is None:
+            for scores, i_indices, j_indices in ImageAnalyzer.iter_pairs(
+                embeddings, neighbour_lists=neighbour_lists, **mining_settings
+            ):
+                yield make_pairs(scores, i_indices, j_indices)
+        else:
+            hash_to_row = {
+                image_hash: row for row, image_hash in enumerate(image_hashes)
+            }
+            for hash_pairs in ImageAnalyzer.iter_pairs_incrementally(
+                embeddings,
+                image_hashes,
+                pair_store,
+                neighbour_lists=neighbour_lists,
+                **mining_settings,
+            ):
+                yield hash_pairs_to_ids(hash_pairs, hash_to_row, neighbour_lists)
+
+    @staticmethod
+    def _load_graph(
+        graph_cache: NeighbourGraphCache,
+        path_to_hash_map: dict[str, str],
+        top_k: int,
+        threshold: float,
+    ) -> tuple[NeighbourGraph, list[str]] | None:
+        """
+        Returns the cached neighbour graph of the images and the path of each of
+        its images, None if it was not cached or was mined with stricter settings.
+        """
+        graph = graph_cache.load(list(path_to_hash_map.values()))
+        if graph is None or not graph.covers(top_k, threshold):
+            return None
+        print(f"Filtering the cached neighbour graph of {len(graph.hashes)} images...")
+        hash_to_path = {v: k for k, v in path_to_hash_map.items()}
+        return graph, [hash_to_path[image_hash] for image_hash in graph.hashes]
+
+    async def stream_similar_pairs(
+        self,
+        path_to_hash_map: dict[str, str],
+        path_table: PathTable,
+        top_k=10,
+        threshold=0.9,
+        mining="exact",
+        ann_ef=ANN_EF,
+        pair_store: "PairStore | None" = None,
+        mining_workers: int | None = None,
+        pca_margin: float = PCA_MARGIN,
+        graph_cache: NeighbourGraphCache | None = None,
+    ) -> AsyncIterator[np.ndarray]:
+        """
+        Yields near duplicates block by block while the similarity matrix is mined.
+
+        Mining runs in a worker thread that hands each block of pairs over through
+        a bounded queue, so consumers can score the first pairs long before the
+        last block is mined. Pairs are not sorted across blocks; aggregate them
+        when a global order or a top N is needed.
+
+        Pairs refer to the images by their id in `path_table`, paths are only
+        materialized by the code that opens or reports the images.
+
+        Parameters:
+            path_to_hash_map (dict[str, str]): A dictionary mapping image paths to their hash values.
+            path_table (PathTable): The table interning the paths of the pairs.
+            top_k (int): The number of near duplicates to find per image and block.
+            threshold (float): The minimum similarity of a pair.
+            mining (str): "exact" for blocked brute-force cosine, "ann" for approximate nearest neighbour search, "pca" for candidates from PCA-reduced embeddings re-ranked at full precision.
+            ann_ef (int): The HNSW search breadth in ANN mode, higher is slower with better recall.
+            pair_store (PairStore | None): The pairs mined by previous runs, yielded first, to only mine the new images.
+            mining_workers (int | None): The number of processes of exact mining, None for one per CPU.
+            pca_margin (float): How far below the threshold candidates are searched in PCA mode.
+            graph_cache (NeighbourGraphCache | None): The neighbour graphs of previous scans, filtered instead of mining an unchanged set of images.
+
+        Yields:
+            np.ndarray: The pairs of a block, of PAIR_DTYPE.
+        """
+        loop = asyncio.get_running_loop()
+        mining_top_k, mining_threshold = top_k, threshold
+        if graph_cache is not None:
+            cached = await loop.run_in_executor(
+                None, self._load_graph, graph_cache, path_to_hash_map, top_k, threshold
+            )
+            if cached is not None:
+                graph, graph_paths = cached
+                pairs = remap_pairs(
+                    graph.filter(top_k, threshold), path_table.intern_many(graph_paths)
+                )
+                for start in range(0, len(pairs), GRAPH_BLOCK_SIZE):
+                    yield pairs[start : start + GRAPH_BLOCK_SIZE]
+                return
+            mining_top_k, mining_threshold = get_graph_mining_settings(top_k, threshold)
+
+        embeddings, stored_hashes, metadatas = await loop.run_in_executor(
+            None, self._load_embeddings, path_to_hash_map
+        )
+        # The id of each row of the embedding matrix
+        ids = path_table.intern_many(metadata["path"] for metadata in metadatas)
+        mining_settings = dict(
+            top_k=mining_top_k,
+            similarity_threshold=mining_threshold,
+            mining=mining,
+            ann_ef=ann_ef,
+            mining_workers=mining_workers,
+            pca_margin=pca_margin,
+        )
+        pair_queue: asyncio.Queue = asyncio.Queue(maxsize=PAIR_QUEUE_SIZE)
+        stop_event = threading.Event()
+
+        def _put(item: Any):
+            asyncio.run_coroutine_threadsafe(pair_queue.put(item), loop).result()
+
+        def _mine():
+            try:
+                if mining == "pca":
+                    mining_settings["projection"] = self.embedding_store.projection(
+                        embeddings
+                    )
+                graph_blocks = []
+                for pairs in self.iter_row_pairs(
+                    embeddings,
+                    stored_hashes,
+                    pair_store,
+                    neighbour_lists=graph_cache is not None,
+                    **mining_settings,
+                ):
+                    if stop_event.is_set():
+                        return
+                    if graph_cache is not None:
+                        # Each block holds whole neighbour lists, so it is
+                        # filtered on its own
+                        graph_blocks.append(pairs)
+                        pairs = filter_graph_pairs(pairs, top_k, threshold)
+                    _put(remap_pairs(pairs, ids))
+                if graph_cache is not None:
+                    graph_cache.save(
+                        list(path_to_hash_map.values()),
+                        NeighbourGraph(
+                            stored_hashes,
+                            concatenate_pairs(graph_blocks),
+                            mining_top_k,
+                            mining_threshold,
+                        ),
+                    )
+            except Exception as e:
+                _put(e)
+            finally:
+                _put(None)
+
+        mining_task = loop.run_in_executor(None, _mine)
+        try:
+            while (item := await pair_queue.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+            await mining_task
+        finally:
+            # Unblock the mining thread if the consumer stopped early
+            stop_event.set()
+            while not pair_queue.empty():
+                pair_queue.get_nowait()
 
     async def similarity_search(
         self,
@@ -328,6 +1624,13 @@ class ImageAnalyzer:
         top_k=10,
         limit: int | None = None,
         threshold=0.9,
+        mining="exact",
+        ann_ef=ANN_EF,
+        ann_recall_sample=0,
+        pair_store: "PairStore | None" = None,
+        mining_workers: int | None = None,
+        pca_margin: float = PCA_MARGIN,
+        graph_cache: NeighbourGraphCache | None = None,
     ) -> List[tuple[float, str, str]]:
         """
         Search for near duplicates using the given image embeddings.
@@ -336,34 +1639,119 @@ class ImageAnalyzer:
             image_paths (list[str]): A list of image paths to search for near duplicates.
             top_k (int): The number of near duplicates to find.
             limit (int): The maximum number of near duplicates to find.
+            mining (str): "exact" for blocked brute-force cosine, "ann" for approximate nearest neighbour search, "pca" for candidates from PCA-reduced embeddings re-ranked at full precision.
+            ann_ef (int): The HNSW search breadth in ANN mode, higher is slower with better recall.
+            ann_recall_sample (int): The number of images whose ANN pairs are checked against exact mining, 0 to skip.
+            pair_store (PairStore | None): The pairs mined by previous runs, to only mine the new images. None to mine every image.
+            mining_workers (int | None): The number of processes of exact mining, None for one per CPU.
+            pca_margin (float): How far below the threshold candidates are searched in PCA mode.
+            graph_cache (NeighbourGraphCache | None): The neighbour graphs of previous scans, filtered instead of mining an unchanged set of images.
 
         Returns:
             list: A list of tuples containing the similarity score, the paths of the two images.
         """
-        image_hashes = list(path_to_hash_map.values())
-        all_docs = self.collection.get(
-            ids=image_hashes,
-            where={"deleted": False},
-            limit=limit,
-            include=[IncludeEnum.embeddings, IncludeEnum.metadatas],
-        )
-        embeddings: List[Any] = all_docs["embeddings"] or []
-        metadatas: List[Any] = all_docs["metadatas"] or []
+        # Mining is CPU bound, keep the event loop responsive while it runs
+        loop = asyncio.get_running_loop()
+        mining_top_k, mining_threshold = top_k, threshold
+        if graph_cache is not None:
+            cached = await loop.run_in_executor(
+                None, self._load_graph, graph_cache, path_to_hash_map, top_k, threshold
+            )
+            if cached is not None:
+                graph, graph_paths = cached
+                pairs = sort_pairs(graph.filter(top_k, threshold))
+                return PathTable(graph_paths).to_tuples(pairs[:limit])
+            mining_top_k, mining_threshold = get_graph_mining_settings(top_k, threshold)
 
-        near_duplicates = self.paraphrase_mining_embeddings_v2(
-            embeddings=embeddings,
-            top_k=top_k,
-            metadatas=metadatas,
-            similarity_threshold=threshold,
+        embeddings, stored_hashes, metadatas = await loop.run_in_executor(
+            None,
+            self._load_embeddings,
+            path_to_hash_map,
+            # The pair store and the neighbour graph need every image
+            limit if pair_store is None and graph_cache is None else None,
         )
+        mining_settings = dict(
+            top_k=mining_top_k,
+            similarity_threshold=mining_threshold,
+            mining=mining,
+            ann_ef=ann_ef,
+            ann_recall_sample=ann_recall_sample,
+            mining_workers=mining_workers,
+            pca_margin=pca_margin,
+        )
+        if mining == "pca":
+            # The projection is saved with the embeddings, and fitted on the whole
+            # library even when only the new images are mined
+            mining_settings["projection"] = await loop.run_in_executor(
+                None, self.embedding_store.projection, embeddings
+            )
+        if graph_cache is not None:
+            # The graph keeps every neighbour list whole, without the pair cap of
+            # `mine_pairs`, or filtering it would keep pairs exact mining drops
+            del mining_settings["ann_recall_sample"]
+            pairs = await loop.run_in_executor(
+                None,
+                lambda: concatenate_pairs(
+                    list(
+                        self.iter_row_pairs(
+                            embeddings,
+                            stored_hashes,
+                            pair_store,
+                            neighbour_lists=True,
+                            **mining_settings,
+                        )
+                    )
+                ),
+            )
+        elif pair_store is None:
+            scores, i_indices, j_indices = await loop.run_in_executor(
+                None, partial(self.mine_pairs, embeddings, **mining_settings)
+            )
+            pairs = make_pairs(scores, i_indices, j_indices)
+        else:
+            hash_pairs = await loop.run_in_executor(
+                None,
+                partial(
+                    self.mine_pairs_incrementally,
+                    embeddings,
+                    stored_hashes,
+                    pair_store,
+                    **mining_settings,
+                ),
+            )
+            pairs = hash_pairs_to_ids(
+                hash_pairs,
+                {image_hash: row for row, image_hash in enumerate(stored_hashes)},
+            )
 
-        if limit is not None:
-            near_duplicates = near_duplicates[:limit]
+        if graph_cache is not None:
+            await loop.run_in_executor(
+                None,
+                graph_cache.save,
+                list(path_to_hash_map.values()),
+                NeighbourGraph(stored_hashes, pairs, mining_top_k, mining_threshold),
+            )
+            pairs = filter_graph_pairs(pairs, top_k, threshold)
+            if mining != "exact" and ann_recall_sample:
+                self.report_recall(
+                    embeddings,
+                    pairs["id1"],
+                    pairs["id2"],
+                    mining,
+                    top_k=top_k,
+                    similarity_threshold=threshold,
+                    sample_size=ann_recall_sample,
+                )
 
-        return near_duplicates
+        # Only the reported pairs are turned back into paths
+        path_table = PathTable(metadata["path"] for metadata in metadatas)
+        return path_table.to_tuples(sort_pairs(pairs)[:limit])
 
     @staticmethod
-    def remove_invalid_pairs(near_duplicates: list[tuple[float, str, str]]):
+    def remove_invalid_pairs(
+        near_duplicates: list[tuple[float, str, str]],
+        scanned_paths: "set[str] | None" = None,
+    ):
         """
         Generate image pairs from the near duplicates list.
 
@@ -371,10 +1759,18 @@ class ImageAnalyzer:
 
         Parameters:
             near_duplicates (list): A list of tuples containing the similarity score, the paths of the two images.
+            scanned_paths (set[str] | None): The images found by the scan, checked instead of the file system when given.
 
         Returns:
             list: A list of tuples containing the image names, the indices of the two images, and the similarity score.
         """
+        if scanned_paths is not None:
+            return [
+                (score, img1_path, img2_path)
+                for score, img1_path, img2_path in near_duplicates
+                if img1_path in scanned_paths and img2_path in scanned_paths
+            ]
+
         import os
 
         valid_pairs = [
@@ -386,11 +1782,35 @@ class ImageAnalyzer:
         return valid_pairs
 
     async def mark_images_as_deleted(self, image_paths: list[str]):
-        path_to_hash_map = await calculate_file_hashes(image_paths)
+        """
+        Marks the images of swept files as deleted, so they are no longer mined.
+
+        Files are looked up by the path the scan saw them at, so they can be marked
+        once moved. Identical copies share one image, which is only marked when no
+        other known copy is left outside `image_paths`.
+
+        Parameters:
+            image_paths (list[str]): The paths of the swept files.
+        """
+        self._import_manifest()
+        swept_paths = set(image_paths)
+        deleted_hashes = [
+            image_hash
+            for image_hash in dict.fromkeys(
+                self.manifest.path_hashes(image_paths).values()
+            )
+            if not any(
+                path not in swept_paths and os.path.exists(path)
+                for path in self.manifest.paths(image_hash)
+            )
+        ]
+        if not deleted_hashes:
+            return
+        deleted_at = datetime.now().isoformat()
         self.collection.update(
-            ids=list(path_to_hash_map.values()),
+            ids=deleted_hashes,
             metadatas=[
-                {"deleted": True, "deleted_at": datetime.now().isoformat()}
-                for _ in image_paths
+                {"deleted": True, "deleted_at": deleted_at} for _ in deleted_hashes
             ],
         )
+        self.manifest.mark_deleted(deleted_hashes)
@@ -0,0 +1,125 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+
+import numpy as np
+from PIL import Image, ImageOps
+
+CLIP_INPUT_SIZE = 224
+
+
+def open_image_reduced(file_path: str, min_size: tuple[int, int]) -> Image.Image:
+    """
+    Opens an image so that it decodes at the smallest resolution covering `min_size`.
+
+    JPEG images are decoded with DCT scaling (1/2, 1/4 or 1/8 of the original size)
+    and JPEG 2000 images at a lower resolution level, which skips most of the decoding
+    work for large camera files. Other formats are decoded at full size. The reduction
+    happens before any EXIF rotation, so `min_size` should be square when orientation
+    matters.
+
+    Parameters:
+        file_path (str): The path to the image.
+        min_size (tuple[int, int]): The minimum width and height needed by the caller.
+
+    Returns:
+        Image.Image: The opened, not yet loaded, image.
+    """
+    image = Image.open(file_path)
+    if image.format == "JPEG2000":
+        factor = 0
+        while all(
+            (dimension >> (factor + 1)) >= target
+            for dimension, target in zip(image.size, min_size)
+        ):
+            factor += 1
+        image.reduce = factor  # type: ignore
+    else:
+        # No-op for formats without a reduced decoding mode
+        image.draft(None, min_size)
+    return image
+
+
+def load_image_for_embedding(
+    file_path: str, size: int = CLIP_INPUT_SIZE
+) -> np.ndarray | None:
+    """
+    Decodes an image and prepares it for the CLIP encoder.
+
+    The image is rotated according to its EXIF orientation, converted to RGB and
+    downsampled so that its shortest side matches the encoder input resolution, the
+    same resize the CLIP processor would otherwise apply to the full-size image.
+
+    Parameters:
+        file_path (str): The path to the image.
+        size (int): The target length of the shortest side.
+
+    Returns:
+        np.ndarray | None: The RGB pixels as a uint8 array, or None if the image cannot be decoded.
+    """
+    try:
+        with open_image_reduced(file_path, (size, size)) as image:
+            image = ImageOps.exif_transpose(image) or image
+            image = image.convert("RGB")
+            width, height = image.size
+            scale = size / min(width, height)
+            if scale < 1:
+                image = image.resize(
+                    (max(size, int(width * scale)), max(size, int(height * scale))),
+                    Image.Resampling.BICUBIC,
+                )
+            return np.asarray(image)
+    except Exception as e:
+        print(f"Failed to decode {file_path}: {e}")
+        return None
+
+
+class ImageDecoder:
+    """
+    Decodes images for embedding in parallel on a process pool.
+
+    Workers only send back the downsampled pixel arrays, so the cost of handing an
+    image to the encoder does not depend on the resolution of the original file.
+    The pool is started on first use.
+    """
+
+    def __init__(self, max_workers: int | None = None, size: int = CLIP_INPUT_SIZE):
+        self.max_workers = max_workers or os.cpu_count() or 4
+        self.size = size
+        self.lock = Lock()
+        self.executor: ProcessPoolExecutor | None = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self.executor
+
+    def decode(self, file_paths: list[str]) -> list[Image.Image | None]:
+        """
+        Decodes the given images in parallel.
+
+        Parameters:
+            file_paths (list[str]): The paths to the images.
+
+        Returns:
+            list[Image.Image | None]: The preprocessed images, None for the ones that failed to decode.
+        """
+        if not file_paths:
+            return []
+        chunk_size = max(1, len(file_paths) // (self.max_workers * 4))
+        arrays = self._get_executor().map(
+            load_image_for_embedding,
+            file_paths,
+            [self.size] * len(file_paths),
+            chunksize=chunk_size,
+        )
+        return [
+            Image.fromarray(array) if array is not None else None for array in arrays
+        ]
+
+    def close(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
@@ -0,0 +1,255 @@
+import os
+import sqlite3
+import time
+from datetime import datetime
+from threading import Lock
+from typing import Iterable
+
+from .embedding_backends import get_backend_index_name
+from .hash_cache import SQLITE_MAX_PARAMETERS
+from .utils import chunkify, get_database_path
+
+IMAGE_MANIFEST_FILE_NAME = "image_manifest.sqlite3"
+STATUS_ACTIVE = "active"
+STATUS_DELETED = "deleted"
+
+
+class ImageManifest:
+    """
+    Local record of the indexed images, next to the vector database.
+
+    Each content hash has the path its embedding was indexed under, a status
+    (active, or deleted once swept), whether its embedding is stored and when a
+    scan last saw it. Every scanned path is recorded with its hash, so a hash
+    resolves to all its known paths.
+
+    A scan is diffed against the manifest with indexed joins on a temporary table
+    of the scanned images, instead of querying the vector database with the whole
+    list of hashes and paths. The vector database is only written to.
+
+    Each embedding backend has its own manifest, next to its own collection.
+
+    Parameters:
+        embedding_backend (str): The backend whose embeddings are recorded.
+        db_path (str | None): The path of the SQLite database. Default is in the database directory.
+    """
+
+    def __init__(self, embedding_backend: str = "torch", db_path: str | None = None):
+        self.db_path = db_path or os.path.join(
+            get_database_path(),
+            get_backend_index_name(IMAGE_MANIFEST_FILE_NAME, embedding_backend),
+        )
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self.lock = Lock()
+        self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                hash TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                embedded INTEGER NOT NULL,
+                last_seen REAL,
+                deleted_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS image_paths (
+                path TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                last_seen REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS image_paths_hash ON image_paths (hash);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TEMP TABLE IF NOT EXISTS scan (
+                path TEXT PRIMARY KEY,
+                hash TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS temp.scan_hash ON scan (hash);
+            """
+        )
+        self.connection.commit()
+
+    @property
+    def is_imported(self) -> bool:
+        """Tells whether the images indexed before the manifest existed were imported."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM meta WHERE key = 'imported'"
+            ).fetchone()
+        return row is not None
+
+    def import_images(self, entries: Iterable[tuple[str, str, bool]]):
+        """
+        Records the images of an existing vector database, once.
+
+        Parameters:
+            entries (Iterable[tuple[str, str, bool]]): Tuples of content hash, indexed path and deleted flag.
+        """
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO images (hash, path, status, embedded) "
+                "VALUES (?, ?, ?, 1)",
+                (
+                    (image_hash, path, STATUS_DELETED if deleted else STATUS_ACTIVE)
+                    for image_hash, path, deleted in entries
+                ),
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('imported', '1')"
+            )
+            self.connection.commit()
+
+    def diff(
+        self, path_to_hash_map: dict[str, str]
+    ) -> tuple[list[str], dict[str, str]]:
+        """
+        Splits scanned images into the ones that still need an embedding and the
+        embedded ones whose record is outdated: moved, or deleted and scanned again.
+        Every scanned path is recorded as seen.
+
+        Parameters:
+            path_to_hash_map (dict[str, str]): A dictionary mapping image paths to their hash values.
+
+        Returns:
+            tuple: The paths to embed, and the paths and hashes of the outdated records.
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute("DELETE FROM scan")
+            self.connection.executemany(
+                "INSERT INTO scan (path, hash) VALUES (?, ?)",
+                path_to_hash_map.items(),
+            )
+            new_image_paths = [
+                row[0]
+                for row in self.connection.execute(
+                    "SELECT scan.path FROM scan LEFT JOIN images "
+                    "ON images.hash = scan.hash "
+                    "WHERE images.hash IS NULL OR images.embedded = 0 "
+                    "ORDER BY scan.rowid"
+                )
+            ]
+            # A hash scanned at several paths is recorded under the last one, SQLite
+            # reads the bare columns from the row of MAX(scan.rowid)
+            update_path_to_hash_map = {
+                path: image_hash
+                for path, image_hash, _ in self.connection.execute(
+                    "SELECT scan.path, scan.hash, MAX(scan.rowid) FROM scan "
+                    "JOIN images ON images.hash = scan.hash WHERE images.embedded = 1 "
+                    "AND (images.status != ? OR NOT EXISTS "
+                    "(SELECT 1 FROM scan AS seen WHERE seen.path = images.path)) "
+                    "GROUP BY scan.hash",
+                    (STATUS_ACTIVE,),
+                )
+            }
+            self.connection.execute(
+                "UPDATE images SET last_seen = ? "
+                "WHERE hash IN (SELECT hash FROM scan)",
+                (now,),
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO image_paths (path, hash, last_seen) "
+                "SELECT path, hash, ? FROM scan",
+                (now,),
+            )
+            self.connection.execute("DELETE FROM scan")
+            self.connection.commit()
+        return new_image_paths, update_path_to_hash_map
+
+    def record_embedded(self, path_to_hash_map: dict[str, str]):
+        """Records images whose embedding was just stored."""
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO images "
+                "(hash, path, status, embedded, last_seen) VALUES (?, ?, ?, 1, ?)",
+                (
+                    (image_hash, path, STATUS_ACTIVE, now)
+                    for path, image_hash in path_to_hash_map.items()
+                ),
+            )
+            self.connection.commit()
+
+    def update_paths(self, path_to_hash_map: dict[str, str]):
+        """Records the new path of moved images, and reactivates deleted ones."""
+        with self.lock:
+            self.connection.executemany(
+                "UPDATE images SET path = ?, status = ?, deleted_at = NULL "
+                "WHERE hash = ?",
+                (
+                    (path, STATUS_ACTIVE, image_hash)
+                    for path, image_hash in path_to_hash_map.items()
+                ),
+            )
+            self.connection.commit()
+
+    def mark_deleted(self, image_hashes: list[str]):
+        deleted_at = datetime.now().isoformat()
+        with self.lock:
+            self.connection.executemany(
+                "UPDATE images SET status = ?, deleted_at = ? WHERE hash = ?",
+                (
+                    (STATUS_DELETED, deleted_at, image_hash)
+                    for image_hash in image_hashes
+                ),
+            )
+            self.connection.commit()
+
+    def active_images(
+        self, image_hashes: list[str], limit: int | None = None
+    ) -> dict[str, str]:
+        """
+        Returns the indexed path of the given hashes that have an embedding and are
+        not deleted, in the given order.
+
+        Parameters:
+            image_hashes (list[str]): The content hashes of the images.
+            limit (int | None): The maximum number of images returned.
+        """
+        found: dict[str, str] = {}
+        with self.lock:
+            for chunk in chunkify(image_hashes, chunk_size=SQLITE_MAX_PARAMETERS):
+                found.update(
+                    self.connection.execute(
+                        "SELECT hash, path FROM images WHERE embedded = 1 "
+                        f"AND status = ? AND hash IN ({', '.join('?' * len(chunk))})",
+                        (STATUS_ACTIVE, *chunk),
+                    ).fetchall()
+                )
+        active_hashes = [
+            image_hash for image_hash in image_hashes if image_hash in found
+        ]
+        return {image_hash: found[image_hash] for image_hash in active_hashes[:limit]}
+
+    def path_hashes(self, paths: list[str]) -> dict[str, str]:
+        """Returns the hash a scan last saw at each of the given paths, when any."""
+        found: dict[str, str] = {}
+        with self.lock:
+            for chunk in chunkify(paths, chunk_size=SQLITE_MAX_PARAMETERS):
+                found.update(
+                    self.connection.execute(
+                        "SELECT path, hash FROM image_paths "
+                        f"WHERE path IN ({', '.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                )
+        return found
+
+    def paths(self, image_hash: str) -> list[str]:
+        """Returns every path a scan saw the given hash at, most recently seen first."""
+        with self.lock:
+            return [
+                row[0]
+                for row in self.connection.execute(
+                    "SELECT path FROM image_paths WHERE hash = ? "
+                    "ORDER BY last_seen DESC",
+                    (image_hash,),
+                )
+            ]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -2,12 +2,13 @@ import asyncio
 import os
 from concurrent.futures import ThreadPoolExecutor
 from threading import Lock
+from typing import AsyncIterator
 
-from brisque import BRISQUE as Btisque
 from numpy import asarray
-from PIL import Image
 from tqdm.asyncio import tqdm
 
+from .duplicate_groups import DuplicateGroup
+from .image_loader import open_image_reduced
 from .utils import chunkify
 
 
@@ -20,12 +21,15 @@ class ImageQualityComparator:
         self.quality_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
 
     def get_numpy_array(self, img_path, pixel_x=64, pixel_y=64):
-        img = Image.open(img_path)
-        resized = img.resize((pixel_x, pixel_y))
+        with open_image_reduced(img_path, (pixel_x, pixel_y)) as img:
+            resized = img.resize((pixel_x, pixel_y))
         ndarray = asarray(resized)
         return ndarray
 
     def compute_quality_score(self, img_path: str) -> float:
+        # brisque pulls in OpenCV and SciPy, import it once a score is needed
+        from brisque import BRISQUE as Btisque
+
         np_array = self.get_numpy_array(img_path)
         with self.lock:
             score = self.scoring_executor.submit(Btisque(url=False).score, img=np_array)
@@ -93,6 +97,118 @@ class ImageQualityComparator:
                     progress_bar.update(1)
         return results
 
+    async def stream_image_quality_comparison(
+        self, pair_blocks: AsyncIterator[list[tuple[float, str, str]]]
+    ) -> AsyncIterator[list[tuple[str, str, float, float, float]]]:
+        """
+        Compares the quality of image pairs as they are mined, block by block.
+
+        The pairs of a block are scored concurrently while the next block is mined,
+        so the first results are available long before mining finishes.
+
+        Parameters:
+            pair_blocks (AsyncIterator[list[tuple[float, str, str]]]): Blocks of tuples containing the similarity score, the paths of the two images.
+
+        Yields:
+            list[tuple[str, str, float, float, float]]: The best and worst image paths, their scores, and the similarity score of each pair of a block.
+        """
+        with tqdm(desc="Processing pairs") as progress_bar:
+            async for img_pairs in pair_blocks:
+                results = []
+                for chunk in chunkify(img_pairs, chunk_size=100):
+                    results += await asyncio.gather(
+                        *[
+                            self._limited_compare_image_quality(
+                                similarity, img1_path, img2_path
+                            )
+                            for similarity, img1_path, img2_path in chunk
+                        ]
+                    )
+                    progress_bar.update(len(chunk))
+                if results:
+                    yield results
+
+    async def perform_exact_duplicate_comparison(
+        self, exact_groups: list[list[str]]
+    ) -> list[tuple[str, str, float, float, float]]:
+        """
+        Builds comparison results for groups of byte-identical images.
+
+        Identical files have identical quality, so only the representative (first path) of
+        each group is scored and every other member is reported as its duplicate.
+
+        Parameters:
+            exact_groups (list[list[str]]): Groups of identical image paths, representative first.
+
+        Returns:
+            list[tuple[str, str, float, float, float]]: A list of tuples containing the kept and duplicate image paths, their scores, and a similarity score of 1.0.
+        """
+        loop = asyncio.get_event_loop()
+        results = []
+
+        async def _score(path: str) -> float:
+            async with self.semaphore:
+                return await loop.run_in_executor(
+                    self.quality_executor, self.compute_quality_score, path
+                )
+
+        scores = await asyncio.gather(*[_score(group[0]) for group in exact_groups])
+        for group, score in zip(exact_groups, scores):
+            representative, *duplicates = group
+            for duplicate in duplicates:
+                results.append((representative, duplicate, score, score, 1.0))
+        return results
+
+    async def perform_group_quality_comparison(
+        self,
+        groups: list[tuple[list[str], float]],
+        score_aliases: dict[str, str] | None = None,
+    ) -> list[DuplicateGroup]:
+        """
+        Scores every member of groups of near duplicates once and picks a keeper per group.
+
+        Parameters:
+            groups (list[tuple[list[str], float]]): The members of each group and their similarity.
+            score_aliases (dict[str, str] | None): Paths sharing the score of another path, e.g. identical copies.
+
+        Returns:
+            list[DuplicateGroup]: The keeper and discards of each group.
+        """
+        loop = asyncio.get_event_loop()
+        score_aliases = score_aliases or {}
+
+        async def _score(path: str) -> float:
+            async with self.semaphore:
+                return await loop.run_in_executor(
+                    self.quality_executor, self.compute_quality_score, path
+                )
+
+        scored_paths = sorted(
+            {
+                score_aliases.get(path, path)
+                for members, _similarity in groups
+                for path in members
+            }
+        )
+        scores: dict[str, float] = {}
+        with tqdm(total=len(scored_paths), desc="Scoring images") as progress_bar:
+            for chunk in chunkify(scored_paths, chunk_size=100):
+                for path, score in zip(
+                    chunk, await asyncio.gather(*[_score(path) for path in chunk])
+                ):
+                    scores[path] = score
+                progress_bar.update(len(chunk))
+
+        results = []
+        for members, similarity in groups:
+            quality_scores = {
+                path: scores[score_aliases.get(path, path)] for path in members
+            }
+            # Identical scores keep the first path, like the exact duplicates do
+            keeper, *discards = sorted(members, key=lambda path: -quality_scores[path])
+            results.append(DuplicateGroup(keeper, discards, quality_scores, similarity))
+        return results
+
     async def _limited_compare_image_quality(
         self, similarity: float, img1_path: str, img2_path: str
     ):
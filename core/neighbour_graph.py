@@ -0,0 +1,145 @@
+import glob
+import hashlib
+import os
+
+import numpy as np
+
+from .pair_table import PAIR_DTYPE, top_k_per_row
+from .utils import get_database_path
+
+NEIGHBOUR_GRAPH_DIR_NAME = "neighbour_graphs"
+# The graph is mined generously, so stricter settings are served by filtering it
+NEIGHBOUR_GRAPH_TOP_K = 32
+NEIGHBOUR_GRAPH_MIN_THRESHOLD = 0.8
+# The number of embedding sets whose graph is kept
+NEIGHBOUR_GRAPH_CACHE_SIZE = 8
+# Bumped when the layout of the pairs changes, so older graphs are mined again
+NEIGHBOUR_GRAPH_VERSION = 2
+
+
+def get_graph_mining_settings(top_k: int, threshold: float) -> tuple[int, float]:
+    """
+    Returns the top k and threshold a neighbour graph is mined with, to serve the
+    given settings and any stricter ones.
+    """
+    return max(top_k, NEIGHBOUR_GRAPH_TOP_K), min(
+        threshold, NEIGHBOUR_GRAPH_MIN_THRESHOLD
+    )
+
+
+class NeighbourGraph:
+    """
+    The neighbour lists of a set of images, mined with a generous top k and a low
+    threshold.
+
+    Pairs are a structured array of PAIR_DTYPE whose ids are positions in
+    `hashes`: id1 is an image and id2 one of its neighbours, so every pair appears
+    once per image that ranks the other among its neighbours. Lists are never
+    truncated, so a stricter threshold or a smaller top k is served by filtering
+    the pairs, without reading a single embedding.
+
+    Parameters:
+        hashes (list[str]): The content hash of each image of the graph.
+        pairs (np.ndarray): The neighbour lists, of PAIR_DTYPE.
+        top_k (int): The number of most similar images kept per image when mining.
+        threshold (float): The minimum similarity of a pair when mining.
+    """
+
+    def __init__(
+        self, hashes: list[str], pairs: np.ndarray, top_k: int, threshold: float
+    ):
+        self.hashes = hashes
+        self.pairs = pairs
+        self.top_k = top_k
+        self.threshold = threshold
+
+    def covers(self, top_k: int, threshold: float) -> bool:
+        """Tells whether the pairs of the given settings can be filtered from the graph."""
+        return top_k <= self.top_k and threshold >= self.threshold
+
+    def filter(self, top_k: int, threshold: float) -> np.ndarray:
+        """Returns the pairs of the given settings, see `filter_graph_pairs`."""
+        return filter_graph_pairs(self.pairs, top_k, threshold)
+
+
+def filter_graph_pairs(pairs: np.ndarray, top_k: int, threshold: float) -> np.ndarray:
+    """
+    Returns the pairs id1 < id2 mining with the given settings keeps from neighbour
+    lists: above the threshold, with id2 among the `top_k` most similar images of
+    id1. Like in exact mining, the image itself is the first of its `top_k` images.
+    Every list must be complete, neighbours ranked beyond `top_k` included.
+    """
+    pairs = pairs[pairs["score"] >= threshold]
+    ranked = top_k_per_row(pairs["id1"], pairs["score"], top_k - 1)
+    return pairs[ranked & (pairs["id1"] < pairs["id2"])]
+
+
+class NeighbourGraphCache:
+    """
+    The neighbour graphs of the most recently mined sets of images, on disk.
+
+    A graph is keyed by a fingerprint of the content hashes of its images and of
+    the mining settings that change its pairs, so a scan of an unchanged library
+    finds the graph of the previous scan. Only the NEIGHBOUR_GRAPH_CACHE_SIZE most
+    recently used graphs are kept.
+
+    Parameters:
+        settings (str): A fingerprint of the mining settings, other than top k and threshold.
+        directory (str | None): The directory of the graphs. Default is in the database directory.
+    """
+
+    def __init__(self, settings: str, directory: str | None = None):
+        self.settings = settings
+        self.directory = directory or os.path.join(
+            get_database_path(), NEIGHBOUR_GRAPH_DIR_NAME
+        )
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, image_hashes: list[str]) -> str:
+        digest = hashlib.sha256(f"{NEIGHBOUR_GRAPH_VERSION}:{self.settings}".encode())
+        for image_hash in sorted(image_hashes):
+            digest.update(b"\n" + image_hash.encode())
+        return os.path.join(self.directory, f"{digest.hexdigest()}.npz")
+
+    def load(self, image_hashes: list[str]) -> NeighbourGraph | None:
+        """
+        Returns the graph of exactly these images, None if it was not cached.
+        """
+        path = self._path(image_hashes)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            graph = NeighbourGraph(
+                data["hashes"].tolist(),
+                data["pairs"].astype(PAIR_DTYPE),
+                int(data["top_k"]),
+                float(data["threshold"]),
+            )
+        # Mark the graph as recently used, so pruning keeps it
+        os.utime(path)
+        return graph
+
+    def save(self, image_hashes: list[str], graph: NeighbourGraph):
+        """
+        Caches the graph of the given images, and forgets the least recently used
+        graphs.
+        """
+        path = self._path(image_hashes)
+        # Written next to the target first, so a crash never leaves half a file
+        temp_path = f"{path}.tmp.npz"
+        np.savez(
+            temp_path,
+            hashes=np.array(graph.hashes, dtype=str),
+            pairs=graph.pairs,
+            top_k=graph.top_k,
+            threshold=graph.threshold,
+        )
+        os.replace(temp_path, path)
+
+        cached_paths = sorted(
+            glob.glob(os.path.join(self.directory, "*.npz")),
+            key=os.path.getmtime,
+            reverse=True,
+        )
+        for stale_path in cached_paths[NEIGHBOUR_GRAPH_CACHE_SIZE:]:
+            os.remove(stale_path)
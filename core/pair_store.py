@@ -0,0 +1,226 @@
+import os
+import sqlite3
+from threading import Lock
+from typing import Iterable
+
+from .hash_cache import SQLITE_MAX_PARAMETERS
+from .utils import chunkify, get_database_path
+
+PAIR_STORE_FILE_NAME = "pair_store.sqlite3"
+
+
+class PairStore:
+    """
+    Persistent record of the similar pairs mined in each library.
+
+    Pairs are keyed by the content hashes of both images, so renamed and moved
+    files keep their pairs, and the store remembers which hashes were mined. A run
+    only has to mine the new hashes against the whole library and merge the pairs
+    found into the store. Hashes missing from a later scan (deleted, modified or
+    moved out of the library) are forgotten together with their pairs. Images of
+    the library left out of a run, e.g. by the perceptual hash prefilter, keep
+    their pairs when `library_hashes` is given.
+
+    Pairs are only valid for the settings they were mined with, a run with other
+    settings starts the library over.
+
+    With `neighbour_lists`, the store holds the neighbour list of each mined image
+    instead of pairs: hash1 is the image and hash2 one of its neighbours. A list
+    missing an image is incomplete, so every image missing from the run is
+    forgotten, and so are the lists that held a forgotten image, which are mined
+    again.
+
+    Parameters:
+        library (str): The root folder of the library.
+        settings (str): A fingerprint of the mining settings.
+        library_hashes (Iterable[str] | None): The content hashes of every scanned image of the library. Default is the hashes given to `sync`.
+        db_path (str | None): The path of the SQLite database. Default is in the database directory.
+        neighbour_lists (bool): Whether the store holds neighbour lists instead of pairs.
+    """
+
+    def __init__(
+        self,
+        library: str,
+        settings: str,
+        library_hashes: Iterable[str] | None = None,
+        db_path: str | None = None,
+        neighbour_lists: bool = False,
+    ):
+        self.library = os.path.abspath(library)
+        self.neighbour_lists = neighbour_lists
+        self.library_hashes = (
+            set(library_hashes) if library_hashes is not None else None
+        )
+        self.db_path = db_path or os.path.join(
+            get_database_path(), PAIR_STORE_FILE_NAME
+        )
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self.lock = Lock()
+        self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS libraries (
+                library TEXT PRIMARY KEY,
+                settings TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS mined_hashes (
+                library TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (library, hash)
+            );
+            CREATE TABLE IF NOT EXISTS mined_pairs (
+                library TEXT NOT NULL,
+                hash1 TEXT NOT NULL,
+                hash2 TEXT NOT NULL,
+                score REAL NOT NULL,
+                PRIMARY KEY (library, hash1, hash2)
+            );
+            CREATE INDEX IF NOT EXISTS mined_pairs_hash2
+                ON mined_pairs (library, hash2);
+            """
+        )
+        self._check_settings(settings)
+
+    def _check_settings(self, settings: str):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT settings FROM libraries WHERE library = ?", (self.library,)
+            ).fetchone()
+            if row is not None and row[0] == settings:
+                return
+            if row is not None:
+                print("Mining settings changed, mining the whole library again.")
+            self.connection.execute(
+                "DELETE FROM mined_hashes WHERE library = ?", (self.library,)
+            )
+            self.connection.execute(
+                "DELETE FROM mined_pairs WHERE library = ?", (self.library,)
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO libraries (library, settings) VALUES (?, ?)",
+                (self.library, settings),
+            )
+            self.connection.commit()
+
+    def sync(self, image_hashes: list[str]) -> list[str]:
+        """
+        Forgets the hashes missing from the library and their pairs.
+
+        Parameters:
+            image_hashes (list[str]): The content hashes of the images mined in this run.
+
+        Returns:
+            list[str]: The hashes that were never mined, in the given order.
+        """
+        current_hashes = (
+            self.library_hashes
+            if self.library_hashes is not None and not self.neighbour_lists
+            else set(image_hashes)
+        )
+        with self.lock:
+            mined_hashes = {
+                row[0]
+                for row in self.connection.execute(
+                    "SELECT hash FROM mined_hashes WHERE library = ?", (self.library,)
+                )
+            }
+            stale_hashes = list(mined_hashes - current_hashes)
+            removed_count = len(stale_hashes)
+            if self.neighbour_lists and stale_hashes:
+                stale_hashes += self._lists_holding(stale_hashes)
+                mined_hashes -= set(stale_hashes)
+            for chunk in chunkify(stale_hashes, chunk_size=SQLITE_MAX_PARAMETERS):
+                placeholders = ", ".join("?" * len(chunk))
+                self.connection.execute(
+                    f"DELETE FROM mined_hashes WHERE library = ? AND hash IN ({placeholders})",
+                    (self.library, *chunk),
+                )
+                for column in ("hash1", "hash2"):
+                    self.connection.execute(
+                        f"DELETE FROM mined_pairs WHERE library = ? AND {column} IN ({placeholders})",
+                        (self.library, *chunk),
+                    )
+            self.connection.commit()
+
+        if removed_count:
+            print(f"Forgot the pairs of {removed_count} removed images")
+        if len(stale_hashes) > removed_count:
+            print(
+                f"Mining the neighbours of {len(stale_hashes) - removed_count} images again"
+            )
+        return [
+            image_hash for image_hash in image_hashes if image_hash not in mined_hashes
+        ]
+
+    def _lists_holding(self, image_hashes: list[str]) -> list[str]:
+        """Returns the images whose stored neighbour list holds one of the given images."""
+        holders: set[str] = set()
+        for chunk in chunkify(image_hashes, chunk_size=SQLITE_MAX_PARAMETERS):
+            holders.update(
+                row[0]
+                for row in self.connection.execute(
+                    "SELECT DISTINCT hash1 FROM mined_pairs WHERE library = ? "
+                    f"AND hash2 IN ({', '.join('?' * len(chunk))})",
+                    (self.library, *chunk),
+                )
+            )
+        return list(holders - set(image_hashes))
+
+    def add(self, mined_hashes: list[str], pairs: list[tuple[float, str, str]]):
+        """
+        Records newly mined hashes and the pairs found for them. A pair of an image
+        with itself is a mining bug and raises ValueError, nothing is recorded.
+
+        Parameters:
+            mined_hashes (list[str]): The content hashes mined against the library.
+            pairs (list[tuple[float, str, str]]): Tuples of similarity score and the content hashes of both images.
+        """
+        for _, hash1, hash2 in pairs:
+            if hash1 == hash2:
+                raise ValueError(f"Cannot store a pair of image {hash1} with itself")
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO mined_hashes (library, hash) VALUES (?, ?)",
+                [(self.library, image_hash) for image_hash in mined_hashes],
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO mined_pairs (library, hash1, hash2, score) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        self.library,
+                        *(
+                            (hash1, hash2)
+                            if self.neighbour_lists
+                            else sorted((hash1, hash2))
+                        ),
+                        score,
+                    )
+                    for score, hash1, hash2 in pairs
+                ],
+            )
+            self.connection.commit()
+
+    def pairs(self) -> list[tuple[float, str, str]]:
+        """
+        Returns every stored pair of the library.
+
+        Returns:
+            list[tuple[float, str, str]]: Tuples of similarity score and the content hashes of both images.
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT score, hash1, hash2 FROM mined_pairs WHERE library = ?",
+                (self.library,),
+            ).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,121 @@
+from typing import Iterable
+
+import numpy as np
+
+# A pair of images as the ids of both paths in a PathTable and their similarity
+PAIR_DTYPE = np.dtype([("score", np.float32), ("id1", np.int32), ("id2", np.int32)])
+
+
+class PathTable:
+    """
+    Interns image paths as int32 ids.
+
+    Pairs of images are kept as NumPy structured arrays of PAIR_DTYPE that refer
+    to the paths by id, instead of tuples holding two path strings each. Millions
+    of pairs then take 12 bytes each, can be filtered and sorted with vectorized
+    operations, and are only turned back into paths when they are reported.
+
+    Parameters:
+        paths (Iterable[str]): The paths to intern first, e.g. the scanned images.
+    """
+
+    def __init__(self, paths: Iterable[str] = ()):
+        self.paths: list[str] = []
+        self.ids: dict[str, int] = {}
+        self.intern_many(paths)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.ids
+
+    def intern(self, path: str) -> int:
+        """Returns the id of a path, adding the path if it is new."""
+        path_id = self.ids.get(path)
+        if path_id is None:
+            path_id = self.ids[path] = len(self.paths)
+            self.paths.append(path)
+        return path_id
+
+    def intern_many(self, paths: Iterable[str]) -> np.ndarray:
+        """Returns the ids of the paths as an int32 array, adding the new paths."""
+        return np.fromiter((self.intern(path) for path in paths), dtype=np.int32)
+
+    def pairs_from_tuples(self, pairs: Iterable[tuple[float, str, str]]) -> np.ndarray:
+        """Interns the paths of pairs of similarity score and paths."""
+        pairs = list(pairs)
+        return make_pairs(
+            np.fromiter((score for score, _, _ in pairs), dtype=np.float32),
+            self.intern_many(path1 for _, path1, _ in pairs),
+            self.intern_many(path2 for _, _, path2 in pairs),
+        )
+
+    def to_tuples(self, pairs: np.ndarray) -> list[tuple[float, str, str]]:
+        """
+        Materializes pairs as tuples of similarity score and paths, for the code
+        that opens or reports the images.
+        """
+        paths = self.paths
+        return [
+            (score, paths[id1], paths[id2])
+            for score, id1, id2 in zip(
+                pairs["score"].tolist(), pairs["id1"].tolist(), pairs["id2"].tolist()
+            )
+        ]
+
+
+def make_pairs(scores: np.ndarray, ids1: np.ndarray, ids2: np.ndarray) -> np.ndarray:
+    """Packs the scores and ids of pairs into a structured array of PAIR_DTYPE."""
+    pairs = np.empty(len(scores), dtype=PAIR_DTYPE)
+    pairs["score"] = scores
+    pairs["id1"] = ids1
+    pairs["id2"] = ids2
+    return pairs
+
+
+def remap_pairs(pairs: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Replaces the ids of pairs with `ids[id]`, e.g. row indices with path ids."""
+    return make_pairs(pairs["score"], ids[pairs["id1"]], ids[pairs["id2"]])
+
+
+def concatenate_pairs(blocks: list[np.ndarray]) -> np.ndarray:
+    """Joins blocks of pairs into one array of PAIR_DTYPE."""
+    if not blocks:
+        return np.empty(0, dtype=PAIR_DTYPE)
+    return np.concatenate(blocks)
+
+
+def filter_pairs(pairs: np.ndarray, valid_ids: np.ndarray) -> np.ndarray:
+    """
+    Keeps the pairs whose images are both valid.
+
+    Parameters:
+        pairs (np.ndarray): The pairs, of PAIR_DTYPE.
+        valid_ids (np.ndarray): A boolean array over the ids of the table.
+
+    Returns:
+        np.ndarray: The valid pairs.
+    """
+    # Paths interned after the mask was made are not valid
+    valid = (pairs["id1"] < len(valid_ids)) & (pairs["id2"] < len(valid_ids))
+    valid[valid] = valid_ids[pairs["id1"][valid]] & valid_ids[pairs["id2"][valid]]
+    return pairs[valid]
+
+
+def sort_pairs(pairs: np.ndarray) -> np.ndarray:
+    """Sorts pairs by decreasing similarity score."""
+    return pairs[np.argsort(-pairs["score"], kind="stable")]
+
+
+def top_k_per_row(rows: np.ndarray, scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Returns a mask of the `top_k` highest scores of each row."""
+    order = np.lexsort((-scores, rows))
+    sorted_rows = rows[order]
+    row_starts = np.flatnonzero(np.r_[True, sorted_rows[1:] != sorted_rows[:-1]])
+    ranks = np.arange(len(rows)) - np.repeat(
+        row_starts, np.diff(np.r_[row_starts, len(rows)])
+    )
+    mask = np.zeros(len(rows), dtype=bool)
+    mask[order[ranks < top_k]] = True
+    return mask
@@ -0,0 +1,239 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from math import ceil
+from typing import Iterator
+
+import numpy as np
+
+from .embedding_store import EmbeddingMatrix
+from .image_analyzer import ImageAnalyzer, PairAggregator
+
+# Scores computed at once by a worker, bounds the memory of each worker
+STRIPE_SCORES = 16 * 1024 * 1024
+# Enough stripes per worker to keep every worker busy until the end
+STRIPES_PER_WORKER = 4
+
+_worker_embeddings: EmbeddingMatrix | None = None
+
+
+def _init_worker(
+    data_path: str,
+    dtype: str,
+    shape: tuple[int, int],
+    scales_path: str | None,
+    rows: np.ndarray,
+    threads: int,
+):
+    from threadpoolctl import threadpool_limits
+
+    # Each worker multiplies its own blocks, several BLAS threads per worker
+    # would only compete for the same cores
+    threadpool_limits(limits=threads)
+
+    global _worker_embeddings
+    data = np.memmap(data_path, dtype=dtype, mode="r", shape=shape)
+    scales = (
+        np.memmap(scales_path, dtype=np.float32, mode="r", shape=(shape[0],))
+        if scales_path is not None
+        else None
+    )
+    _worker_embeddings = EmbeddingMatrix(data, scales, rows)
+
+
+def _mine_stripe(
+    stripe: tuple[int, int],
+    corpus_chunk_size: int,
+    top_k: int,
+    similarity_threshold: float,
+    neighbour_lists: bool,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+    assert _worker_embeddings is not None
+    query_start_idx, query_end_idx = stripe
+    query_embeddings = _worker_embeddings[query_start_idx:query_end_idx]
+    total_embeddings = len(_worker_embeddings)
+    aggregator = PairAggregator()
+    # The corpus is chunked like in `ImageAnalyzer.iter_pair_blocks`, so each row
+    # keeps the same top k as in a single process
+    for corpus_start_idx in range(0, total_embeddings, corpus_chunk_size):
+        corpus_end_idx = min(corpus_start_idx + corpus_chunk_size, total_embeddings)
+        # Chunks entirely below the diagonal hold no new pair
+        if corpus_end_idx - 1 <= query_start_idx and not neighbour_lists:
+            continue
+        block_pairs = ImageAnalyzer.mine_block(
+            query_embeddings,
+            _worker_embeddings[corpus_start_idx:corpus_end_idx],
+            query_start_idx,
+            corpus_start_idx,
+            top_k=top_k,
+            similarity_threshold=similarity_threshold,
+            neighbour_lists=neighbour_lists,
+        )
+        if block_pairs is not None:
+            aggregator.add(*block_pairs)
+    scores, i_indices, j_indices = aggregator.result()
+    if not len(scores):
+        return None
+    return scores, i_indices, j_indices
+
+
+def get_query_stripes(query_count: int, stripe_size: int) -> list[tuple[int, int]]:
+    """
+    Splits the query rows of the similarity matrix into stripes, each mined against
+    the whole corpus so that `top_k` applies per query row.
+
+    Parameters:
+        query_count (int): The number of leading rows mined against every row.
+        stripe_size (int): The number of query rows of a stripe.
+
+    Returns:
+        list: The query start and end rows of each stripe.
+    """
+    return [
+        (query_start_idx, min(query_start_idx + stripe_size, query_count))
+        for query_start_idx in range(0, query_count, stripe_size)
+    ]
+
+
+def iter_pair_blocks_parallel(
+    embeddings: "np.ndarray | EmbeddingMatrix",
+    top_k: int = 100,
+    similarity_threshold: float = 0.5,
+    query_count: int | None = None,
+    workers: int | None = None,
+    stripe_size: int | None = None,
+    corpus_chunk_size: int = 100000,
+    neighbour_lists: bool = False,
+) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Yields the similar pairs of embeddings mined by a pool of processes, stripe by
+    stripe in the order the stripes complete.
+
+    The query rows are split into stripes, which the workers mine against the
+    whole corpus from the same memory-mapped embedding matrix. Each query row is
+    ranked against the same corpus chunks as in `ImageAnalyzer.iter_pair_blocks`,
+    so the pairs do not depend on the number of workers. Each worker limits its
+    BLAS library to its share of the cores.
+
+    Embeddings that are not backed by a file are first written to a temporary one.
+
+    Parameters:
+        embeddings (np.ndarray | EmbeddingMatrix): The L2-normalized embeddings, one per row.
+        top_k (int): The number of most similar rows kept per query row and corpus chunk.
+        similarity_threshold (float): The minimum cosine similarity of a pair.
+        query_count (int | None): The number of leading rows to mine against every row, None for all rows.
+        workers (int | None): The number of processes. Default is the CPU count.
+        stripe_size (int | None): The query rows of a stripe. Default gives each worker several stripes of bounded memory.
+        corpus_chunk_size (int): The number of corpus rows per block.
+        neighbour_lists (bool): Whether to yield the neighbours j != i of each query row i, instead of the pairs i < j.
+
+    Yields:
+        tuple: The scores and the row indices i < j of the pairs of a stripe, or i and its neighbours j.
+    """
+    total_embeddings = len(embeddings)
+    query_count = total_embeddings if query_count is None else query_count
+    cpu_count = os.cpu_count() or 1
+    workers = workers or cpu_count
+    if stripe_size is None:
+        stripe_size = max(
+            1,
+            min(
+                ceil(query_count / (STRIPES_PER_WORKER * workers)),
+                STRIPE_SCORES // max(1, min(total_embeddings, corpus_chunk_size)),
+            ),
+        )
+    stripes = get_query_stripes(query_count, stripe_size)
+
+    with tempfile.TemporaryDirectory() as directory:
+        if isinstance(embeddings, EmbeddingMatrix) and isinstance(
+            embeddings.data, np.memmap
+        ):
+            matrix = embeddings
+            scales_path = (
+                getattr(matrix.scales, "filename", None)
+                if matrix.scales is not None
+                else None
+            )
+            data_path = str(matrix.data.filename)
+        else:
+            data_path = os.path.join(directory, "embeddings.bin")
+            data = np.memmap(
+                data_path,
+                dtype=np.float32,
+                mode="w+",
+                shape=embeddings.shape,
+            )
+            for start in range(0, total_embeddings, corpus_chunk_size):
+                data[start : start + corpus_chunk_size] = embeddings[
+                    start : start + corpus_chunk_size
+                ]
+            data.flush()
+            matrix = EmbeddingMatrix(data, None, np.arange(total_embeddings))
+            scales_path = None
+
+        print(
+            f"Mining {len(stripes)} stripes of {stripe_size} embeddings with {workers} processes..."
+        )
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(
+                data_path,
+                str(matrix.data.dtype),
+                matrix.data.shape,
+                scales_path,
+                matrix.rows,
+                max(1, cpu_count // workers),
+            ),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _mine_stripe,
+                    stripe,
+                    corpus_chunk_size,
+                    top_k,
+                    similarity_threshold,
+                    neighbour_lists,
+                )
+                for stripe in stripes
+            ]
+            try:
+                for future in as_completed(futures):
+                    stripe_pairs = future.result()
+                    if stripe_pairs is not None:
+                        yield stripe_pairs
+            finally:
+                # Stripes not started yet are dropped when the consumer stops early
+                for future in futures:
+                    future.cancel()
+
+
+def mine_pair_indices_parallel(
+    embeddings: "np.ndarray | EmbeddingMatrix",
+    top_k: int = 100,
+    max_pairs: int = 500000,
+    similarity_threshold: float = 0.5,
+    query_count: int | None = None,
+    workers: int | None = None,
+    stripe_size: int | None = None,
+    corpus_chunk_size: int = 100000,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds the most similar pairs of embeddings with a pool of processes, see
+    `iter_pair_blocks_parallel`.
+
+    Returns:
+        tuple: The scores and the row indices i < j of the best `max_pairs` pairs, highest scores first.
+    """
+    aggregator = PairAggregator(max_pairs)
+    for block_pairs in iter_pair_blocks_parallel(
+        embeddings,
+        top_k=top_k,
+        similarity_threshold=similarity_threshold,
+        query_count=query_count,
+        workers=workers,
+        stripe_size=stripe_size,
+        corpus_chunk_size=corpus_chunk_size,
+    ):
+        aggregator.add(*block_pairs)
+    return aggregator.result()
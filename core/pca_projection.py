@@ -0,0 +1,109 @@
+import os
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .embedding_store import EmbeddingMatrix
+
+PCA_DIMENSIONS = 64
+PCA_FIT_SAMPLE_SIZE = 20000
+# The projection is fitted again once the library has grown by this factor
+PCA_REFIT_GROWTH = 1.5
+# Candidates are kept down to this much below the similarity threshold
+PCA_MARGIN = 0.1
+PCA_PROJECT_CHUNK_SIZE = 50000
+
+
+class PcaProjection:
+    """
+    Projects L2-normalized embeddings onto their principal components.
+
+    The components are fitted on the uncentered embeddings, so the dot product of
+    two projections is the best low-rank approximation of their cosine similarity.
+    Mining the projections finds candidate pairs at a fraction of the cost of the
+    full dimension, and the candidates are re-ranked with the full embeddings.
+
+    Parameters:
+        components (np.ndarray): The principal components, one per row.
+        fitted_count (int): The number of embeddings of the library when it was fitted.
+        explained_variance (float): The share of the energy of the embeddings kept by the projection.
+    """
+
+    def __init__(
+        self, components: np.ndarray, fitted_count: int, explained_variance: float
+    ):
+        self.components = components.astype(np.float32)
+        self.fitted_count = fitted_count
+        self.explained_variance = explained_variance
+
+    @property
+    def dimensions(self) -> int:
+        return len(self.components)
+
+    @classmethod
+    def fit(
+        cls,
+        embeddings: "np.ndarray | EmbeddingMatrix",
+        dimensions: int = PCA_DIMENSIONS,
+        sample_size: int = PCA_FIT_SAMPLE_SIZE,
+    ) -> "PcaProjection":
+        """
+        Fits the projection on a sample of the embeddings.
+
+        Parameters:
+            embeddings (np.ndarray | EmbeddingMatrix): The L2-normalized embeddings, one per row.
+            dimensions (int): The number of components kept.
+            sample_size (int): The number of embeddings the components are computed from.
+        """
+        total_embeddings = len(embeddings)
+        rng = np.random.default_rng(0)
+        sample = np.sort(
+            rng.choice(
+                total_embeddings, min(sample_size, total_embeddings), replace=False
+            )
+        )
+        vectors = np.asarray(embeddings[sample], dtype=np.float64)
+        # The eigenvectors of the small d x d second moment matrix are the right
+        # singular vectors of the sample, without decomposing the sample itself
+        eigenvalues, eigenvectors = np.linalg.eigh(vectors.T @ vectors)
+        order = np.argsort(eigenvalues)[::-1][:dimensions]
+        explained_variance = float(
+            eigenvalues[order].sum() / max(eigenvalues.sum(), 1e-12)
+        )
+        return cls(eigenvectors[:, order].T, total_embeddings, explained_variance)
+
+    def needs_refit(self, total_embeddings: int) -> bool:
+        """Tells whether the library has grown too much since the projection was fitted."""
+        return total_embeddings > self.fitted_count * PCA_REFIT_GROWTH
+
+    def project(self, embeddings: "np.ndarray | EmbeddingMatrix") -> np.ndarray:
+        """Returns the float32 projection of the embeddings, read chunk by chunk."""
+        projected = np.empty((len(embeddings), self.dimensions), dtype=np.float32)
+        for start in range(0, len(embeddings), PCA_PROJECT_CHUNK_SIZE):
+            end = start + PCA_PROJECT_CHUNK_SIZE
+            projected[start:end] = embeddings[start:end] @ self.components.T
+        return projected
+
+    def save(self, path: str):
+        # Written next to the target first, so a crash never leaves half a file
+        temp_path = f"{path}.tmp.npz"
+        np.savez(
+            temp_path,
+            components=self.components,
+            fitted_count=self.fitted_count,
+            explained_variance=self.explained_variance,
+        )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "PcaProjection | None":
+        """Returns the saved projection, None if there is none."""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(
+                data["components"],
+                int(data["fitted_count"]),
+                float(data["explained_variance"]),
+            )
@@ -0,0 +1,261 @@
+import asyncio
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from math import log2
+from typing import TYPE_CHECKING
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from .image_loader import open_image_reduced
+
+if TYPE_CHECKING:
+    from .hash_cache import HashCache
+
+HASH_BITS = 64
+HASH_SIZE = 8
+# pHash keeps the lowest 8x8 frequencies of a 32x32 DCT
+PHASH_IMAGE_SIZE = HASH_SIZE * 4
+DEFAULT_MAX_DISTANCE = 6
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+    matrix[0] *= np.sqrt(1 / size)
+    matrix[1:] *= np.sqrt(2 / size)
+    return matrix
+
+
+DCT_MATRIX = _dct_matrix(PHASH_IMAGE_SIZE)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+
+def dhash(image: Image.Image) -> int:
+    """
+    Computes the 64-bit difference hash of a grayscale image.
+
+    Each bit tells whether a pixel is brighter than its right neighbour on a 9x8
+    thumbnail, which survives resizing, recompression and small color changes.
+    """
+    pixels = np.asarray(
+        image.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS),
+        dtype=np.float32,
+    )
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(image: Image.Image) -> int:
+    """
+    Computes the 64-bit perceptual hash of a grayscale image.
+
+    Each bit tells whether one of the 8x8 lowest DCT frequencies of a 32x32 thumbnail
+    is above their median.
+    """
+    pixels = np.asarray(
+        image.resize((PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), Image.Resampling.LANCZOS),
+        dtype=np.float32,
+    )
+    frequencies = (DCT_MATRIX @ pixels @ DCT_MATRIX.T)[:HASH_SIZE, :HASH_SIZE]
+    return _bits_to_int(frequencies > np.median(frequencies))
+
+
+def compute_perceptual_hashes(file_path: str) -> tuple[int, int] | None:
+    """
+    Computes the pHash and dHash of an image from a reduced decode.
+
+    Parameters:
+        file_path (str): The path to the image.
+
+    Returns:
+        tuple[int, int] | None: The pHash and dHash, or None if the image cannot be decoded.
+    """
+    try:
+        with open_image_reduced(
+            file_path, (PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE)
+        ) as image:
+            image = ImageOps.exif_transpose(image) or image
+            image = image.convert("L")
+            return phash(image), dhash(image)
+    except Exception as e:
+        print(f"Failed to decode {file_path}: {e}")
+        return None
+
+
+def hamming_distance(hash1: int, hash2: int) -> int:
+    return (hash1 ^ hash2).bit_count()
+
+
+class MultiIndexHashTable:
+    """
+    Finds 64-bit hashes within a Hamming radius using multi-index hashing.
+
+    Hashes are split into disjoint chunks, each indexed in its own table. Two hashes
+    within distance `max_distance` differ by at most `max_distance // chunk_count`
+    bits in at least one chunk, so a query only probes the buckets of its chunks and
+    of their few variants flipping that many bits. Chunks are sized so that buckets
+    hold about one hash each for the expected number of hashes.
+
+    Parameters:
+        max_distance (int): The largest Hamming distance reported by `query`.
+        expected_size (int): The expected number of hashes in the table.
+    """
+
+    def __init__(self, max_distance: int, expected_size: int):
+        self.max_distance = max_distance
+        bits_per_chunk = min(HASH_BITS, max(8, round(log2(max(expected_size, 2)))))
+        chunk_count = max(1, HASH_BITS // bits_per_chunk)
+        self.sub_radius = max_distance // chunk_count
+
+        self.chunks: list[tuple[int, int]] = []
+        self.flip_masks: list[list[int]] = []
+        shift = 0
+        for chunk_index in range(chunk_count):
+            width = HASH_BITS // chunk_count + (chunk_index < HASH_BITS % chunk_count)
+            self.chunks.append((shift, (1 << width) - 1))
+            self.flip_masks.append(
+                [
+                    sum(1 << bit for bit in bits)
+                    for distance in range(self.sub_radius + 1)
+                    for bits in combinations(range(width), distance)
+                ]
+            )
+            shift += width
+
+        self.tables: list[dict[int, list[int]]] = [
+            defaultdict(list) for _ in self.chunks
+        ]
+        self.hashes: list[int] = []
+
+    def add(self, value: int) -> int:
+        """Adds a hash to the table and returns its index."""
+        index = len(self.hashes)
+        self.hashes.append(value)
+        for table, (shift, mask) in zip(self.tables, self.chunks):
+            table[(value >> shift) & mask].append(index)
+        return index
+
+    def query(self, value: int) -> list[tuple[int, int]]:
+        """
+        Finds the hashes of the table within the Hamming radius of the given one.
+
+        Returns:
+            list[tuple[int, int]]: The index and distance of each hash found.
+        """
+        candidates: set[int] = set()
+        for table, (shift, mask), flip_masks in zip(
+            self.tables, self.chunks, self.flip_masks
+        ):
+            chunk = (value >> shift) & mask
+            for flip_mask in flip_masks:
+                candidates.update(table.get(chunk ^ flip_mask, ()))
+
+        matches: list[tuple[int, int]] = []
+        for index in candidates:
+            distance = hamming_distance(value, self.hashes[index])
+            if distance <= self.max_distance:
+                matches.append((index, distance))
+        return matches
+
+
+async def calculate_perceptual_hashes(
+    path_to_hash_map: dict[str, str],
+    hash_cache: "HashCache | None" = None,
+    max_workers: int | None = None,
+) -> dict[str, tuple[int, int]]:
+    """
+    Resolves the perceptual hashes of images, from the cache or from reduced decodes.
+
+    Parameters:
+        path_to_hash_map (dict[str, str]): A dictionary mapping image paths to their content hash.
+        hash_cache (HashCache | None): Persistent cache of previously computed hashes.
+        max_workers (int | None): The number of processes decoding images.
+
+    Returns:
+        dict[str, tuple[int, int]]: A dictionary mapping image paths to their pHash and dHash.
+    """
+    loop = asyncio.get_running_loop()
+    cached_hashes: dict[str, tuple[int, int]] = {}
+    if hash_cache is not None:
+        cached_hashes = await loop.run_in_executor(
+            None,
+            hash_cache.lookup_perceptual_hashes,
+            list(set(path_to_hash_map.values())),
+        )
+
+    results = {
+        path: cached_hashes[content_hash]
+        for path, content_hash in path_to_hash_map.items()
+        if content_hash in cached_hashes
+    }
+    pending_paths = [path for path in path_to_hash_map if path not in results]
+    print(
+        f"Perceptual hash cache hits: {len(results)}, images to decode: {len(pending_paths)}"
+    )
+    if not pending_paths:
+        return results
+
+    max_workers = max_workers or os.cpu_count() or 4
+
+    def _compute() -> list[tuple[int, int] | None]:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return list(
+                executor.map(
+                    compute_perceptual_hashes,
+                    pending_paths,
+                    chunksize=max(1, len(pending_paths) // (max_workers * 4)),
+                )
+            )
+
+    computed_entries: list[tuple[str, int, int]] = []
+    for path, hashes in zip(pending_paths, await loop.run_in_executor(None, _compute)):
+        if hashes is None:
+            continue
+        results[path] = hashes
+        computed_entries.append((path_to_hash_map[path], *hashes))
+
+    if hash_cache is not None:
+        await loop.run_in_executor(
+            None, hash_cache.store_perceptual_hashes, computed_entries
+        )
+    return results
+
+
+def find_perceptual_pairs(
+    perceptual_hashes: dict[str, tuple[int, int]],
+    max_distance: int = DEFAULT_MAX_DISTANCE,
+) -> list[tuple[float, str, str]]:
+    """
+    Finds pairs of images whose pHash and dHash are both within a Hamming radius.
+
+    Candidates are found on the pHash with a multi-index hash table and confirmed
+    with the dHash, which rejects most of the accidental pHash collisions.
+
+    Parameters:
+        perceptual_hashes (dict[str, tuple[int, int]]): A dictionary mapping image paths to their pHash and dHash.
+        max_distance (int): The largest Hamming distance between near duplicates.
+
+    Returns:
+        list: Tuples of similarity score and the paths of the two images, highest scores first.
+    """
+    paths = sorted(perceptual_hashes)
+    table = MultiIndexHashTable(max_distance, expected_size=len(paths))
+    pairs: list[tuple[float, str, str]] = []
+    for path in paths:
+        phash_value, dhash_value = perceptual_hashes[path]
+        # Querying before adding reports each pair once, with the first path first
+        for index, phash_distance in table.query(phash_value):
+            other_path = paths[index]
+            dhash_distance = hamming_distance(
+                dhash_value, perceptual_hashes[other_path][1]
+            )
+            if dhash_distance <= max_distance:
+                score = 1 - (phash_distance + dhash_distance) / (2 * HASH_BITS)
+                pairs.append((score, other_path, path))
+        table.add(phash_value)
+    return sorted(pairs, key=lambda x: x[0], reverse=True)
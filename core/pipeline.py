@@ -0,0 +1,210 @@
+import asyncio
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, AsyncIterator
+
+from .file_hasher import FileHasher
+from .scanner import ExclusionRules, scan_image_files
+
+if TYPE_CHECKING:
+    from .hash_cache import HashCache
+    from .image_analyzer import ImageAnalyzer
+
+QUEUE_SIZE = 1024
+
+
+class PipelineStats:
+    def __init__(self):
+        self.scanned = 0
+        self.cache_hits = 0
+        self.hashed = 0
+        self.embedded = 0
+
+    def __str__(self):
+        return (
+            f"scanned {self.scanned} images, {self.cache_hits} hash cache hits, "
+            f"hashed {self.hashed} files, embedded {self.embedded} new images"
+        )
+
+
+async def _scan_stage(
+    img_folder: str,
+    include_subdirs: bool,
+    exclusion_rules: ExclusionRules | None,
+    hash_cache: "HashCache | None",
+    output_queue: asyncio.Queue,
+    stop_event: threading.Event,
+):
+    loop = asyncio.get_running_loop()
+
+    def _walk():
+        for scanned_file in scan_image_files(
+            img_folder, include_subdirs, exclusion_rules
+        ):
+            if stop_event.is_set():
+                return
+            # The walk thread also resolves cached hashes, it already touches the inode
+            cached_hash = (
+                hash_cache.lookup_path(scanned_file.path) if hash_cache else None
+            )
+            asyncio.run_coroutine_threadsafe(
+                output_queue.put((scanned_file.path, cached_hash)), loop
+            ).result()
+
+    try:
+        await loop.run_in_executor(None, _walk)
+    finally:
+        await output_queue.put(None)
+
+
+async def _hash_stage(
+    input_queue: asyncio.Queue,
+    output_queue: asyncio.Queue,
+    hasher: FileHasher,
+    hash_cache: "HashCache | None",
+    stats: PipelineStats,
+):
+    async def _paths_to_hash() -> AsyncIterator[str]:
+        while (item := await input_queue.get()) is not None:
+            file_path, cached_hash = item
+            stats.scanned += 1
+            if cached_hash is None:
+                yield file_path
+            else:
+                stats.cache_hits += 1
+                await output_queue.put((file_path, cached_hash))
+
+    hashed_entries: list[tuple[os.stat_result, str]] = []
+    try:
+        async for file_path, file_hash, stat in hasher.hash_files(_paths_to_hash()):
+            stats.hashed += 1
+            hashed_entries.append((stat, file_hash))
+            await output_queue.put((file_path, file_hash))
+    finally:
+        if hash_cache is not None:
+            hash_cache.store_many(hashed_entries)
+        await output_queue.put(None)
+
+
+async def _embed_stage(
+    input_queue: asyncio.Queue,
+    image_analyzer: "ImageAnalyzer",
+    hash_to_paths: dict[str, list[str]],
+    embed_workers: int,
+    stats: PipelineStats,
+):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(embed_workers)
+    tasks: list[asyncio.Task] = []
+
+    async def _index(batch: dict[str, str]):
+        try:
+            stats.embedded += await loop.run_in_executor(
+                None, image_analyzer.index_batch, batch
+            )
+        finally:
+            semaphore.release()
+
+    async def _submit(batch: dict[str, str]):
+        # Backpressure: stop consuming hashes while every embed worker is busy
+        await semaphore.acquire()
+        tasks.append(asyncio.create_task(_index(batch)))
+
+    batch: dict[str, str] = {}
+    while (item := await input_queue.get()) is not None:
+        file_path, file_hash = item
+        paths = hash_to_paths.setdefault(file_hash, [])
+        paths.append(file_path)
+        # Identical copies share an embedding, only the first one seen is indexed
+        if len(paths) > 1:
+            continue
+        batch[file_path] = file_hash
+        # Batches are sized from the memory measured on the previous ones
+        if len(batch) >= image_analyzer.batch_sizer.next_batch_size():
+            await _submit(batch)
+            batch = {}
+
+    if batch:
+        await _submit(batch)
+    await asyncio.gather(*tasks)
+
+
+async def run_indexing_pipeline(
+    img_folder: str,
+    image_analyzer: "ImageAnalyzer",
+    include_subdirs: bool = True,
+    exclusion_rules: ExclusionRules | None = None,
+    hash_cache: "HashCache | None" = None,
+    verify_hashes: bool = False,
+    hash_workers: int | None = None,
+    embed_workers: int = 1,
+    queue_size: int = QUEUE_SIZE,
+) -> dict[str, list[str]]:
+    """
+    Scans, hashes and indexes images as overlapping stages.
+
+    Each stage runs concurrently and hands its output to the next one through a
+    bounded queue, so hashing starts with the first scanned file and embedding with
+    the first hashed one. A full queue blocks the stage feeding it, which keeps memory
+    flat no matter how large the folder is.
+
+    Parameters:
+        img_folder (str): The folder containing the images to process.
+        image_analyzer (ImageAnalyzer): The analyzer whose index is updated.
+        include_subdirs (bool): Whether to scan subdirectories.
+        exclusion_rules (ExclusionRules | None): Rules for subdirectories to skip.
+        hash_cache (HashCache | None): Persistent cache of previously computed hashes.
+        verify_hashes (bool): Whether to ignore cached hashes and re-read every file.
+        hash_workers (int | None): The number of threads used to hash files.
+        embed_workers (int): The number of embedding batches processed concurrently.
+        queue_size (int): The capacity of the queues between stages.
+
+    Returns:
+        dict[str, list[str]]: A dictionary mapping each hash to the paths of the identical files sharing it.
+    """
+    start_time = time.time()
+    stats = PipelineStats()
+    hash_to_paths: dict[str, list[str]] = {}
+    scanned_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    hashed_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+
+    print("Scanning, hashing and indexing images...")
+    with FileHasher(max_workers=hash_workers) as hasher:
+        stages = [
+            asyncio.create_task(
+                _scan_stage(
+                    img_folder,
+                    include_subdirs,
+                    exclusion_rules,
+                    None if verify_hashes else hash_cache,
+                    scanned_queue,
+                    stop_event,
+                )
+            ),
+            asyncio.create_task(
+                _hash_stage(scanned_queue, hashed_queue, hasher, hash_cache, stats)
+            ),
+            asyncio.create_task(
+                _embed_stage(
+                    hashed_queue,
+                    image_analyzer,
+                    hash_to_paths,
+                    embed_workers,
+                    stats,
+                )
+            ),
+        ]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            stop_event.set()
+            for stage in stages:
+                stage.cancel()
+            # Unblock the walk thread if it is waiting on a full queue
+            while not scanned_queue.empty():
+                scanned_queue.get_nowait()
+
+    print(f"Pipeline {stats} in {time.time() - start_time:.2f} seconds")
+    return hash_to_paths
@@ -0,0 +1,185 @@
+import os
+from fnmatch import fnmatch
+from typing import Iterator, NamedTuple
+
+from filetype import is_image
+
+IMAGE_EXTENSIONS = frozenset(
+    {
+        ".avif",
+        ".bmp",
+        ".dib",
+        ".gif",
+        ".heic",
+        ".heif",
+        ".ico",
+        ".jfif",
+        ".jp2",
+        ".jpe",
+        ".jpeg",
+        ".jpg",
+        ".jxl",
+        ".png",
+        ".psd",
+        ".tga",
+        ".tif",
+        ".tiff",
+        ".webp",
+    }
+)
+
+# Extensions that are common in photo folders and never need to be sniffed.
+NON_IMAGE_EXTENSIONS = frozenset(
+    {
+        ".aae",
+        ".avi",
+        ".csv",
+        ".db",
+        ".doc",
+        ".docx",
+        ".html",
+        ".ini",
+        ".json",
+        ".log",
+        ".m4v",
+        ".mkv",
+        ".mov",
+        ".mp3",
+        ".mp4",
+        ".pdf",
+        ".sqlite3",
+        ".thm",
+        ".txt",
+        ".wav",
+        ".xml",
+        ".xmp",
+        ".zip",
+    }
+)
+
+
+# Directories that only ever hold caches, thumbnails or trash.
+DEFAULT_EXCLUDE_PATTERNS = (
+    "@eaDir",
+    "__MACOSX",
+    "__pycache__",
+    "$RECYCLE.BIN",
+    "System Volume Information",
+)
+
+
+class ExclusionRules:
+    """
+    Directory-level rules deciding which subtrees are pruned during a scan.
+
+    Parameters:
+        excluded_dir_names (list[str]): Exact directory names to skip, e.g. the sweep sub-folder.
+        patterns (list[str]): Glob patterns matched against directory names and paths relative to the scanned root.
+        skip_hidden (bool): Whether to skip directories whose name starts with a dot.
+        max_depth (int | None): Maximum depth of subdirectories to descend into, 0 scans only the top-level directory.
+    """
+
+    def __init__(
+        self,
+        excluded_dir_names: list[str] | None = None,
+        patterns: list[str] | None = None,
+        skip_hidden: bool = True,
+        max_depth: int | None = None,
+    ):
+        self.excluded_dir_names = {name for name in excluded_dir_names or [] if name}
+        self.patterns = [
+            pattern.strip().rstrip("/\\")
+            for pattern in [*DEFAULT_EXCLUDE_PATTERNS, *(patterns or [])]
+            if pattern.strip()
+        ]
+        self.skip_hidden = skip_hidden
+        self.max_depth = max_depth
+
+    def can_descend(self, depth: int) -> bool:
+        return self.max_depth is None or depth < self.max_depth
+
+    def is_excluded(self, name: str, relative_path: str) -> bool:
+        if name in self.excluded_dir_names:
+            return True
+        if self.skip_hidden and name.startswith("."):
+            return True
+        relative_path = relative_path.replace(os.sep, "/")
+        return any(
+            fnmatch(name, pattern) or fnmatch(relative_path, pattern)
+            for pattern in self.patterns
+        )
+
+
+class ScannedFile(NamedTuple):
+    path: str
+    size: int
+    mtime_ns: int
+
+
+def _is_image_entry(entry: os.DirEntry) -> bool:
+    extension = os.path.splitext(entry.name)[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return True
+    if extension in NON_IMAGE_EXTENSIONS:
+        return False
+    # Unknown or missing extension, fall back to sniffing the magic bytes
+    try:
+        return is_image(entry.path)
+    except Exception:
+        return False
+
+
+def scan_image_files(
+    directory: str,
+    include_subdirs: bool = True,
+    exclusion_rules: ExclusionRules | None = None,
+) -> Iterator[ScannedFile]:
+    """
+    Walk the given directory and yield image files as they are found.
+
+    Files are accepted by their extension whenever it is a known one, so only files
+    with an unknown or missing extension are opened to sniff their content. The stat
+    information of each directory entry is reused instead of stat'ing files again.
+    Excluded directories are pruned before anything inside them is listed.
+
+    Args:
+        directory (str): The directory to scan.
+        include_subdirs (bool): If True, scan subdirectories. If False, only scan the top-level directory.
+        exclusion_rules (ExclusionRules | None): Rules for subdirectories to skip.
+
+    Yields:
+        ScannedFile: The path, size and modification time of each image file.
+    """
+    exclusion_rules = exclusion_rules or ExclusionRules()
+
+    pending_dirs = [(directory, 0)]
+    while pending_dirs:
+        current_dir, depth = pending_dirs.pop()
+        can_descend = include_subdirs and exclusion_rules.can_descend(depth)
+        try:
+            entries = os.scandir(current_dir)
+        except OSError as e:
+            print(f"Skipping {current_dir}: {e}")
+            continue
+
+        subdirs: list[str] = []
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if can_descend and not exclusion_rules.is_excluded(
+                            entry.name, os.path.relpath(entry.path, directory)
+                        ):
+                            subdirs.append(entry.path)
+                        continue
+                    if not entry.is_file() or not _is_image_entry(entry):
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                yield ScannedFile(entry.path, stat.st_size, stat.st_mtime_ns)
+
+        # Visit subdirectories in name order, like os.walk would
+        pending_dirs.extend(
+            (subdir, depth + 1) for subdir in sorted(subdirs, reverse=True)
+        )
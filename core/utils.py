@@ -1,11 +1,19 @@
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
-import hashlib
 import os
+import sys
 from functools import lru_cache
+from pathlib import Path
 from shutil import copyfile, move
+from typing import TYPE_CHECKING
 
-from filetype import is_image
+from .file_hasher import FileHasher, hash_file
+from .scanner import ExclusionRules, ScannedFile, scan_image_files
+
+if TYPE_CHECKING:
+    from .hash_cache import HashCache
+
+DB_PATH_NAME = "database"
 
 
 def chunkify(lst, chunk_size=20):
@@ -13,6 +21,32 @@ def chunkify(lst, chunk_size=20):
         yield lst[i : i + chunk_size]
 
 
+def get_database_path() -> str:
+    """
+    Resolve the directory holding the application's persistent data.
+
+    Returns:
+        str: The path of the database directory.
+    """
+    if os.environ.get("APP_ENV") != "production":
+        return "./" + DB_PATH_NAME
+
+    if getattr(sys, "frozen", False):
+        app_path = Path(sys.executable).parent.parent
+        db_path = app_path / "Contents" / "Resources" / DB_PATH_NAME
+    else:
+        db_path = Path("./" + DB_PATH_NAME)
+
+    if sys.platform == "darwin":
+        db_path = (
+            Path.home() / "Library" / "Application Support" / "SnapSweep" / DB_PATH_NAME
+        )
+
+    # Ensure the directory exists
+    db_path.mkdir(parents=True, exist_ok=True)
+    return str(db_path)
+
+
 def copy_file(file_path: str, dest_folder: str):
 
     dest_path = os.path.join(dest_folder, os.path.basename(file_path))
@@ -35,59 +69,34 @@ def move_file(file_path: str, dest_folder: str):
     move(file_path, dest_path)
 
 
-async def is_image_file(file_path: str) -> bool:
-    try:
-        loop = asyncio.get_event_loop()
-        is_image_obj = await loop.run_in_executor(None, is_image, file_path)
-        return is_image_obj
-    except Exception:
-        return False
-
-
-def list_all_files(directory: str, include_subdirs: bool = True) -> list[str]:
-    """
-    Recursively list all files in the given directory.
-
-    Args:
-        directory (str): The directory to scan.
-        include_subdirs (bool): If True, scan subdirectories. If False, only scan the top-level directory.
-
-    Returns:
-        list[str]: A list of file paths.
-    """
-    file_list = []
-    if include_subdirs:
-        for root, _dirs, files in os.walk(directory):
-            for file in files:
-                file_list.append(os.path.join(root, file))
-    else:
-        for file in os.listdir(directory):
-            file_path = os.path.join(directory, file)
-            if os.path.isfile(file_path):
-                file_list.append(file_path)
-    return file_list
-
-
-async def get_image_files(img_folder: str, include_subdirs: bool = True) -> list[str]:
-    """Asynchronously list all image files in the given directory."""
+async def get_scanned_image_files(
+    img_folder: str,
+    include_subdirs: bool = True,
+    exclusion_rules: ExclusionRules | None = None,
+) -> list[ScannedFile]:
+    """Asynchronously scan the given directory for image files, sorted by path."""
 
     print("Listing all files...")
     loop = asyncio.get_event_loop()
-    all_files = await loop.run_in_executor(
-        None, list_all_files, img_folder, include_subdirs
+    scanned_files = await loop.run_in_executor(
+        None,
+        lambda: list(scan_image_files(img_folder, include_subdirs, exclusion_rules)),
     )
+    scanned_files.sort()
+    return scanned_files
 
-    # Create tasks for checking each file asynchronously
-    tasks = [is_image_file(file) for file in all_files]
-    img_validity = await asyncio.gather(*tasks)
-
-    # Filter and collect valid image files
-    valid_img_files = [file for file, valid in zip(all_files, img_validity) if valid]
 
-    # Sort the image file paths
-    valid_img_files.sort()
+async def get_image_files(
+    img_folder: str,
+    include_subdirs: bool = True,
+    exclusion_rules: ExclusionRules | None = None,
+) -> list[str]:
+    """Asynchronously list all image files in the given directory."""
 
-    return valid_img_files
+    scanned_files = await get_scanned_image_files(
+        img_folder, include_subdirs, exclusion_rules
+    )
+    return [scanned_file.path for scanned_file in scanned_files]
 
 
 async def async_move_file_to_subdir(src: str, dest_subfolder: str):
@@ -133,33 +142,69 @@ async def calculate_file_hash(file_path: str) -> dict[str, str]:
     """
 
     def _hash_file():
-        hasher = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(1024 * 1024), b""):
-                hasher.update(chunk)
-        return {"path": file_path, "hash": hasher.hexdigest()}
+        file_hash, _stat = hash_file(file_path)
+        return {"path": file_path, "hash": file_hash}
 
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(None, _hash_file)
 
 
-async def calculate_file_hashes(file_paths: list[str], max_workers: int | None = None):
+async def calculate_file_hashes(
+    file_paths: list[str],
+    max_workers: int | None = None,
+    hash_cache: "HashCache | None" = None,
+    verify: bool = False,
+):
     """
     Calculate the hash of files asynchronously.
 
+    Files whose stat signature matches an entry of `hash_cache` are not read at all,
+    unless `verify` is set, in which case every file is re-hashed and the cache is
+    refreshed with the result.
+
     Parameters:
         file_paths (list[str]): The paths to the files.
         max_workers (int | None): Maximum number of worker threads.
+        hash_cache (HashCache | None): Persistent cache of previously computed hashes.
+        verify (bool): Whether to ignore cached hashes and re-read every file.
 
     Returns:
         dict[str, str]: A dictionary with the file paths as keys and the hashes as values.
     """
-    max_workers = max_workers or (os.cpu_count() or 4) * 2
-
     results: dict[str, str] = {}
-
-    tasks = [calculate_file_hash(file_path) for file_path in file_paths]
-    hashed_results = await asyncio.gather(*tasks)
-    for result in hashed_results:
-        results[result["path"]] = result["hash"]
+    cached_hashes: dict[str, str] = {}
+
+    with FileHasher(max_workers=max_workers) as hasher:
+        if hash_cache is not None:
+            loop = asyncio.get_running_loop()
+            cached_hashes = await loop.run_in_executor(
+                hasher.executor, hash_cache.lookup_many, file_paths
+            )
+            if not verify:
+                results.update(cached_hashes)
+
+        pending_paths = [path for path in file_paths if path not in results]
+        if hash_cache is not None:
+            print(
+                f"Hash cache hits: {len(results)}, files to hash: {len(pending_paths)}"
+            )
+
+        hashed_entries: list[tuple[os.stat_result, str]] = []
+        async for file_path, file_hash, stat in hasher.hash_files(pending_paths):
+            results[file_path] = file_hash
+            hashed_entries.append((stat, file_hash))
+
+    if hash_cache is not None:
+        if verify:
+            mismatches = [
+                path
+                for path, cached_hash in cached_hashes.items()
+                if path in results and results[path] != cached_hash
+            ]
+            if mismatches:
+                print(
+                    f"Warning: {len(mismatches)} files changed without a stat change, "
+                    "hash cache refreshed."
+                )
+        hash_cache.store_many(hashed_entries)
     return results
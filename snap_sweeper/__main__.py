@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 import sys
 from tkinter import PhotoImage
@@ -67,6 +68,8 @@ def main():
 
 
 if __name__ == "__main__":
+    # Image decoding runs on a process pool, which frozen builds must bootstrap
+    multiprocessing.freeze_support()
     app_env = os.getenv("APP_ENV", "development")
     print("Running in", app_env, "mode")
     if app_env != "production":
@@ -1,7 +1,7 @@
 from core.find_and_move_similar_images import (
     find_and_move_similar_images,
 )
-from core.image_analyzer import ImageAnalyzer
+from core.image_analyzer import get_shared_image_analyzer
 from core.utils import move_files_to_subdir
 
 
@@ -9,7 +9,7 @@ class SnapSweeper:
     def __init__(self):
         self.discarded_images: list[str] = []
 
-    async def process_images(self, image_dir, settings):
+    async def process_images(self, image_dir, settings, on_results=None):
         return await find_and_move_similar_images(
             image_dir,
             dry_run=bool(settings["dry_run"]),
@@ -17,19 +17,43 @@ class SnapSweeper:
             threshold=float(settings["threshold"]),
             sub_folder_name=str(settings["sub_folder_name"]),
             include_subdirs=bool(settings["include_subdirs"]),
+            exclude_patterns=list(settings["exclude_patterns"]),
+            skip_hidden_dirs=bool(settings["skip_hidden_dirs"]),
+            max_depth=settings["max_depth"],
+            embedding_backend=str(settings["embedding_backend"]),
+            perceptual_hash=str(settings["perceptual_hash"]),
+            group_duplicates=bool(settings["group_duplicates"]),
+            on_results=on_results,
         )
 
     async def move_discarded_images(self, sub_folder_name):
         discarded_images = list(self.discarded_images)
         print(f"Moving {len(discarded_images)} images to {sub_folder_name}")
         await move_files_to_subdir(discarded_images, sub_folder_name)
-        await self.delete_images(discarded_images)
+        # The files are moved whatever happens to the index, scans skip the
+        # subfolder so an image left unmarked is not mined again
+        try:
+            await self.delete_images(discarded_images)
+        except Exception as e:
+            print(f"Failed to mark the moved images as deleted: {e}")
         print("Completed")
         print(
             f"Now you can review the images again in {sub_folder_name} and delete them manually."
         )
 
+    @staticmethod
+    def warm_up(embedding_backend: str):
+        """
+        Imports the heavy modules and loads the embedding model ahead of the first scan.
+        """
+        # Imported for its side effect of loading OpenCV and SciPy
+        import brisque  # noqa: F401
+
+        image_analyzer = get_shared_image_analyzer(embedding_backend=embedding_backend)
+        image_analyzer.load_model()
+
     @staticmethod
     async def delete_images(image_paths: list[str]):
-        image_analyzer = ImageAnalyzer()
+        # The shared analyzer reuses the scan's database client without loading a model
+        image_analyzer = get_shared_image_analyzer()
         await image_analyzer.mark_images_as_deleted(image_paths)
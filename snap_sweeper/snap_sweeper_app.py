@@ -20,6 +20,8 @@ class SnapSweeperApp:
         self.loop: asyncio.AbstractEventLoop = asyncio.get_event_loop()
         self.ui_manager: UIManager = UIManager(root)
         self.sweeper: SnapSweeper = SnapSweeper()
+        self.warm_ups_in_progress = 0
+        self.streamed_results = False
 
     def setup_ui(self) -> None:
         self.ui_manager.setup_ui()
@@ -28,11 +30,41 @@ class SnapSweeperApp:
         )
         self.ui_manager.btn_scan.configure(command=self.on_btn_process_clicked)
         self.ui_manager.sweep_button.configure(command=self.on_sweep_clicked)
+        self.ui_manager.settings_widget.embedding_backend.trace_add(
+            "write", self.on_embedding_backend_changed
+        )
 
     def on_image_dir_changed(self, *args: Any) -> None:
+        if self.warm_ups_in_progress:
+            return
         value = self.ui_manager.select_folder_widget.image_dir.get()
         self.ui_manager.btn_scan.configure(state=ctk.NORMAL if value else ctk.DISABLED)
 
+    def on_embedding_backend_changed(self, *args: Any) -> None:
+        self.start_warm_up()
+
+    def start_warm_up(self) -> None:
+        """
+        Loads the model in the background while the window is already usable.
+        """
+        self.warm_ups_in_progress += 1
+        self.ui_manager.start_warming_up()
+        embedding_backend = self.ui_manager.settings_widget.embedding_backend.get()
+        asyncio.run_coroutine_threadsafe(self.warm_up(embedding_backend), self.loop)
+
+    async def warm_up(self, embedding_backend: str) -> None:
+        try:
+            await self.loop.run_in_executor(
+                None, self.sweeper.warm_up, embedding_backend
+            )
+        except Exception as e:
+            # The scan loads the model again and reports the error to the user
+            print(f"Failed to warm up the {embedding_backend} model: {e}")
+        finally:
+            self.warm_ups_in_progress -= 1
+            if not self.warm_ups_in_progress:
+                self.ui_manager.finish_warming_up()
+
     def on_btn_process_clicked(self) -> None:
         self.ui_manager.start_processing()
         asyncio.run_coroutine_threadsafe(self.process_images(), self.loop)
@@ -48,15 +80,32 @@ class SnapSweeperApp:
             settings = self.ui_manager.settings_widget.get_settings()
             print(settings)
             image_dir = self.ui_manager.select_folder_widget.image_dir.get()
+            self.streamed_results = False
             results, discarded_images, error = await self.sweeper.process_images(
-                image_dir, settings
+                image_dir, settings, on_results=self.on_partial_results
+            )
+            # Queued after the partial results, so the sorted results replace them
+            self.root.after(
+                0, self.handle_processing_results, results, discarded_images, error
             )
-            self.handle_processing_results(results, discarded_images, error)
         except Exception as e:
             self.handle_processing_error(e)
         finally:
             self.ui_manager.finish_processing()
 
+    def on_partial_results(self, results) -> None:
+        # Called on the event loop thread, the widgets are updated on the Tk thread
+        self.root.after(0, self.show_partial_results, results)
+
+    def show_partial_results(self, results) -> None:
+        preview_widget = self.ui_manager.preview_widget
+        if self.streamed_results:
+            preview_widget.add_duplicates(results)
+            return
+        self.streamed_results = True
+        preview_widget.set_duplicates(results)
+        preview_widget.pack(side=ctk.TOP, fill=ctk.BOTH, padx=10, pady=10)
+
     def handle_processing_results(self, results, discarded_images, error):
         if error:
             messagebox.showerror("Error", error)
@@ -103,6 +152,7 @@ class SnapSweeperApp:
         if not self.loop.is_running():
             t = threading.Thread(target=self._run_event_loop, daemon=True)
             t.start()
+        self.start_warm_up()
 
     def _run_event_loop(self) -> None:
         asyncio.set_event_loop(self.loop)
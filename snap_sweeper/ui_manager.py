@@ -85,6 +85,15 @@ class UIManager:
 
         self.footer_label.pack(padx=10, pady=10)
 
+    def start_warming_up(self):
+        self.btn_scan.configure(text="Warming up...", state=ctk.DISABLED)
+
+    def finish_warming_up(self):
+        has_image_dir = bool(self.select_folder_widget.image_dir.get())
+        self.btn_scan.configure(
+            text="Scan", state=ctk.NORMAL if has_image_dir else ctk.DISABLED
+        )
+
     def start_processing(self):
         self.btn_scan.configure(state=ctk.DISABLED)
         self.progress_bar.pack(side=ctk.BOTTOM, fill="x", padx=8, pady=8)
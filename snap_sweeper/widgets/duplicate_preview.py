@@ -5,7 +5,10 @@ from typing import Any
 import customtkinter as ctk
 from PIL import Image, ImageOps
 
+from core.duplicate_groups import DuplicateGroup
+
 CHUNK_SIZE = 10  # Number of images to load per chunk
+MIN_DISCARD_THUMBNAIL_SIZE = 96
 LOAD_MORE_BUTTON_TEXT = "Load More"
 
 
@@ -14,7 +17,7 @@ class DuplicatePreviewWidget(ctk.CTkScrollableFrame):
         super().__init__(master)
         self.master = master
         self.master.anchor(ctk.CENTER)
-        self.duplicates = []
+        self.duplicates: list[DuplicateGroup] = []
         self.image_queue = queue.Queue()
         self.current_chunk = 0
         self.total_items = 0
@@ -54,12 +57,6 @@ class DuplicatePreviewWidget(ctk.CTkScrollableFrame):
         similarity_label = ctk.CTkLabel(self, text="Score", font=("Arial", 16, "bold"))
         similarity_label.grid(row=0, column=2, padx=5, pady=(5, 10))
 
-        # Add label to check if user want to keep low quality image
-        keep_low_quality_label = ctk.CTkLabel(
-            self, text="Keep?", font=("Arial", 16, "bold")
-        )
-        keep_low_quality_label.grid(row=0, column=3, padx=5, pady=(5, 10))
-
         self.current_chunk = 0
         self.total_items = len(self.duplicates)
 
@@ -68,71 +65,52 @@ class DuplicatePreviewWidget(ctk.CTkScrollableFrame):
     def on_mouse_wheel(self, event: Any):
         self._parent_canvas.yview_scroll(-1 * event.delta, "units")
 
-    def load_images_in_thread(self, start_index):
-        end_index = min(start_index + CHUNK_SIZE, self.total_items)
+    def load_images_in_thread(self, start_index, end_index=None):
+        end_index = min(end_index or start_index + CHUNK_SIZE, self.total_items)
         for i in range(start_index, end_index):
             duplicate = self.duplicates[i]
             self.add_duplicate_lazy(duplicate, i)
         self.image_queue.put("done")
 
-    def add_duplicate_lazy(
-        self, duplicate: tuple[str, str, float, float, float], i: int
-    ):
-        best_image_path = duplicate[0]
-        worst_image_path = duplicate[1]
-        best_image = Image.open(best_image_path)
-        worst_image = Image.open(worst_image_path)
-        similarity_score = f"{duplicate[4] * 100:.2f}%"
-
-        thumbnail_size = self.custom_thumbnail_size
+    def get_thumbnail_size(self) -> int:
         padding = 10 * 2
-        master = self.master
-        width = master.winfo_width()
-        height = master.winfo_height()
+        width = self.master.winfo_width()
+        height = self.master.winfo_height()
         scrollbar_width = self._scrollbar.winfo_width()
         if width > height:
             thumbnail_size = width // 2 - padding - scrollbar_width
         else:
             thumbnail_size = height // 2 - padding - scrollbar_width
-
-        thumbnail_size = min(thumbnail_size, self.custom_thumbnail_size, 512)
-
-        best_image = ImageOps.exif_transpose(best_image) or best_image
-        worst_image = ImageOps.exif_transpose(worst_image) or worst_image
-
-        best_image.thumbnail((thumbnail_size, thumbnail_size))
-        worst_image.thumbnail((thumbnail_size, thumbnail_size))
-
-        left_image_size = best_image.size
-        right_image_size = worst_image.size
-
-        image_left = ctk.CTkImage(
-            light_image=best_image, dark_image=best_image, size=left_image_size
-        )
-        image_right = ctk.CTkImage(
-            light_image=worst_image, dark_image=worst_image, size=right_image_size
+        return min(thumbnail_size, self.custom_thumbnail_size, 512)
+
+    @staticmethod
+    def load_thumbnail(image_path: str, size: int) -> ctk.CTkImage:
+        image = Image.open(image_path)
+        image = ImageOps.exif_transpose(image) or image
+        image.thumbnail((size, size))
+        return ctk.CTkImage(light_image=image, dark_image=image, size=image.size)
+
+    def add_duplicate_lazy(self, group: DuplicateGroup, i: int):
+        thumbnail_size = self.get_thumbnail_size()
+        keeper_image = self.load_thumbnail(group.keeper, thumbnail_size)
+        # The discards of a group share the width of one thumbnail
+        discard_size = max(
+            thumbnail_size // len(group.discards), MIN_DISCARD_THUMBNAIL_SIZE
         )
+        discard_images = [
+            (discard, self.load_thumbnail(discard, discard_size))
+            for discard in group.discards
+        ]
 
         similarity_label = ctk.CTkLabel(
-            master=self, text=similarity_score, font=("Arial", 16, "bold")
-        )
-        similarity_label.grid(row=i + 1, column=2, padx=5, pady=5)
-
-        keep_low_quality_checkbox = ctk.CTkCheckBox(
             master=self,
-            text="",
-            command=lambda: self.on_keep_low_quality_checkbox_changed(worst_image_path),
-        )
-        keep_low_quality_checkbox.grid(
-            row=i + 1,
-            column=3,
-            padx=5,
-            pady=5,
-            sticky="w",
+            text=f"{group.similarity * 100:.2f}%",
+            font=("Arial", 16, "bold"),
         )
+        similarity_label.grid(row=i + 1, column=2, padx=5, pady=5)
 
         # Put the images into the queue
-        self.image_queue.put((i, image_left, image_right))
+        self.image_queue.put((i, keeper_image, discard_images))
 
     def process_image_queue(self):
         try:
@@ -142,35 +120,88 @@ class DuplicatePreviewWidget(ctk.CTkScrollableFrame):
                     self.add_load_more_button()
                     continue
 
-                i, image_left, image_right = item
+                i, keeper_image, discard_images = item
 
                 self.left_label = ctk.CTkLabel(
-                    master=self, image=image_left, text="", cursor="hand2"
+                    master=self, image=keeper_image, text="", cursor="hand2"
                 )
                 self.left_label.bind(
                     "<Button-1>",
-                    lambda event: self.on_image_clicked(event, image_left),  # type: ignore
+                    lambda event, image=keeper_image: self.on_image_clicked(event, image),  # type: ignore
                 )
                 self.left_label.grid(row=i + 1, column=0, padx=5, pady=5)
 
-                self.right_label = ctk.CTkLabel(
-                    master=self, image=image_right, text="", cursor="hand2"
-                )
-                self.right_label.bind(
-                    "<Button-1>",
-                    lambda event: self.on_image_clicked(event, image_right),  # type: ignore
-                )
-                self.right_label.grid(row=i + 1, column=1, padx=5, pady=5)
+                discards_frame = ctk.CTkFrame(master=self, fg_color="transparent")
+                discards_frame.grid(row=i + 1, column=1, padx=5, pady=5)
+                for column, (discard_path, discard_image) in enumerate(discard_images):
+                    discard_label = ctk.CTkLabel(
+                        master=discards_frame,
+                        image=discard_image,
+                        text="",
+                        cursor="hand2",
+                    )
+                    discard_label.bind(
+                        "<Button-1>",
+                        lambda event, image=discard_image: self.on_image_clicked(event, image),  # type: ignore
+                    )
+                    discard_label.grid(row=0, column=column, padx=2, pady=2)
+
+                    keep_checkbox = ctk.CTkCheckBox(
+                        master=discards_frame,
+                        text="Keep",
+                        command=lambda path=discard_path: self.on_keep_low_quality_checkbox_changed(
+                            path
+                        ),
+                    )
+                    keep_checkbox.grid(row=1, column=column, padx=2, pady=2)
         except queue.Empty:
             pass
         finally:
             # Continue polling the queue
             self.after(100, self.process_image_queue)
 
-    def set_duplicates(self, duplicates: list[tuple[str, str, float, float, float]]):
-        self.duplicates = duplicates
+    def set_duplicates(
+        self,
+        duplicates: list[DuplicateGroup] | list[tuple[str, str, float, float, float]],
+    ):
+        self.duplicates = self.to_groups(duplicates)
         self.setup_ui()
 
+    def add_duplicates(
+        self,
+        duplicates: list[DuplicateGroup] | list[tuple[str, str, float, float, float]],
+    ):
+        """
+        Appends duplicates found while the scan goes on. They fill the chunks already
+        loaded, and the rest waits behind the "Load More" button.
+        """
+        loaded_items = min(self.current_chunk * CHUNK_SIZE, self.total_items)
+        self.duplicates += self.to_groups(duplicates)
+        self.total_items = len(self.duplicates)
+        end_index = min(self.current_chunk * CHUNK_SIZE, self.total_items)
+        if loaded_items < end_index:
+            threading.Thread(
+                target=self.load_images_in_thread,
+                args=(loaded_items, end_index),
+                daemon=True,
+            ).start()
+        else:
+            self.add_load_more_button()
+
+    @staticmethod
+    def to_groups(
+        duplicates: list[DuplicateGroup] | list[tuple[str, str, float, float, float]],
+    ) -> list[DuplicateGroup]:
+        # Pairs are shown as groups of a single discard
+        return [
+            (
+                duplicate
+                if isinstance(duplicate, DuplicateGroup)
+                else DuplicateGroup.from_pair(duplicate)
+            )
+            for duplicate in duplicates
+        ]
+
     def load_next_chunk(self):
         start_index = self.current_chunk * CHUNK_SIZE
         threading.Thread(
@@ -178,7 +209,9 @@ class DuplicatePreviewWidget(ctk.CTkScrollableFrame):
         ).start()
         self.current_chunk += 1
         self.after(100, self.process_image_queue)
-        # Remove the existing "Load More" button
+        self.remove_load_more_button()
+
+    def remove_load_more_button(self):
         for widget in self.winfo_children():
             if (
                 isinstance(widget, ctk.CTkButton)
@@ -189,6 +222,8 @@ class DuplicatePreviewWidget(ctk.CTkScrollableFrame):
     def add_load_more_button(self):
         if self.current_chunk * CHUNK_SIZE >= self.total_items:
             return
+        # Results streamed in during the scan may ask for the button again
+        self.remove_load_more_button()
 
         load_more_button = ctk.CTkButton(
             master=self,
@@ -212,4 +247,7 @@ class DuplicatePreviewWidget(ctk.CTkScrollableFrame):
         self.custom_thumbnail_size = size
 
     def on_keep_low_quality_checkbox_changed(self, worst_image_path: str):
-        self.ignore_delete_images.append(worst_image_path)
+        if worst_image_path in self.ignore_delete_images:
+            self.ignore_delete_images.remove(worst_image_path)
+        else:
+            self.ignore_delete_images.append(worst_image_path)
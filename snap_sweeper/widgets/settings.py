@@ -13,6 +13,12 @@ class SettingsWidget(ctk.CTkFrame):
         self.sub_folder_name = StringVar(value="LOW_QUALITY_IMAGES")
         self.image_thumbnail_size = IntVar(value=512)
         self.include_subdirs = BooleanVar(value=False)
+        self.exclude_patterns = StringVar(value="")
+        self.skip_hidden_dirs = BooleanVar(value=True)
+        self.max_depth = StringVar(value="")
+        self.embedding_backend = StringVar(value="torch")
+        self.perceptual_hash = StringVar(value="off")
+        self.group_duplicates = BooleanVar(value=False)
 
         self.should_move_images.trace_add("write", self.on_dry_run_changed)
         self.setup_ui()
@@ -116,6 +122,88 @@ class SettingsWidget(ctk.CTkFrame):
             row=5, column=1, padx=5, pady=5, sticky="w"
         )
 
+        # excluded folder patterns input and label
+        self.exclude_patterns_label = ctk.CTkLabel(
+            master=self, text="Exclude folders (comma separated):"
+        )
+        self.exclude_patterns_label.grid(row=6, column=1, padx=5, pady=5, sticky="w")
+        self.exclude_patterns_input = ctk.CTkEntry(
+            master=self,
+            textvariable=self.exclude_patterns,
+            width=170,
+        )
+        self.exclude_patterns_input.grid(row=6, column=2, padx=5, pady=5, sticky="w")
+
+        # checkbox to skip hidden folders
+        self.skip_hidden_dirs_checkbox = ctk.CTkCheckBox(
+            master=self,
+            text="",
+            variable=self.skip_hidden_dirs,
+            onvalue=True,
+            offvalue=False,
+        )
+        self.skip_hidden_dirs_checkbox.grid(row=7, column=2, padx=5, pady=5, sticky="w")
+        self.skip_hidden_dirs_checkbox_label = ctk.CTkLabel(
+            master=self, text="Skip hidden folders"
+        )
+        self.skip_hidden_dirs_checkbox_label.grid(
+            row=7, column=1, padx=5, pady=5, sticky="w"
+        )
+
+        # max depth input and label
+        self.max_depth_label = ctk.CTkLabel(
+            master=self, text="Max folder depth (empty for no limit):"
+        )
+        self.max_depth_label.grid(row=8, column=1, padx=5, pady=5, sticky="w")
+        self.max_depth_input = ctk.CTkEntry(
+            master=self,
+            textvariable=self.max_depth,
+            width=170,
+        )
+        self.max_depth_input.grid(row=8, column=2, padx=5, pady=5, sticky="w")
+
+        # embedding backend option menu and label
+        self.embedding_backend_label = ctk.CTkLabel(
+            master=self, text="Embedding backend:"
+        )
+        self.embedding_backend_label.grid(row=9, column=1, padx=5, pady=5, sticky="w")
+        self.embedding_backend_menu = ctk.CTkOptionMenu(
+            master=self,
+            values=["torch", "onnx", "onnx-int8"],
+            variable=self.embedding_backend,
+            width=170,
+        )
+        self.embedding_backend_menu.grid(row=9, column=2, padx=5, pady=5, sticky="w")
+
+        # perceptual hash option menu and label
+        self.perceptual_hash_label = ctk.CTkLabel(master=self, text="Perceptual hash:")
+        self.perceptual_hash_label.grid(row=10, column=1, padx=5, pady=5, sticky="w")
+        self.perceptual_hash_menu = ctk.CTkOptionMenu(
+            master=self,
+            values=["off", "prefilter", "only"],
+            variable=self.perceptual_hash,
+            width=170,
+        )
+        self.perceptual_hash_menu.grid(row=10, column=2, padx=5, pady=5, sticky="w")
+
+        # checkbox to group duplicates
+        self.group_duplicates_checkbox = ctk.CTkCheckBox(
+            master=self,
+            text="",
+            variable=self.group_duplicates,
+            onvalue=True,
+            offvalue=False,
+        )
+        self.group_duplicates_checkbox.grid(
+            row=11, column=2, padx=5, pady=5, sticky="w"
+        )
+        self.group_duplicates_checkbox_label = ctk.CTkLabel(
+            master=self, text="Group duplicates"
+        )
+        self.group_duplicates_checkbox_label.grid(
+            row=11, column=1, padx=5, pady=5, sticky="w"
+        )
+
     def on_threshold_changed(self, *args) -> None:
         self.threshold_value_label.configure(text=f"{self.threshold.get():.1f}%")
 
@@ -137,7 +225,21 @@ class SettingsWidget(ctk.CTkFrame):
             "sub_folder_name": self.sub_folder_name.get(),
             "thumbnail_size": self.image_thumbnail_size.get(),
             "include_subdirs": self.include_subdirs.get(),
+            "exclude_patterns": [
+                pattern.strip()
+                for pattern in self.exclude_patterns.get().split(",")
+                if pattern.strip()
+            ],
+            "skip_hidden_dirs": self.skip_hidden_dirs.get(),
+            "max_depth": self.get_max_depth(),
+            "embedding_backend": self.embedding_backend.get(),
+            "perceptual_hash": self.perceptual_hash.get(),
+            "group_duplicates": self.group_duplicates.get(),
         }
 
+    def get_max_depth(self) -> int | None:
+        value = self.max_depth.get().strip()
+        return int(value) if value.isdigit() else None
+
     def set_thumbnail_size(self, size: int):
         self.image_thumbnail_size.set(size)
@@ -1,38 +1,114 @@
 import sys
+from core.batch_sizer import parse_memory_size
 from core.error_handling import global_exception_handler
-from core.find_and_move_similar_images import (
-    find_and_move_similar_images,
-)
 
 sys.excepthook = global_exception_handler
 
 
+def print_pair_results(results):
+    for best_path, worst_path, _best_score, _worst_score, similarity in results:
+        print(
+            f"Keep {best_path}, discard {worst_path} ({similarity * 100:.2f}% similar)"
+        )
+
+
 async def main(args):
     import time
 
+    # Imported here so that --help and argument errors do not load the image stack
+    from core.find_and_move_similar_images import find_and_move_similar_images
+
     start_time = time.time()
     img_folder = args.dir
     limit = args.limit
     top_k = args.top_k
     threshold = args.threshold
     dry_run = args.dry_run
+    verify_hashes = args.verify_hashes
+    hash_workers = args.hash_workers
+    sub_folder_name = args.sub_folder_name
+    exclude_patterns = args.exclude
+    skip_hidden_dirs = not args.include_hidden
+    max_depth = args.max_depth
+    pipelined = args.pipelined
+    embed_workers = args.embed_workers
+    score_workers = args.score_workers
+    queue_size = args.queue_size
+    decode_workers = args.decode_workers
+    embedding_backend = args.embedding_backend
+    batch_size = args.batch_size
+    max_memory = args.max_memory
+    embedding_precision = args.embedding_precision
+    perceptual_hash = args.perceptual_hash
+    perceptual_distance = args.perceptual_distance
+    mining = args.mining
+    ann_ef = args.ann_ef
+    ann_recall_sample = args.ann_recall_sample
+    pca_margin = args.pca_margin
+    mining_workers = args.mining_workers
+    group_duplicates = args.group
+    max_group_diameter = args.max_group_diameter
+    incremental_mining = not args.full_mining
+    neighbour_graph = not args.no_neighbour_graph
+
+    if args.check_backend_parity:
+        from core.embedding_backends import check_backend_parity
+        from core.utils import get_image_files
+
+        check_backend_parity(await get_image_files(img_folder), embedding_backend)
+        return
 
     if dry_run:
         print("Dry run mode enabled. No images will be moved.")
 
-    await find_and_move_similar_images(
+    results, _discarded_images, _error = await find_and_move_similar_images(
         img_folder,
         limit=limit,
         top_k=top_k,
         threshold=threshold,
         dry_run=dry_run,
+        sub_folder_name=sub_folder_name,
+        verify_hashes=verify_hashes,
+        hash_workers=hash_workers,
+        exclude_patterns=exclude_patterns,
+        skip_hidden_dirs=skip_hidden_dirs,
+        max_depth=max_depth,
+        pipelined=pipelined,
+        embed_workers=embed_workers,
+        score_workers=score_workers,
+        queue_size=queue_size,
+        decode_workers=decode_workers,
+        embedding_backend=embedding_backend,
+        batch_size=batch_size,
+        max_memory=max_memory,
+        embedding_precision=embedding_precision,
+        perceptual_hash=perceptual_hash,
+        perceptual_distance=perceptual_distance,
+        mining=mining,
+        ann_ef=ann_ef,
+        ann_recall_sample=ann_recall_sample,
+        pca_margin=pca_margin,
+        mining_workers=mining_workers,
+        group_duplicates=group_duplicates,
+        max_group_diameter=max_group_diameter,
+        incremental_mining=incremental_mining,
+        neighbour_graph=neighbour_graph,
+        # Pairs are printed as soon as they are scored, while mining goes on
+        on_results=None if group_duplicates else print_pair_results,
     )
+    if group_duplicates and results:
+        for group in results:
+            print(f"Keep {group.keeper} ({group.similarity * 100:.2f}% similar):")
+            for discard in group.discards:
+                print(f"    discard {discard}")
     print(f"Total time: {(time.time() - start_time):.2f} seconds")
 
 
 def parse_args():
     import argparse
 
+    from core.perceptual_hash import DEFAULT_MAX_DISTANCE
+
     parser = argparse.ArgumentParser(
         description="Find and compare duplicate images based on sharpness, color, and layout."
     )
@@ -66,11 +142,175 @@ def parse_args():
         action="store_true",
         help="Dry run mode. Only prints the results without moving the images.",
     )
+    parser.add_argument(
+        "--sub-folder-name",
+        type=str,
+        default="DISCARDED",
+        help="Sub-folder the low quality images are moved to. It is never scanned. Default is DISCARDED.",
+    )
+    parser.add_argument(
+        "--exclude",
+        type=str,
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="Glob pattern of directory names or relative paths to skip. Can be repeated.",
+    )
+    parser.add_argument(
+        "--include-hidden",
+        action="store_true",
+        help="Also scan hidden directories (names starting with a dot).",
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        default=None,
+        help="Maximum depth of subdirectories to scan. Default is no limit.",
+    )
+    parser.add_argument(
+        "--verify-hashes",
+        action="store_true",
+        help="Re-read every file to verify its hash instead of trusting the hash cache.",
+    )
+    parser.add_argument(
+        "--hash-workers",
+        type=int,
+        default=None,
+        help="Number of threads used to hash files. Default is twice the CPU count.",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="Overlap scanning, hashing and embedding instead of running them one after the other.",
+    )
+    parser.add_argument(
+        "--embed-workers",
+        type=int,
+        default=1,
+        help="Number of embedding batches processed concurrently in pipelined mode. Default is 1.",
+    )
+    parser.add_argument(
+        "--score-workers",
+        type=int,
+        default=None,
+        help="Maximum number of concurrent quality comparisons. Default is twice the CPU count.",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=1024,
+        help="Capacity of the queues between pipeline stages. Default is 1024.",
+    )
+    parser.add_argument(
+        "--decode-workers",
+        type=int,
+        default=None,
+        help="Number of processes decoding images for embedding. Default is the CPU count.",
+    )
+    parser.add_argument(
+        "--embedding-backend",
+        type=str,
+        choices=["torch", "onnx", "onnx-int8"],
+        default="torch",
+        help="Image encoder used to create embeddings. Default is torch.",
+    )
+    parser.add_argument(
+        "--check-backend-parity",
+        action="store_true",
+        help="Compare the embeddings of --embedding-backend with torch on sample images of --dir and exit.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help="Fixed number of images per embedding batch. Default is to size batches from --max-memory.",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=parse_memory_size,
+        default=None,
+        help="Memory budget used to size embedding batches, e.g. 4G or 512M. Default is half of the system memory.",
+    )
+    parser.add_argument(
+        "--embedding-precision",
+        type=str,
+        choices=["float32", "float16", "int8"],
+        default="float16",
+        help="Precision of the memory-mapped embedding matrix read by mining. Default is float16.",
+    )
+    parser.add_argument(
+        "--perceptual-hash",
+        type=str,
+        choices=["off", "prefilter", "only"],
+        default="off",
+        help="Pair resaved and resized copies by perceptual hash before CLIP (prefilter), or instead of CLIP (only). Default is off.",
+    )
+    parser.add_argument(
+        "--perceptual-distance",
+        type=int,
+        default=DEFAULT_MAX_DISTANCE,
+        help=f"Maximum Hamming distance between the 64-bit perceptual hashes of near duplicates. Default is {DEFAULT_MAX_DISTANCE}.",
+    )
+    parser.add_argument(
+        "--mining",
+        type=str,
+        choices=["exact", "ann", "pca"],
+        default="exact",
+        help="Compare every pair of embeddings (exact), query an HNSW index for nearest neighbours (ann), near-linear for very large libraries, or mine PCA-reduced embeddings for candidates re-ranked at full precision (pca). Default is exact.",
+    )
+    parser.add_argument(
+        "--ann-ef",
+        type=int,
+        default=50,
+        help="HNSW search breadth in ann mining, higher is slower with better recall. Default is 50.",
+    )
+    parser.add_argument(
+        "--ann-recall-sample",
+        type=int,
+        default=0,
+        help="Number of images whose ann or pca pairs are checked against exact mining to report the recall. Default is 0 (no report).",
+    )
+    parser.add_argument(
+        "--pca-margin",
+        type=float,
+        default=0.1,
+        help="How far below the threshold candidates are searched in pca mining, larger is slower with better recall. Default is 0.1.",
+    )
+    parser.add_argument(
+        "--mining-workers",
+        type=int,
+        default=None,
+        help="Number of processes sharing exact mining of libraries of 20000 images or more. Default is the CPU count.",
+    )
+    parser.add_argument(
+        "--group",
+        action="store_true",
+        help="Collapse near duplicate pairs into groups, score each image once and keep the best image of each group.",
+    )
+    parser.add_argument(
+        "--max-group-diameter",
+        type=int,
+        default=None,
+        help="Maximum number of pairs between two images of a group with --group, splits chains of gradually changing images. Default is no limit.",
+    )
+    parser.add_argument(
+        "--full-mining",
+        action="store_true",
+        help="Mine every pair of images again instead of only the images added since the previous run.",
+    )
+    parser.add_argument(
+        "--no-neighbour-graph",
+        action="store_true",
+        help="Mine with the given threshold and top k only, instead of caching a neighbour graph of the images that stricter scans of the same images filter without mining.",
+    )
 
     return parser.parse_args()
 
 
 if __name__ == "__main__":
+    import multiprocessing
+
+    multiprocessing.freeze_support()
     args = parse_args()
     import asyncio
 
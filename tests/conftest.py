@@ -0,0 +1,12 @@
+import pytest
+
+from core import image_analyzer as image_analyzer_module
+from core.image_analyzer import ImageAnalyzer
+
+
+@pytest.fixture
+def image_analyzer(tmp_path, monkeypatch):
+    # The database is created in the working directory outside production
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(image_analyzer_module, "_chroma_client", None)
+    return ImageAnalyzer()
@@ -0,0 +1,36 @@
+import asyncio
+
+from core import exact_duplicates
+from core.exact_duplicates import find_exact_duplicates
+from core.file_hasher import hash_file_head_tail
+from core.hash_cache import HashCache
+
+
+def test_cached_files_are_not_partially_read_again(tmp_path, monkeypatch):
+    contents = {"a.jpg": b"same", "b.jpg": b"same", "c.jpg": b"diff"}
+    paths = []
+    for name, content in contents.items():
+        (tmp_path / name).write_bytes(content)
+        paths.append(str(tmp_path / name))
+    partially_read = []
+
+    def _hash_file_head_tail(file_path: str) -> str:
+        partially_read.append(file_path)
+        return hash_file_head_tail(file_path)
+
+    monkeypatch.setattr(exact_duplicates, "hash_file_head_tail", _hash_file_head_tail)
+    hash_cache = HashCache(str(tmp_path / "hashes.sqlite3"))
+    try:
+        groups, _ = asyncio.run(find_exact_duplicates(paths, hash_cache=hash_cache))
+        assert groups == [paths[:2]]
+        assert len(partially_read) == 3
+
+        # A new copy of the same size is compared with the cached files by full hash
+        (tmp_path / "d.jpg").write_bytes(b"same")
+        paths.append(str(tmp_path / "d.jpg"))
+        partially_read.clear()
+        groups, _ = asyncio.run(find_exact_duplicates(paths, hash_cache=hash_cache))
+        assert groups == [[paths[0], paths[1], paths[3]]]
+        assert partially_read == []
+    finally:
+        hash_cache.close()
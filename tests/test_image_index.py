@@ -0,0 +1,24 @@
+from core.image_analyzer import ImageAnalyzer
+
+
+def test_each_embedding_backend_embeds_the_images_again(image_analyzer: ImageAnalyzer):
+    path_to_hash_map = {"image.jpg": "hash"}
+    image_analyzer.collection.add(
+        ids=["hash"],
+        embeddings=[[1.0, 0.0]],
+        metadatas=[{"path": "image.jpg", "deleted": False}],
+    )
+    image_analyzer.embedding_store.add(["hash"], [[1.0, 0.0]])
+    image_analyzer._import_manifest()
+    image_analyzer.manifest.record_embedded(path_to_hash_map)
+    assert image_analyzer.manifest.diff(path_to_hash_map) == ([], {})
+
+    # The vectors of the torch model are not reused for the ONNX model
+    image_analyzer.configure(embedding_backend="onnx-int8")
+    assert image_analyzer.collection.count() == 0
+    assert image_analyzer.embedding_store.lookup_rows(["hash"]) == {}
+    assert image_analyzer.manifest.diff(path_to_hash_map) == (["image.jpg"], {})
+
+    image_analyzer.configure(embedding_backend="torch")
+    assert image_analyzer.collection.count() == 1
+    assert image_analyzer.embedding_store.lookup_rows(["hash"]) == {"hash": 0}
@@ -0,0 +1,182 @@
+import numpy as np
+
+from core.image_analyzer import ImageAnalyzer
+
+
+def make_embeddings(size: int, dim: int = 8, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    embeddings = rng.standard_normal((size, dim)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def brute_force_pairs(
+    embeddings: np.ndarray, threshold: float, query_count: int | None = None
+) -> set[tuple[int, int]]:
+    scores = embeddings @ embeddings.T
+    query_count = len(embeddings) if query_count is None else query_count
+    return {
+        (i, j)
+        for i in range(query_count)
+        for j in range(i + 1, len(embeddings))
+        if scores[i, j] >= threshold
+    }
+
+
+def test_single_query_row_has_no_self_pair():
+    embeddings = make_embeddings(15)
+    _, i, j = ImageAnalyzer.mine_pair_indices(
+        embeddings, top_k=2, similarity_threshold=0.5, query_count=1
+    )
+    assert np.all(i < j)
+
+
+def test_non_dividing_chunk_sizes_match_brute_force():
+    embeddings = make_embeddings(15)
+    _, i, j = ImageAnalyzer.mine_pair_indices(
+        embeddings,
+        top_k=len(embeddings),
+        similarity_threshold=-1.0,
+        query_chunk_size=3,
+        corpus_chunk_size=7,
+    )
+    assert np.all(i < j)
+    assert set(zip(i.tolist(), j.tolist())) == brute_force_pairs(embeddings, -1.0)
+
+
+def test_query_count_matches_brute_force():
+    embeddings = make_embeddings(15)
+    _, i, j = ImageAnalyzer.mine_pair_indices(
+        embeddings,
+        top_k=len(embeddings),
+        similarity_threshold=-1.0,
+        query_chunk_size=3,
+        corpus_chunk_size=7,
+        query_count=4,
+    )
+    assert set(zip(i.tolist(), j.tolist())) == brute_force_pairs(
+        embeddings, -1.0, query_count=4
+    )
+
+
+def test_parallel_mining_keeps_top_k_per_row():
+    from core.parallel_mining import mine_pair_indices_parallel
+
+    rng = np.random.default_rng(1)
+    centers = rng.standard_normal((30, 16)).astype(np.float32)
+    embeddings = centers[rng.integers(0, 30, 300)] + 0.3 * rng.standard_normal(
+        (300, 16)
+    ).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    options = dict(top_k=3, similarity_threshold=0.5, max_pairs=None)
+
+    _, i, j = ImageAnalyzer.mine_pair_indices(embeddings, **options)
+    serial_pairs = set(zip(i.tolist(), j.tolist()))
+    for workers, stripe_size in [(2, None), (3, 7)]:
+        _, i, j = mine_pair_indices_parallel(
+            embeddings, workers=workers, stripe_size=stripe_size, **options
+        )
+        assert set(zip(i.tolist(), j.tolist())) == serial_pairs
+
+
+def make_clustered_embeddings(size: int = 1000, clusters: int = 100) -> np.ndarray:
+    rng = np.random.default_rng(1)
+    centers = rng.standard_normal((clusters, 32)).astype(np.float32)
+    embeddings = centers[rng.integers(0, clusters, size)] + 0.3 * rng.standard_normal(
+        (size, 32)
+    ).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def test_approximate_modes_count_top_k_like_exact_mining():
+    embeddings = make_clustered_embeddings()
+    for top_k in (2, 3, 10):
+        options = dict(top_k=top_k, similarity_threshold=0.5, max_pairs=None)
+        _, i, j = ImageAnalyzer.mine_pairs(embeddings, **options)
+        exact_pairs = set(zip(i.tolist(), j.tolist()))
+        assert (
+            ImageAnalyzer.measure_ann_recall(
+                embeddings, i, j, top_k=top_k, similarity_threshold=0.5
+            )
+            == 1.0
+        )
+        for mining in ("ann", "pca"):
+            _, i, j = ImageAnalyzer.mine_pairs(
+                embeddings, mining=mining, ann_ef=200, **options
+            )
+            assert set(zip(i.tolist(), j.tolist())) == exact_pairs
+
+
+def make_burst_embeddings() -> np.ndarray:
+    # A burst of 60 shots of one scene, larger than the top k of the graph
+    rng = np.random.default_rng(2)
+    scene, other_scene = rng.standard_normal((2, 16)).astype(np.float32)
+    embeddings = np.concatenate(
+        [
+            scene + 0.15 * rng.standard_normal((60, 16)).astype(np.float32),
+            other_scene + 0.15 * rng.standard_normal((5, 16)).astype(np.float32),
+            rng.standard_normal((30, 16)).astype(np.float32),
+        ]
+    )[rng.permutation(95)]
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def filtered_pairs(pairs: np.ndarray, top_k: int, threshold: float) -> set:
+    from core.neighbour_graph import filter_graph_pairs
+
+    kept = filter_graph_pairs(pairs, top_k, threshold)
+    return set(zip(kept["id1"].tolist(), kept["id2"].tolist()))
+
+
+def test_graph_filter_matches_exact_mining_in_bursts():
+    from core.image_analyzer import concatenate_pairs
+
+    embeddings = make_burst_embeddings()
+    hashes = [str(row) for row in range(len(embeddings))]
+    graph_pairs = concatenate_pairs(
+        list(
+            ImageAnalyzer.iter_row_pairs(
+                embeddings,
+                hashes,
+                top_k=32,
+                similarity_threshold=0.8,
+                neighbour_lists=True,
+            )
+        )
+    )
+    for top_k, threshold in [(2, 0.8), (5, 0.9), (32, 0.8)]:
+        _, i, j = ImageAnalyzer.mine_pairs(
+            embeddings, top_k=top_k, similarity_threshold=threshold, max_pairs=None
+        )
+        assert filtered_pairs(graph_pairs, top_k, threshold) == set(
+            zip(i.tolist(), j.tolist())
+        )
+
+
+def test_incremental_neighbour_lists_match_exact_mining(tmp_path):
+    from core.embedding_store import EmbeddingMatrix
+    from core.pair_store import PairStore
+
+    embeddings = make_burst_embeddings()
+    hashes = [str(row) for row in range(len(embeddings))]
+    db_path = str(tmp_path / "pairs.sqlite3")
+    # A first run, a run with new images, then a run with removed images
+    for rows in (np.arange(70), np.arange(95), np.arange(3, 95)):
+        with PairStore(
+            "library", "settings", db_path=db_path, neighbour_lists=True
+        ) as pair_store:
+            blocks = ImageAnalyzer.iter_row_pairs(
+                EmbeddingMatrix(embeddings, None, rows),
+                [hashes[row] for row in rows],
+                pair_store,
+                top_k=32,
+                similarity_threshold=0.8,
+                neighbour_lists=True,
+            )
+            # Each block holds whole neighbour lists, and is filtered on its own
+            streamed_pairs = set().union(
+                *(filtered_pairs(block, 5, 0.9) for block in blocks)
+            )
+        _, i, j = ImageAnalyzer.mine_pairs(
+            embeddings[rows], top_k=5, similarity_threshold=0.9, max_pairs=None
+        )
+        assert streamed_pairs == set(zip(i.tolist(), j.tolist()))
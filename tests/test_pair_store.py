@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from core.pair_store import PairStore
+
+
+def test_library_hashes_keep_pairs_of_images_left_out(tmp_path):
+    db_path = str(tmp_path / "pairs.sqlite3")
+    with PairStore("library", "settings", db_path=db_path) as pair_store:
+        assert pair_store.sync(["a", "b", "c"]) == ["a", "b", "c"]
+        pair_store.add(["a", "b", "c"], [(0.95, "a", "b"), (0.9, "b", "c")])
+
+    # A run that mines a subset of the library keeps the pairs of the others
+    with PairStore(
+        "library", "settings", library_hashes=["a", "b", "c"], db_path=db_path
+    ) as pair_store:
+        assert pair_store.sync(["a", "c"]) == []
+        assert len(pair_store.pairs()) == 2
+
+    # Without the library hashes, the images not mined are forgotten
+    with PairStore("library", "settings", db_path=db_path) as pair_store:
+        assert pair_store.sync(["a", "c"]) == []
+        assert pair_store.pairs() == []
+
+
+def test_self_pairs_are_rejected(tmp_path):
+    with PairStore(
+        "library", "settings", db_path=str(tmp_path / "pairs.sqlite3")
+    ) as pair_store:
+        with pytest.raises(ValueError):
+            pair_store.add(["a", "b"], [(0.9, "a", "b"), (1.0, "a", "a")])
+        assert pair_store.pairs() == []
+
+
+def test_incremental_mining_stores_pairs_beyond_max_pairs(tmp_path):
+    from core.embedding_store import EmbeddingMatrix
+    from core.image_analyzer import ImageAnalyzer
+
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((20, 8)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    hashes = [str(row) for row in range(len(embeddings))]
+    options = dict(top_k=20, similarity_threshold=-1.0)
+    with PairStore(
+        "library", "settings", db_path=str(tmp_path / "pairs.sqlite3")
+    ) as pair_store:
+        pairs = ImageAnalyzer.mine_pairs_incrementally(
+            EmbeddingMatrix(embeddings, None, np.arange(len(embeddings))),
+            hashes,
+            pair_store,
+            max_pairs=10,
+            **options,
+        )
+    assert len(pairs) == len(embeddings) * (len(embeddings) - 1) // 2
@@ -0,0 +1,42 @@
+import asyncio
+import shutil
+
+from core.image_analyzer import ImageAnalyzer
+
+
+def index_files(image_analyzer: ImageAnalyzer, path_to_hash_map: dict[str, str]):
+    image_hashes = list(dict.fromkeys(path_to_hash_map.values()))
+    image_analyzer.collection.add(
+        ids=image_hashes,
+        embeddings=[[1.0, float(index)] for index in range(len(image_hashes))],
+        metadatas=[
+            {"path": image_hash, "deleted": False} for image_hash in image_hashes
+        ],
+    )
+    image_analyzer._import_manifest()
+    image_analyzer.manifest.record_embedded(path_to_hash_map)
+    image_analyzer.manifest.diff(path_to_hash_map)
+
+
+def test_sweeping_identical_copies_keeps_the_kept_copy(image_analyzer, tmp_path):
+    paths = []
+    for name in ("keep.jpg", "copy1.jpg", "copy2.jpg", "other.jpg"):
+        path = tmp_path / name
+        path.write_bytes(b"other" if name == "other.jpg" else b"same")
+        paths.append(str(path))
+    discards = paths[1:]
+    index_files(
+        image_analyzer,
+        {path: "other" if path.endswith("other.jpg") else "same" for path in paths},
+    )
+
+    # Discarded files are moved before they are marked
+    (tmp_path / "DISCARDED").mkdir()
+    for path in discards:
+        shutil.move(path, tmp_path / "DISCARDED")
+    asyncio.run(image_analyzer.mark_images_as_deleted(discards))
+
+    assert list(image_analyzer.manifest.active_images(["same", "other"])) == ["same"]
+    metadatas = image_analyzer.collection.get(ids=["same", "other"])["metadatas"]
+    deleted = {metadata["path"]: metadata["deleted"] for metadata in metadatas}
+    assert deleted == {"same": False, "other": True}